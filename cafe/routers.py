@@ -0,0 +1,87 @@
+"""
+Routes the reads of designated report views to the read-only 'reports'
+database (see REPORTS_DATABASE in cafe/settings.py).
+
+Views opt in with @report_view. While such a view runs (and while a
+streamed export it returned is being sent), reads go to 'reports', so long
+report queries don't hold locks on the connection sale entry and payments
+write through. Everything else, and every write, stays on 'default'. So
+does the database cache: a snapshot would only see cache entries as old
+as the snapshot.
+"""
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.http import FileResponse
+
+REPORTS_DB_ALIAS = 'reports'
+# app_label of the model Django's DatabaseCache queries through
+CACHE_APP_LABEL = 'django_cache'
+
+_reporting = ContextVar('reporting', default=False)
+
+
+def reports_enabled():
+    return getattr(settings, 'REPORTS_DATABASE', 'off') != 'off' and REPORTS_DB_ALIAS in settings.DATABASES
+
+
+def _iter_reporting(content):
+    # Streaming responses run their queries after the view has returned
+    iterator = iter(content)
+    while True:
+        token = _reporting.set(True)
+        try:
+            chunk = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            _reporting.reset(token)
+        yield chunk
+
+
+def report_view(view):
+    """
+    Mark a read-only view whose queries should run on the reports database.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        token = _reporting.set(True)
+        try:
+            response = view(request, *args, **kwargs)
+        finally:
+            _reporting.reset(token)
+        # FileResponse bodies (PDF and XLSX exports) are already built by the view
+        if getattr(response, 'streaming', False) and not isinstance(response, FileResponse):
+            response.streaming_content = _iter_reporting(response.streaming_content)
+        return response
+    return wrapper
+
+
+class ReportRouter:
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label == CACHE_APP_LABEL:
+            return None
+        if _reporting.get() and reports_enabled():
+            return REPORTS_DB_ALIAS
+        return None
+
+    def db_for_write(self, model, **hints):
+        # An object loaded inside a report view remembers 'reports'; saving it must not go there
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db == REPORTS_DB_ALIAS:
+            return DEFAULT_DB_ALIAS
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases hold the same data
+        if {obj1._state.db, obj2._state.db} <= {DEFAULT_DB_ALIAS, REPORTS_DB_ALIAS}:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == REPORTS_DB_ALIAS:
+            return False
+        return None
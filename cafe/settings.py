@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -19,11 +20,15 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.0/howto/deployment/checklist/
 
+# Production profile: DJANGO_PRODUCTION=1 turns DEBUG off and switches the
+# database to the tuned SQLite backend below.
+PRODUCTION = os.environ.get('DJANGO_PRODUCTION') == '1'
+
 # SECURITY WARNING: keep the secret key used in production secret!
-SECRET_KEY = 'django-insecure-bvo+q&+fz*&!n4)!)#%+z5ine_$-8_h*2*td^*4-#jm30s(j0k'
+SECRET_KEY = os.environ.get('DJANGO_SECRET_KEY', 'django-insecure-bvo+q&+fz*&!n4)!)#%+z5ine_$-8_h*2*td^*4-#jm30s(j0k')
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+DEBUG = os.environ.get('DJANGO_DEBUG', '0' if PRODUCTION else '1') == '1'
 
 ALLOWED_HOSTS = ["*"]
 
@@ -49,6 +54,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Outermost, so its timings cover the rest of the stack
+    'panel.middleware.PerfMiddleware',
+    'panel.middleware.QueryLogMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -56,6 +64,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'panel.middleware.ProfilerMiddleware',
 ]
 
 ROOT_URLCONF = 'cafe.urls'
@@ -85,10 +94,50 @@ WSGI_APPLICATION = 'cafe.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': os.environ.get('DJANGO_DB_PATH', BASE_DIR / 'db.sqlite3'),
     }
 }
 
+if PRODUCTION:
+    # cafe/sqlite: WAL, synchronous=NORMAL, busy timeout, mmap and page cache
+    # pragmas on connect, and BEGIN IMMEDIATE for atomic blocks, so concurrent
+    # sale entry queues for the write lock instead of failing with
+    # "database is locked". Connections are kept for CONN_MAX_AGE seconds.
+    DATABASES['default'].update({
+        'ENGINE': 'cafe.sqlite',
+        'CONN_MAX_AGE': int(os.environ.get('DJANGO_CONN_MAX_AGE', 600)),
+        'CONN_HEALTH_CHECKS': True,
+        'PRAGMAS': {
+            'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000)),
+        },
+        'TRANSACTION_MODE': 'IMMEDIATE',
+    })
+
+# Read-only connection for views marked with cafe.routers.report_view:
+#   'readonly' - the live database opened with mode=ro (default in production;
+#                with WAL the long reads never block writers)
+#   a path     - a snapshot file kept fresh by `manage.py refresh_reports_snapshot`
+#   'off'      - report views read from 'default' like everything else
+REPORTS_DATABASE = os.environ.get('DJANGO_REPORTS_DB', 'readonly' if PRODUCTION else 'off')
+if REPORTS_DATABASE != 'off':
+    _reports_file = DATABASES['default']['NAME'] if REPORTS_DATABASE == 'readonly' else REPORTS_DATABASE
+    DATABASES['reports'] = {
+        'ENGINE': 'cafe.sqlite',
+        'NAME': Path(_reports_file).resolve().as_uri() + '?mode=ro',
+        'OPTIONS': {'uri': True},
+        'CONN_MAX_AGE': DATABASES['default'].get('CONN_MAX_AGE', 0),
+        'CONN_HEALTH_CHECKS': True,
+        # A read-only connection can't change the journal mode or take a write lock
+        'PRAGMAS': {'journal_mode': None, 'synchronous': None, 'query_only': 'ON'},
+        'TRANSACTION_MODE': None,
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['cafe.routers.ReportRouter']
+
+# Where `manage.py backup_db` writes its snapshots
+BACKUP_DIR = Path(os.environ.get('DJANGO_BACKUP_DIR', BASE_DIR / 'backups'))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -163,3 +212,80 @@ PWA_APP_ICONS = [
 ]
 PWA_APP_DIR = 'ltr'
 PWA_APP_LANG = 'en-US'
+
+# TTF used by the ReportLab table PDFs (panel/pdf_utils.py); must contain Arabic glyphs.
+# When unset, DejaVu Sans is used if installed.
+PDF_FONT_PATH = None
+
+# Invoice numbers each process reserves at once from the counter table (panel/numbering.py).
+# Larger blocks mean fewer writes but bigger gaps when a process restarts.
+INVOICE_NUMBER_BLOCK_SIZE = 20
+
+# Firebase Cloud Messaging (panel/fcm_utils.py). FCM_ENDPOINT may point at a local stub
+# server for testing; {project_id} is filled in from FCM_PROJECT_ID.
+FCM_SERVICE_ACCOUNT_FILE = os.environ.get('FCM_SERVICE_ACCOUNT_FILE', '/home/mazin/projects/maha/firebase_service_account.json')
+FCM_PROJECT_ID = os.environ.get('FCM_PROJECT_ID', 'alsinary-973fa')
+FCM_ENDPOINT = os.environ.get('FCM_ENDPOINT', 'https://fcm.googleapis.com/v1/projects/{project_id}/messages:send')
+FCM_MAX_WORKERS = 8
+FCM_MAX_RETRIES = 3
+FCM_TIMEOUT = 10
+FCM_MAX_RETRY_DELAY = 30  # cap on Retry-After, seconds
+
+# Staff alerts queued in the notification outbox (panel/notifications.py)
+LOW_STOCK_THRESHOLD = 10
+LARGE_PAYMENT_THRESHOLD = 1000000  # SDG
+
+# Shared by every worker process, so the cash-flow projection cache
+# (finance/cashflow_utils.py) and the profiling rate limit see the same
+# entries. The table is created by finance migration 0007.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'django_cache',
+    }
+}
+
+# Per-view request stats (panel/perf.py): staff page at /perf/, Prometheus text at /perf/metrics/.
+# Each worker process flushes its stats to PERF_STATS_DIR every PERF_FLUSH_INTERVAL seconds.
+PERF_ENABLED = os.environ.get('DJANGO_PERF', '1') == '1'
+PERF_STATS_DIR = Path(os.environ.get('DJANGO_PERF_DIR', BASE_DIR / 'perf'))
+PERF_FLUSH_INTERVAL = 60
+PERF_MAX_VIEWS = 300
+PERF_SAMPLES = 512  # latency samples kept per view for percentiles
+PERF_METRICS_TOKEN = os.environ.get('PERF_METRICS_TOKEN', '')
+
+# Repeated (N+1) and slow query log (panel/querylog.py), rotated at 5 MB.
+# Off unless DJANGO_QUERY_LOG=1: it inspects every query of every request.
+QUERY_LOG_ENABLED = os.environ.get('DJANGO_QUERY_LOG', '0') == '1'
+QUERY_LOG_FILE = Path(os.environ.get('DJANGO_QUERY_LOG_FILE', BASE_DIR / 'logs' / 'queries.log'))
+DUPLICATE_QUERY_THRESHOLD = 5  # same query more than this many times in one request
+SLOW_QUERY_MS = 100
+
+# On-demand profiling of staff requests (?_profile=cprofile|sample), listed at /profiles/
+PROFILE_DIR = Path(os.environ.get('DJANGO_PROFILE_DIR', BASE_DIR / 'profiles'))
+PROFILE_APPS = ('panel', 'finance')
+PROFILE_RATE_LIMIT = 5  # profiles per user per minute
+PROFILE_SAMPLE_INTERVAL = 0.005  # seconds between stack samples
+PROFILE_KEEP = 50
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'timestamped': {'format': '%(asctime)s %(levelname)s %(message)s'},
+    },
+    'handlers': {
+        'query_log': {
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': QUERY_LOG_FILE,
+            'maxBytes': 5 * 1024 * 1024,
+            'backupCount': 5,
+            'encoding': 'utf-8',
+            'delay': True,
+            'formatter': 'timestamped',
+        },
+    },
+    'loggers': {
+        'panel.querylog': {'handlers': ['query_log'], 'level': 'WARNING', 'propagate': False},
+    },
+}
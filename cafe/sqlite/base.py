@@ -0,0 +1,39 @@
+"""
+SQLite backend for the production profile (see DATABASES in cafe/settings.py).
+
+On top of Django's backend it
+- applies PRAGMAS from the database settings on every new connection
+  (WAL journal, synchronous=NORMAL, busy timeout, mmap, page cache), and
+- starts atomic blocks with BEGIN IMMEDIATE, so a transaction that will
+  write takes the write lock up front and waits for it (busy_timeout)
+  instead of failing with "database is locked" when it upgrades a read
+  lock half-way through.
+"""
+from django.db.backends.sqlite3 import base
+
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,  # ms
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -20000,  # KiB
+    'temp_store': 'MEMORY',
+}
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    @property
+    def pragmas(self):
+        return {**DEFAULT_PRAGMAS, **self.settings_dict.get('PRAGMAS', {})}
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.pragmas.items():
+            if value is not None:
+                conn.execute(f"PRAGMA {name} = {value}")
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        mode = self.settings_dict.get('TRANSACTION_MODE', 'IMMEDIATE')
+        self.cursor().execute(f"BEGIN {mode}" if mode else "BEGIN")
@@ -0,0 +1,207 @@
+"""
+Company balances per currency.
+
+The ledger is every row that moves company money: currency exchanges,
+partner deposits and withdrawals, invoice payments, shipment costs,
+expenses and commission payments (SDG) and supplier payments (USD).
+LEDGER_ENTRIES defines it once; calculate_company_balances() sums it in
+one query generated from it. CurrencyBalance keeps the same totals up to
+date as those rows are saved and deleted (see finance/signals.py), so
+spend() can check and lock a balance without reading the ledger.
+"""
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.apps import apps
+from django.core.exceptions import FieldDoesNotExist
+from django.db import connections, router, transaction
+from django.db.models import F
+
+from .models import Currency, CurrencyBalance
+
+# Breakdown rows of the dashboard, in display order
+BALANCE_SOURCES = [
+    ('exchanges_bought', 'شراء عملات'),
+    ('exchanges_sold', 'بيع عملات'),
+    ('partner_deposits', 'إيداعات الشركاء'),
+    ('partner_withdrawals', 'سحوبات الشركاء'),
+    ('invoice_payments', 'تحصيل الفواتير'),
+    ('supplier_payments', 'دفعات الموردين'),
+    ('shipments', 'تكاليف الشحنات'),
+    ('expenses', 'المصروفات'),
+    ('commissions', 'العمولات'),
+]
+
+
+def calculate_company_balances():
+    """
+    Balance of every currency in one query: {code: {'balance': Decimal,
+    'sources': {source: signed Decimal}}}. The sources (see BALANCE_SOURCES)
+    add up to the balance; money in is positive, money out negative.
+    Shipments, expenses, commissions and invoice payments are in SDG,
+    supplier payments in USD.
+    """
+    balances = {
+        code: {'balance': Decimal('0'), 'sources': {source: Decimal('0') for source, _ in BALANCE_SOURCES}}
+        for code in Currency.objects.values_list('code', flat=True)
+    }
+    with connections[router.db_for_read(Currency)].cursor() as cursor:
+        cursor.execute(COMPANY_FLOWS_SQL)
+        rows = cursor.fetchall()
+    for code, source, total in rows:
+        if code not in balances or total is None:
+            continue
+        # SQLite sums decimals as floats
+        total = Decimal(str(total)).quantize(Decimal('0.01'))
+        balances[code]['sources'][source] = total
+        balances[code]['balance'] += total
+    return balances
+
+
+def calculate_company_balance(currency):
+    """
+    Balance of one currency; see calculate_company_balances().
+    """
+    return calculate_company_balances().get(currency.code, {}).get('balance', Decimal('0'))
+
+
+class InsufficientBalance(Exception):
+    def __init__(self, currency_code, balance, amount):
+        self.currency_code = currency_code
+        self.balance = balance
+        self.amount = amount
+        super().__init__(f"{currency_code} balance {balance} is less than {amount}")
+
+
+def _money(value):
+    return Decimal(str(value or 0))
+
+
+# Every kind of ledger row, by model label: (source, amount field, sign,
+# currency, condition). The currency is a fixed code or the name of the
+# row's Currency foreign key; a row counts only if it matches the optional
+# (field, value) condition. Both COMPANY_FLOWS_SQL and ledger_entries() are
+# built from this, so the balance query and the maintained balances agree.
+LEDGER_ENTRIES = {
+    'finance.CurrencyExchange': [
+        ('exchanges_bought', 'bought_amount', 1, 'bought_currency', None),
+        ('exchanges_sold', 'sold_amount', -1, 'sold_currency', None),
+    ],
+    'finance.PartnerTransaction': [
+        ('partner_deposits', 'amount', 1, 'currency', ('transaction_type', 'deposit')),
+        ('partner_withdrawals', 'amount', -1, 'currency', ('transaction_type', 'withdrawal')),
+    ],
+    'panel.InvoicePayment': [('invoice_payments', 'amount', 1, 'SDG', None)],
+    'panel.Shipment': [('shipments', 'shipment_cost', -1, 'SDG', None)],
+    'panel.Expense': [('expenses', 'amount', -1, 'SDG', None)],
+    'panel.CommissionPayment': [('commissions', 'amount', -1, 'SDG', None)],
+    'panel.SupplierPayment': [('supplier_payments', 'amount', -1, 'USD', None)],
+}
+
+
+def _currency_field(model, currency):
+    try:
+        return model._meta.get_field(currency)
+    except FieldDoesNotExist:
+        return None
+
+
+def _flow_sql(label, source, amount, sign, currency, condition):
+    model = apps.get_model(label)
+    table = model._meta.db_table
+    column = f"{'-' if sign < 0 else ''}t.{model._meta.get_field(amount).column}"
+    field = _currency_field(model, currency)
+    if field:
+        sql = (f"SELECT c.code AS code, '{source}' AS source, {column} AS amount FROM {table} t "
+               f"JOIN {Currency._meta.db_table} c ON c.id = t.{field.column}")
+    else:
+        sql = f"SELECT '{currency}' AS code, '{source}' AS source, {column} AS amount FROM {table} t"
+    if condition:
+        name, value = condition
+        sql += f" WHERE t.{model._meta.get_field(name).column} = '{value}'"
+    return sql
+
+
+# Every movement of company money as (currency, source, signed amount)
+COMPANY_FLOWS_SQL = """
+    SELECT code, source, SUM(amount) AS total FROM (
+        %s
+    ) flows
+    GROUP BY code, source
+""" % '\n        UNION ALL\n        '.join(
+    _flow_sql(label, *flow) for label, flows in LEDGER_ENTRIES.items() for flow in flows
+)
+
+
+def ledger_entries(instance):
+    """
+    (currency code, signed amount) of every ledger entry of a saved row.
+    """
+    entries = []
+    for source, amount, sign, currency, condition in LEDGER_ENTRIES[instance._meta.label]:
+        if condition and getattr(instance, condition[0]) != condition[1]:
+            continue
+        if _currency_field(type(instance), currency):
+            currency = getattr(instance, currency).code
+        entries.append((currency, sign * _money(getattr(instance, amount))))
+    return entries
+
+
+def apply_entries(entries, sign=1):
+    """
+    Add (or with sign=-1 take back) ledger entries to CurrencyBalance with
+    one UPDATE per currency, so concurrent writers never lose an update.
+    """
+    totals = {}
+    for code, amount in entries:
+        totals[code] = totals.get(code, Decimal('0')) + sign * amount
+    for code, amount in totals.items():
+        if amount:
+            CurrencyBalance.objects.filter(currency__code=code).update(balance=F('balance') + amount)
+
+
+def rebuild_balances():
+    """
+    Reset every CurrencyBalance to the ledger total, e.g. after bulk
+    inserts that skip signals. Returns {code: balance}.
+    """
+    with transaction.atomic():
+        totals = {code: data['balance'] for code, data in calculate_company_balances().items()}
+        for currency in Currency.objects.all():
+            CurrencyBalance.objects.update_or_create(currency=currency, defaults={'balance': totals[currency.code]})
+    return totals
+
+
+def locked_balance(currency_code):
+    """
+    The maintained balance of `currency_code`, locked until the end of the
+    current transaction. Call it inside transaction.atomic().
+    """
+    rows = CurrencyBalance.objects.filter(currency__code=currency_code)
+    # A write first: on SQLite it takes the database write lock for the rest
+    # of the transaction (what BEGIN IMMEDIATE does in production), elsewhere
+    # it locks the row; a second spender waits here until we commit
+    if not rows.update(balance=F('balance')):
+        return Decimal('0')
+    return rows.values_list('balance', flat=True).get()
+
+
+@contextmanager
+def spend(currency_code, amount):
+    """
+    Guard a write that spends `amount` of `currency_code`:
+
+        with spend('SDG', amount):
+            expense.save()
+
+    Locks the currency's balance and raises InsufficientBalance before the
+    block runs if `amount` is not available. Otherwise the block runs in
+    the same transaction, so the check, the spending row and the balance
+    update it triggers commit together and no other spend can slip in
+    between. Spending nothing (amount <= 0) always passes.
+    """
+    with transaction.atomic():
+        balance = locked_balance(currency_code)
+        if amount > 0 and balance < amount:
+            raise InsufficientBalance(currency_code, balance, amount)
+        yield balance
@@ -0,0 +1,225 @@
+"""
+Cash-flow projection: where each company balance is heading over the
+next HORIZON_DAYS days.
+
+Day 0 is today. It starts from the ledger balance and takes in
+everything already owed:
+
+- open invoices (what is left of the sale total after the payments)
+  come in on their due date. Invoices that are overdue or have no due
+  date are counted on day 0.
+- the remaining supplier balances (USD), unpaid employee commissions
+  and this month's unpaid manager commissions go out on day 0. None of
+  them has a due date.
+- from day 1, the average daily expense of the last EXPENSE_DAYS days
+  goes out every day.
+
+The daily flows are numpy arrays, so the running balance is a single
+cumulative sum per currency. The result is kept in the shared database
+cache (settings.CACHES) until a row it reads changes (see
+finance/signals.py) or the day turns.
+"""
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import DecimalField, ExpressionWrapper, F, Q, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .balance_utils import LEDGER_ENTRIES, calculate_company_balances
+
+HORIZON_DAYS = 180
+EXPENSE_DAYS = 180
+
+# Saving or deleting any of these changes the projection
+PROJECTION_INPUTS = sorted(set(LEDGER_ENTRIES) | {
+    'finance.Currency', 'panel.Sale', 'panel.Invoice', 'panel.Commission', 'panel.Manager',
+    'panel.ManagerCommissionPayment',
+})
+
+CACHE_VERSION_KEY = 'cashflow:version'
+
+_ZERO = Value(Decimal('0'))
+_MONEY = DecimalField(max_digits=16, decimal_places=2)
+
+
+def _bump_version():
+    # A new random version rather than incr(), which the database cache
+    # does as a read and a write: two processes bumping at once could both
+    # write the same value and one change would be missed
+    cache.set(CACHE_VERSION_KEY, uuid.uuid4().hex, None)
+
+
+def invalidate_projection(**kwargs):
+    """
+    Signal receiver: drop every cached projection once the change is
+    committed. Bumping earlier would let a request that still sees the
+    old rows cache them under the new version.
+    """
+    transaction.on_commit(_bump_version)
+
+
+def open_invoices():
+    """
+    (due date, remaining SDG) of every invoice with something left to pay.
+    """
+    from panel.models import Invoice
+
+    return list(
+        Invoice.objects.exclude(status='paid')
+        .annotate(paid=Coalesce(Sum('payments__amount'), _ZERO, output_field=_MONEY))
+        .annotate(remaining=ExpressionWrapper(F('sale__total') - F('paid'), output_field=_MONEY))
+        .filter(remaining__gt=0)
+        .values_list('due_date', 'remaining')
+    )
+
+
+def supplier_debt():
+    """
+    Sum of Supplier.remaining_amount over all suppliers (USD), from two
+    grouped queries.
+    """
+    from panel.models import Shipment, SupplierPayment
+
+    owed = dict(
+        Shipment.objects.filter(supplier__isnull=False).values('supplier')
+        .annotate(total=Sum(F('cost_usd') * F('quantity'), output_field=_MONEY))
+        .values_list('supplier', 'total')
+    )
+    paid = dict(
+        SupplierPayment.objects.values('supplier').annotate(total=Sum('amount'))
+        .values_list('supplier', 'total')
+    )
+    # An overpaid supplier doesn't pay anything back
+    return sum((max((total or 0) - paid.get(pk, 0), 0) for pk, total in owed.items()), Decimal('0'))
+
+
+def unpaid_commissions(today):
+    """
+    Unpaid employee commissions plus this month's unpaid manager
+    commissions, as on the managers page (SDG).
+    """
+    from panel.models import Commission, Manager, ManagerCommissionPayment
+    from panel.periods import in_period, month_range
+
+    employees = Commission.objects.filter(amount__gt=F('paid_amount')).aggregate(
+        total=Sum(F('amount') - F('paid_amount'), output_field=_MONEY)
+    )['total'] or Decimal('0')
+
+    period = month_range(today.year, today.month)
+    sales = Manager.objects.annotate(
+        sales=Sum('employees__sale__total', filter=Q(**in_period('employees__sale__created_at', period)))
+    ).values_list('pk', 'commission_percentage', 'sales')
+    paid = dict(
+        ManagerCommissionPayment.objects.filter(**in_period('paid_at', period)).values('manager')
+        .annotate(total=Sum('amount')).values_list('manager', 'total')
+    )
+    managers = Decimal('0')
+    for pk, percentage, total in sales:
+        commission = (total or 0) * (percentage or 0) / Decimal('100')
+        managers += max(commission - paid.get(pk, 0), 0)
+    return employees + managers
+
+
+def average_daily_expense(today):
+    from panel.models import Expense
+
+    start = today - timedelta(days=EXPENSE_DAYS)
+    total = Expense.objects.filter(date__gte=start, date__lt=today).aggregate(total=Sum('amount'))['total']
+    return (total or Decimal('0')) / EXPENSE_DAYS
+
+
+def project(balances, invoices, supplier_due, commissions_due, daily_expense, today, horizon=HORIZON_DAYS):
+    """
+    Daily inflow, outflow and closing balance per currency code for days
+    0..horizon, as numpy arrays.
+    """
+    import numpy as np
+
+    days = horizon + 1
+    flows = {code: (np.zeros(days), np.zeros(days)) for code in balances}
+    for code in ('SDG', 'USD'):
+        flows.setdefault(code, (np.zeros(days), np.zeros(days)))
+
+    inflow, outflow = flows['SDG']
+    if invoices:
+        offsets = np.array([(due - today).days if due else 0 for due, _ in invoices])
+        amounts = np.array([float(remaining) for _, remaining in invoices])
+        inside = offsets <= horizon
+        np.add.at(inflow, np.clip(offsets[inside], 0, None), amounts[inside])
+    outflow[0] += float(commissions_due)
+    outflow[1:] += float(daily_expense)
+    flows['USD'][1][0] += float(supplier_due)  # outflow
+
+    projection = {}
+    for code, (inflow, outflow) in flows.items():
+        balance = float(balances.get(code, 0)) + np.cumsum(inflow - outflow)
+        projection[code] = {'inflow': inflow, 'outflow': outflow, 'balance': balance}
+    return projection
+
+
+def summarize(code, series, today):
+    """
+    Start, end and lowest balance of one currency, and the first day it
+    goes below zero (None if it doesn't).
+    """
+    import numpy as np
+
+    balance = series['balance']
+    lowest = int(balance.argmin())
+    negative = np.flatnonzero(balance < 0)
+    return {
+        'currency': code,
+        'start': float(balance[0]),
+        'end': float(balance[-1]),
+        'inflow': float(series['inflow'].sum()),
+        'outflow': float(series['outflow'].sum()),
+        'lowest': float(balance[lowest]),
+        'lowest_date': today + timedelta(days=lowest),
+        'negative_date': today + timedelta(days=int(negative[0])) if len(negative) else None,
+    }
+
+
+def build_projection(today=None, horizon=HORIZON_DAYS):
+    """
+    The projection in display form: dates, per-currency series as plain
+    lists (for the chart), one summary row per currency and the inputs.
+    """
+    today = today or timezone.localdate()
+    balances = {code: totals['balance'] for code, totals in calculate_company_balances().items()}
+    invoices = open_invoices()
+    inputs = {
+        'receivable': sum((remaining for _, remaining in invoices), Decimal('0')),
+        'overdue': sum((remaining for due, remaining in invoices if not due or due < today), Decimal('0')),
+        'supplier_due': supplier_debt(),
+        'commissions_due': unpaid_commissions(today),
+        'daily_expense': average_daily_expense(today),
+    }
+    projection = project(
+        balances, invoices, inputs['supplier_due'], inputs['commissions_due'], inputs['daily_expense'],
+        today, horizon,
+    )
+    inputs['monthly_expense'] = inputs['daily_expense'] * 30
+    return {
+        'dates': [(today + timedelta(days=day)).isoformat() for day in range(horizon + 1)],
+        'series': {code: [round(value, 2) for value in series['balance'].tolist()] for code, series in projection.items()},
+        'summary': [summarize(code, series, today) for code, series in sorted(projection.items())],
+        'inputs': inputs,
+    }
+
+
+def cash_flow_projection(today=None, horizon=HORIZON_DAYS):
+    """
+    build_projection(), cached until an input changes or the day turns.
+    """
+    today = today or timezone.localdate()
+    version = cache.get(CACHE_VERSION_KEY, 0)
+    key = f'cashflow:{version}:{today.isoformat()}:{horizon}'
+    projection = cache.get(key)
+    if projection is None:
+        projection = build_projection(today, horizon)
+        cache.set(key, projection, 24 * 60 * 60)
+    return projection
@@ -0,0 +1,25 @@
+# Generated by Django 5.0.1 on 2026-10-19 08:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0004_currencyexchange_delete_currencypurchase'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='currencyexchange',
+            index=models.Index(fields=['sold_currency', 'bought_currency', 'date'], name='exchange_pair_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='partnertransaction',
+            index=models.Index(fields=['partner', 'currency', 'transaction_type'], name='partnertx_partner_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='partnertransaction',
+            index=models.Index(fields=['currency', 'transaction_type'], name='partnertx_currency_type_idx'),
+        ),
+    ]
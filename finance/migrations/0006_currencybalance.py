@@ -0,0 +1,60 @@
+# Generated by Django 5.0.1 on 2026-10-19 08:40
+
+import django.db.models.deletion
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def fill_balances(apps, schema_editor):
+    # Start every currency at its ledger total; signals keep it from here.
+    # A frozen copy of the ledger as it stood when this migration was written
+    # (finance.balance_utils.LEDGER_ENTRIES): migrations must not import app
+    # code, so leave this as is when the ledger changes and run
+    # rebuild_balances() from a later migration instead.
+    Currency = apps.get_model('finance', 'Currency')
+    CurrencyBalance = apps.get_model('finance', 'CurrencyBalance')
+    CurrencyExchange = apps.get_model('finance', 'CurrencyExchange')
+    PartnerTransaction = apps.get_model('finance', 'PartnerTransaction')
+
+    def total(model, field, **filters):
+        return model.objects.filter(**filters).aggregate(total=Sum(field))['total'] or Decimal('0')
+
+    for currency in Currency.objects.all():
+        balance = (
+            total(CurrencyExchange, 'bought_amount', bought_currency=currency)
+            - total(CurrencyExchange, 'sold_amount', sold_currency=currency)
+            + total(PartnerTransaction, 'amount', currency=currency, transaction_type='deposit')
+            - total(PartnerTransaction, 'amount', currency=currency, transaction_type='withdrawal')
+        )
+        if currency.code == 'SDG':
+            balance += (
+                total(apps.get_model('panel', 'InvoicePayment'), 'amount')
+                - total(apps.get_model('panel', 'Shipment'), 'shipment_cost')
+                - total(apps.get_model('panel', 'Expense'), 'amount')
+                - total(apps.get_model('panel', 'CommissionPayment'), 'amount')
+            )
+        if currency.code == 'USD':
+            balance -= total(apps.get_model('panel', 'SupplierPayment'), 'amount')
+        CurrencyBalance.objects.create(currency=currency, balance=balance)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0005_hot_query_indexes'),
+        ('panel', '0011_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CurrencyBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('balance', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('currency', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='company_balance', to='finance.currency')),
+            ],
+        ),
+        migrations.RunPython(fill_balances, migrations.RunPython.noop),
+    ]
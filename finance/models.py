@@ -59,6 +59,11 @@ class CurrencyExchange(models.Model):
     date = models.DateField(default=timezone.now)
     note = models.CharField(max_length=255, blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['sold_currency', 'bought_currency', 'date'], name='exchange_pair_date_idx'),
+        ]
+
     def clean(self):
         if self.sold_amount <= 0 or self.bought_amount <= 0:
             raise ValidationError("Amounts must be positive.")
@@ -73,6 +78,17 @@ class CurrencyExchange(models.Model):
     def __str__(self):
         return f"{self.sold_amount} {self.sold_currency.code} → {self.bought_amount} {self.bought_currency.code} @ {self.exchange_rate:.4f}"
 
+class CurrencyBalance(models.Model):
+    """
+    The company's balance in one currency, kept equal to the ledger total
+    (finance.balance_utils.calculate_company_balances) by finance/signals.py.
+    """
+    currency = models.OneToOneField(Currency, on_delete=models.CASCADE, related_name='company_balance')
+    balance = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+
+    def __str__(self):
+        return f"{self.currency.code}: {self.balance}"
+
 class Partner(models.Model):
     """
     Represents a company partner/funder.
@@ -91,22 +107,34 @@ class Partner(models.Model):
         """
         Returns the partner's balances in all currencies, including SDG equivalent.
         """
-        balances = self.transactions.values('currency__code', 'currency__name').annotate(
-            total_deposit=Coalesce(Sum('amount', filter=Q(transaction_type='deposit')), Decimal('0')),
-            total_withdrawal=Coalesce(Sum('amount', filter=Q(transaction_type='withdrawal')), Decimal('0')),
-        ).annotate(
-            balance=ExpressionWrapper(
-                F('total_deposit') - F('total_withdrawal'),
-                output_field=DecimalField(max_digits=16, decimal_places=2)
-            )
-        ).order_by('currency__code')
+        return partner_balances([self.pk]).get(self.pk, [])
 
-        # Add SDG equivalent
-        for b in balances:
-            code = b['currency__code']
-            b['sdg_equivalent'] = Decimal(convert_to_sdg(b['balance'], code))
 
-        return balances
+def partner_balances(partner_ids=None):
+    """
+    Balances of many partners at once: {partner id: [{'currency__code',
+    'currency__name', 'total_deposit', 'total_withdrawal', 'balance',
+    'sdg_equivalent'}, ...]} ordered by currency code. One grouped query
+    over the transactions plus one for the exchange rates, however many
+    partners there are.
+    """
+    transactions = PartnerTransaction.objects.all()
+    if partner_ids is not None:
+        transactions = transactions.filter(partner_id__in=partner_ids)
+    rows = transactions.values('partner_id', 'currency__code', 'currency__name').annotate(
+        total_deposit=Coalesce(Sum('amount', filter=Q(transaction_type='deposit')), Decimal('0')),
+        total_withdrawal=Coalesce(Sum('amount', filter=Q(transaction_type='withdrawal')), Decimal('0')),
+    ).order_by('partner_id', 'currency__code')
+
+    rates = get_latest_exchange_rates()
+    balances = {}
+    for row in rows:
+        partner_id = row.pop('partner_id')
+        row['balance'] = row['total_deposit'] - row['total_withdrawal']
+        rate = rates.get(row['currency__code']) or fallback_rate(row['currency__code'])
+        row['sdg_equivalent'] = Decimal(float(row['balance']) * rate)
+        balances.setdefault(partner_id, []).append(row)
+    return balances
 
 
 class PartnerTransaction(models.Model):
@@ -124,6 +152,13 @@ class PartnerTransaction(models.Model):
     date = models.DateField(default=timezone.now)
     note = models.CharField(max_length=255, blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['partner', 'currency', 'transaction_type'], name='partnertx_partner_idx'),
+            # Company-wide per-currency deposit/withdrawal totals
+            models.Index(fields=['currency', 'transaction_type'], name='partnertx_currency_type_idx'),
+        ]
+
     def clean(self):
         if self.amount < 0:
             raise ValidationError("Transaction amount cannot be negative.")
@@ -145,17 +180,32 @@ def get_latest_exchange_rate(to_currency):
     latest = CurrencyExchange.objects.filter(
         sold_currency__code="SDG",
         bought_currency__code=to_currency
-    ).order_by('-date').first()
+    ).order_by('-date', '-pk').first()
 
     if latest:
         return float(latest.exchange_rate)
+    return fallback_rate(to_currency)
 
-    # fallback rates
-    if to_currency == 'USD':
-        return 2550
-    elif to_currency == 'AED':
-        return 700
-    return 1
+
+# Used until a currency has been bought with SDG at least once
+FALLBACK_RATES = {'USD': 2550, 'AED': 700}
+
+
+def fallback_rate(currency_code):
+    return FALLBACK_RATES.get(currency_code, 1)
+
+
+def get_latest_exchange_rates():
+    """
+    get_latest_exchange_rate() for every currency in one query:
+    {currency code: SDG per unit}.
+    """
+    latest = CurrencyExchange.objects.filter(
+        sold_currency__code="SDG",
+        bought_currency=models.OuterRef('pk'),
+    ).order_by('-date', '-pk').values('exchange_rate')[:1]
+    rates = Currency.objects.annotate(rate=models.Subquery(latest)).values_list('code', 'rate')
+    return {code: float(rate) if rate is not None else fallback_rate(code) for code, rate in rates}
 
 
 def convert_to_sdg(amount, currency_code):
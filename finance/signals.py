@@ -0,0 +1,47 @@
+"""
+Keep CurrencyBalance in step with the ledger: every save or delete of a
+row that moves company money applies its change to the balances. Saving
+or deleting any input of the cash-flow projection drops its cache.
+"""
+from django.apps import apps
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+
+from .balance_utils import LEDGER_ENTRIES, apply_entries, ledger_entries
+from .cashflow_utils import PROJECTION_INPUTS, invalidate_projection
+from .models import Currency, CurrencyBalance
+
+
+def remember_ledger_entries(sender, instance, **kwargs):
+    # An edit replaces what the row contributed before
+    previous = sender.objects.filter(pk=instance.pk).first() if instance.pk else None
+    instance._ledger_before = ledger_entries(previous) if previous else []
+
+
+def apply_ledger_change(sender, instance, **kwargs):
+    apply_entries(getattr(instance, '_ledger_before', []), sign=-1)
+    apply_entries(ledger_entries(instance))
+    instance._ledger_before = []
+
+
+def revert_ledger_entries(sender, instance, **kwargs):
+    apply_entries(ledger_entries(instance), sign=-1)
+
+
+def create_currency_balance(sender, instance, created, **kwargs):
+    # A new currency has nothing in the ledger yet
+    if created:
+        CurrencyBalance.objects.get_or_create(currency=instance)
+
+
+for label in LEDGER_ENTRIES:
+    model = apps.get_model(label)
+    pre_save.connect(remember_ledger_entries, sender=model)
+    post_save.connect(apply_ledger_change, sender=model)
+    post_delete.connect(revert_ledger_entries, sender=model)
+post_save.connect(create_currency_balance, sender=Currency)
+
+for label in PROJECTION_INPUTS:
+    model = apps.get_model(label)
+    post_save.connect(invalidate_projection, sender=model)
+    post_delete.connect(invalidate_projection, sender=model)
+m2m_changed.connect(invalidate_projection, sender=apps.get_model('panel.Manager').employees.through)
@@ -1,3 +1,373 @@
-from django.test import TestCase
+from datetime import timedelta
+from decimal import Decimal
+from unittest import skipUnless
 
-# Create your tests here.
+from django.db import connection
+from django.db.models import Sum
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from panel.tests import QueryPlanMixin
+from .models import Currency, CurrencyExchange, Partner, PartnerTransaction
+
+
+@skipUnless(connection.vendor == 'sqlite', "EXPLAIN QUERY PLAN output is SQLite-specific")
+# The test database only exists on the 'default' connection
+@override_settings(REPORTS_DATABASE='off')
+class FinanceQueryPlanTests(QueryPlanMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        today = timezone.localdate()
+        cls.sdg, cls.usd, cls.aed = Currency.objects.bulk_create([
+            Currency(code='SDG', name='Sudanese Pound'),
+            Currency(code='USD', name='US Dollar'),
+            Currency(code='AED', name='UAE Dirham'),
+        ])
+        cls.partners = Partner.objects.bulk_create([Partner(full_name=f"شريك {i}") for i in range(5)])
+        PartnerTransaction.objects.bulk_create([
+            PartnerTransaction(
+                partner=cls.partners[i % 5], currency=(cls.sdg, cls.usd, cls.aed)[i % 3],
+                transaction_type=('deposit', 'withdrawal')[i % 2], amount=Decimal('100') * (i + 1),
+                date=today - timedelta(days=i),
+            )
+            for i in range(150)
+        ])
+        CurrencyExchange.objects.bulk_create([
+            CurrencyExchange(
+                sold_currency=cls.sdg, bought_currency=(cls.usd, cls.aed)[i % 2],
+                sold_amount=Decimal('60000'), bought_amount=Decimal('100'), exchange_rate=Decimal('600'),
+                date=today - timedelta(days=i),
+            )
+            for i in range(100)
+        ])
+
+    def test_partner_balances(self):
+        self.assertIndexed(
+            self.partners[0].transactions.values('currency__code').annotate(total=Sum('amount')),
+        )
+        self.assertIndexed(
+            PartnerTransaction.objects.filter(partner=self.partners[0], currency=self.usd, transaction_type='deposit'),
+            'partnertx_partner_idx',
+        )
+
+    def test_company_currency_totals(self):
+        self.assertIndexed(
+            PartnerTransaction.objects.filter(currency=self.usd, transaction_type='withdrawal'),
+            'partnertx_currency_type_idx',
+        )
+
+    def test_latest_exchange_rate(self):
+        self.assertIndexed(
+            CurrencyExchange.objects.filter(sold_currency__code='SDG', bought_currency__code='USD').order_by('-date')[:1],
+            'exchange_pair_date_idx',
+        )
+
+    def test_hot_views(self):
+        tables = {'finance_partnertransaction', 'finance_currencyexchange'}
+        self.assertViewIndexed(reverse('partner_transactions', args=[self.partners[0].pk]), tables)
+
+
+@override_settings(REPORTS_DATABASE='off')
+class PartnerBalanceTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        today = timezone.localdate()
+        cls.sdg, cls.usd = Currency.objects.bulk_create([
+            Currency(code='SDG', name='Sudanese Pound'),
+            Currency(code='USD', name='US Dollar'),
+        ])
+        CurrencyExchange.objects.create(
+            sold_currency=cls.sdg, bought_currency=cls.usd, sold_amount=Decimal('60000'),
+            bought_amount=Decimal('100'), exchange_rate=Decimal('600'), date=today,
+        )
+        cls.partners = Partner.objects.bulk_create([Partner(full_name=f"شريك {i}") for i in range(3)])
+
+    def add_transactions(self, partners):
+        PartnerTransaction.objects.bulk_create([
+            PartnerTransaction(
+                partner=partner, currency=currency, transaction_type=kind, amount=amount,
+                date=timezone.localdate(),
+            )
+            for partner in partners
+            for currency, kind, amount in (
+                (self.sdg, 'deposit', Decimal('1000')), (self.usd, 'deposit', Decimal('50')),
+                (self.usd, 'withdrawal', Decimal('20')),
+            )
+        ])
+
+    def test_balances_pivot_per_partner_and_currency(self):
+        from .models import partner_balances
+        self.add_transactions(self.partners[:2])
+        balances = partner_balances()
+        self.assertEqual(set(balances), {self.partners[0].pk, self.partners[1].pk})
+        sdg, usd = balances[self.partners[0].pk]
+        self.assertEqual((sdg['currency__code'], sdg['balance'], sdg['sdg_equivalent']), ('SDG', 1000, 1000))
+        self.assertEqual((usd['currency__code'], usd['total_deposit'], usd['total_withdrawal']), ('USD', 50, 20))
+        self.assertEqual((usd['balance'], usd['sdg_equivalent']), (30, 30 * 600))
+        self.assertEqual(list(self.partners[0].get_all_balances()), balances[self.partners[0].pk])
+        self.assertEqual(self.partners[2].get_all_balances(), [])
+
+    def test_partners_list_queries_do_not_grow_with_partners(self):
+        self.add_transactions(self.partners[:1])
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(reverse('partners_list'))
+        self.add_transactions(self.partners)
+        with self.assertNumQueries(len(few)):
+            response = self.client.get(reverse('partners_list'))
+        self.assertContains(response, 'USD: 30')
+
+
+@override_settings(REPORTS_DATABASE='off')
+class CompanyBalanceTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        from panel.models import Expense
+        today = timezone.localdate()
+        cls.sdg, cls.usd = Currency.objects.bulk_create([
+            Currency(code='SDG', name='Sudanese Pound'),
+            Currency(code='USD', name='US Dollar'),
+        ])
+        partner = Partner.objects.create(full_name="شريك")
+        PartnerTransaction.objects.bulk_create([
+            PartnerTransaction(partner=partner, currency=cls.sdg, transaction_type='deposit',
+                               amount=Decimal('100000'), date=today),
+            PartnerTransaction(partner=partner, currency=cls.sdg, transaction_type='withdrawal',
+                               amount=Decimal('5000'), date=today),
+        ])
+        CurrencyExchange.objects.create(
+            sold_currency=cls.sdg, bought_currency=cls.usd, sold_amount=Decimal('60000'),
+            bought_amount=Decimal('100'), exchange_rate=Decimal('600'), date=today,
+        )
+        Expense.objects.create(description="إيجار", amount=Decimal('2500.50'), date=today)
+
+    def test_balances_and_sources_in_one_pass(self):
+        from .balance_utils import calculate_company_balance, calculate_company_balances
+        with self.assertNumQueries(2):
+            balances = calculate_company_balances()
+        sdg = balances['SDG']
+        self.assertEqual(sdg['balance'], Decimal('32499.50'))
+        self.assertEqual(sdg['sources']['partner_deposits'], Decimal('100000'))
+        self.assertEqual(sdg['sources']['partner_withdrawals'], Decimal('-5000'))
+        self.assertEqual(sdg['sources']['exchanges_sold'], Decimal('-60000'))
+        self.assertEqual(sdg['sources']['expenses'], Decimal('-2500.50'))
+        self.assertEqual(sum(sdg['sources'].values()), sdg['balance'])
+        self.assertEqual(balances['USD']['balance'], Decimal('100'))
+        self.assertEqual(calculate_company_balance(self.usd), Decimal('100'))
+
+    def test_dashboard_shows_breakdown(self):
+        response = self.client.get(reverse('financial_dashboard'))
+        self.assertContains(response, 'مصادر الأرصدة')
+        self.assertContains(response, '32,500')
+
+
+@override_settings(REPORTS_DATABASE='off')
+class BalanceGuardTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.sdg, cls.usd = Currency.objects.bulk_create([
+            Currency(code='SDG', name='Sudanese Pound'),
+            Currency(code='USD', name='US Dollar'),
+        ])
+        # bulk_create skips the signal that opens the balances
+        from .balance_utils import rebuild_balances
+        rebuild_balances()
+        cls.partner = Partner.objects.create(full_name="شريك")
+
+    def deposit(self, amount, currency=None):
+        return PartnerTransaction.objects.create(
+            partner=self.partner, currency=currency or self.sdg, transaction_type='deposit',
+            amount=Decimal(amount), date=timezone.localdate(),
+        )
+
+    def balance(self, currency):
+        currency.company_balance.refresh_from_db()
+        return currency.company_balance.balance
+
+    def test_balance_follows_ledger_on_save_edit_and_delete(self):
+        from panel.models import Expense
+        from .balance_utils import calculate_company_balances
+        deposit = self.deposit('1000')
+        expense = Expense.objects.create(description="وقود", amount=Decimal('300'))
+        self.assertEqual(self.balance(self.sdg), Decimal('700'))
+        expense.amount = Decimal('450')
+        expense.save()
+        deposit.delete()
+        self.assertEqual(self.balance(self.sdg), Decimal('-450'))
+        CurrencyExchange.objects.create(
+            sold_currency=self.sdg, bought_currency=self.usd, sold_amount=Decimal('600'),
+            bought_amount=Decimal('1'), exchange_rate=Decimal('600'),
+        )
+        ledger = calculate_company_balances()
+        self.assertEqual(self.balance(self.sdg), ledger['SDG']['balance'])
+        self.assertEqual(self.balance(self.usd), ledger['USD']['balance'])
+
+    def test_rebuild_matches_the_ledger_after_mixed_writes(self):
+        from panel.models import (
+            CommissionPayment, Employee, Expense, Invoice, InvoicePayment, Product, Sale, Shipment, Supplier,
+            SupplierPayment,
+        )
+        from .balance_utils import calculate_company_balances, rebuild_balances
+        today = timezone.localdate()
+        self.deposit('5000')
+        self.deposit('40', currency=self.usd)
+        PartnerTransaction.objects.create(
+            partner=self.partner, currency=self.sdg, transaction_type='withdrawal', amount=Decimal('700'),
+            date=today,
+        )
+        exchange = CurrencyExchange.objects.create(
+            sold_currency=self.sdg, bought_currency=self.usd, sold_amount=Decimal('1200'),
+            bought_amount=Decimal('2'), exchange_rate=Decimal('600'),
+        )
+        exchange.bought_amount = Decimal('2.50')
+        exchange.save()
+        employee = Employee.objects.create(name="مندوب")
+        invoice = Invoice.objects.create(sale=Sale.objects.create(employee=employee, total=900), due_date=today)
+        payment = InvoicePayment.objects.create(invoice=invoice, amount=Decimal('300'))
+        InvoicePayment.objects.create(invoice=invoice, amount=Decimal('150.25'))
+        payment.delete()
+        supplier = Supplier.objects.create(name="مورد")
+        Shipment.objects.create(
+            product=Product.objects.create(name="دواء"), quantity=4, shipment_cost=Decimal('80'),
+            cost_usd=Decimal('5'), batch_number='B1', expiry_date=today + timedelta(days=365), supplier=supplier,
+        )
+        SupplierPayment.objects.create(supplier=supplier, amount=Decimal('12'))
+        expense = Expense.objects.create(description="إيجار", amount=Decimal('400'))
+        expense.amount = Decimal('410.75')
+        expense.save()
+        CommissionPayment.objects.create(employee=employee, amount=Decimal('55'))
+
+        ledger = {code: data['balance'] for code, data in calculate_company_balances().items()}
+        self.assertEqual(ledger, {'SDG': Decimal('2704.50'), 'USD': Decimal('30.50')})
+        self.assertEqual({'SDG': self.balance(self.sdg), 'USD': self.balance(self.usd)}, ledger)
+        self.assertEqual(rebuild_balances(), ledger)
+        self.assertEqual({'SDG': self.balance(self.sdg), 'USD': self.balance(self.usd)}, ledger)
+
+    def test_spend_refuses_more_than_the_balance(self):
+        from panel.models import Expense
+        from .balance_utils import InsufficientBalance, spend
+        self.deposit('1000')
+        with self.assertRaises(InsufficientBalance) as raised:
+            with spend('SDG', Decimal('1000.01')):
+                Expense.objects.create(description="إيجار", amount=Decimal('1000.01'))
+        self.assertEqual(raised.exception.balance, Decimal('1000'))
+        self.assertFalse(Expense.objects.exists())
+        with spend('SDG', Decimal('1000')):
+            Expense.objects.create(description="إيجار", amount=Decimal('1000'))
+        self.assertEqual(self.balance(self.sdg), 0)
+        # Spending nothing passes even on an empty balance
+        with spend('USD', 0):
+            pass
+
+    def test_expense_add_is_guarded(self):
+        from panel.models import Expense
+        self.deposit('500')
+        data = {'description': "كهرباء", 'amount': '800', 'date': timezone.localdate().isoformat()}
+        response = self.client.post(reverse('panel:expense_add'), data)
+        self.assertContains(response, 'غير كافٍ')
+        self.assertFalse(Expense.objects.exists())
+        data['amount'] = '500'
+        self.assertRedirects(self.client.post(reverse('panel:expense_add'), data), reverse('panel:expense_list'))
+        self.assertEqual(self.balance(self.sdg), 0)
+
+    def test_currency_purchase_edit_is_guarded(self):
+        self.deposit('1000')
+        self.deposit('20', self.usd)
+        purchase = CurrencyExchange.objects.create(
+            sold_currency=self.sdg, bought_currency=self.usd, sold_amount=Decimal('600'),
+            bought_amount=Decimal('1'), exchange_rate=Decimal('600'),
+        )
+        url = reverse('currency_purchase_edit', args=[purchase.pk])
+        data = {
+            'sold_currency': self.sdg.pk, 'sold_amount': '1100', 'bought_currency': self.usd.pk,
+            'bought_amount': '2', 'date': timezone.localdate().isoformat(),
+        }
+        # 400 SDG left: the extra 500 is not available
+        self.assertContains(self.client.post(url, data), 'Insufficient balance for SDG')
+        purchase.refresh_from_db()
+        self.assertEqual(purchase.sold_amount, Decimal('600'))
+        data['sold_amount'] = '1000'
+        self.assertRedirects(self.client.post(url, data), reverse('currency_purchases_list'))
+        self.assertEqual(self.balance(self.sdg), 0)
+        # Selling USD instead: the SDG comes back, all 30 USD must be available
+        data.update(sold_currency=self.usd.pk, sold_amount='30', bought_currency=self.sdg.pk, bought_amount='1000')
+        self.assertContains(self.client.post(url, data), 'Insufficient balance for USD')
+        data['sold_amount'] = '20'
+        self.assertRedirects(self.client.post(url, data), reverse('currency_purchases_list'))
+        self.assertEqual(self.balance(self.usd), 0)
+        self.assertEqual(self.balance(self.sdg), Decimal('2000'))
+
+
+@override_settings(REPORTS_DATABASE='off')
+class CashFlowProjectionTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        from panel.models import (
+            Commission, Employee, Expense, Invoice, InvoicePayment, Product, Sale, Shipment, Supplier,
+        )
+        from .balance_utils import rebuild_balances
+        cls.today = timezone.localdate()
+        cls.sdg, cls.usd = Currency.objects.bulk_create([
+            Currency(code='SDG', name='Sudanese Pound'),
+            Currency(code='USD', name='US Dollar'),
+        ])
+        rebuild_balances()
+        partner = Partner.objects.create(full_name="شريك")
+        PartnerTransaction.objects.create(
+            partner=partner, currency=cls.sdg, transaction_type='deposit', amount=Decimal('10000'),
+            date=cls.today,
+        )
+        employee = Employee.objects.create(name="مندوب")
+        # 600 left on an invoice due in 10 days, 400 on an overdue one
+        for total, paid, due in ((1000, 400, 10), (400, 0, -5)):
+            sale = Sale.objects.create(employee=employee, total=total)
+            invoice = Invoice.objects.create(sale=sale, due_date=cls.today + timedelta(days=due))
+            if paid:
+                InvoicePayment.objects.create(invoice=invoice, amount=paid)
+        Commission.objects.create(employee=employee, sale=sale, amount=Decimal('300'), paid_amount=Decimal('100'))
+        Expense.objects.create(description="إيجار", amount=Decimal('1800'), date=cls.today - timedelta(days=3))
+        supplier = Supplier.objects.create(name="مورد")
+        Shipment.objects.create(
+            product=Product.objects.create(name="دواء"), quantity=10, shipment_cost=0, cost_usd=Decimal('5'),
+            batch_number='B1', expiry_date=cls.today + timedelta(days=365), supplier=supplier,
+        )
+
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+
+    def test_projection_from_invoices_debts_and_expenses(self):
+        from .cashflow_utils import EXPENSE_DAYS, build_projection
+        data = build_projection(self.today, horizon=30)
+        sdg = data['series']['SDG']
+        daily = 1800 / EXPENSE_DAYS
+        # 10000 + 400 paid, minus the expense: 8600 today, plus the overdue 400, minus 200 commission
+        self.assertAlmostEqual(sdg[0], 8600 + 400 - 200)
+        self.assertAlmostEqual(sdg[9], 8800 - 9 * daily)
+        self.assertAlmostEqual(sdg[10], 8800 + 600 - 10 * daily)
+        self.assertAlmostEqual(data['series']['USD'][0], -50)
+        usd = next(row for row in data['summary'] if row['currency'] == 'USD')
+        self.assertEqual(usd['negative_date'], self.today)
+        self.assertEqual(data['inputs']['overdue'], Decimal('400'))
+
+    def test_cached_until_an_input_changes(self):
+        from panel.models import Expense
+        from .cashflow_utils import cash_flow_projection
+        first = cash_flow_projection(self.today)
+        # Only the two cache reads (version and projection)
+        with self.assertNumQueries(2):
+            self.assertEqual(cash_flow_projection(self.today), first)
+        with self.captureOnCommitCallbacks(execute=True):
+            Expense.objects.create(description="كهرباء", amount=Decimal('500'), date=self.today)
+        self.assertEqual(cash_flow_projection(self.today)['series']['SDG'][0], first['series']['SDG'][0] - 500)
+
+    def test_page(self):
+        response = self.client.get(reverse('cash_flow_projection'))
+        self.assertContains(response, 'cash-flow-chart')
+        self.assertEqual(len(response.context['chart']['dates']), 181)
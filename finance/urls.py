@@ -4,6 +4,7 @@ from . import views
 urlpatterns = [
     # Financial Dashboard and Company Balances
     path('dashboard/', views.financial_dashboard, name='financial_dashboard'),
+    path('cash-flow/', views.cash_flow_projection, name='cash_flow_projection'),
     # path('balances/', views.company_balances, name='company_balances'),
 
     # Partner Management
@@ -1,66 +1,45 @@
+from contextlib import ExitStack
 from django.shortcuts import render, get_object_or_404, redirect
 from django.db.models import Sum, Q, F, ExpressionWrapper, DecimalField
 from django.core.exceptions import ValidationError
 from django.http import HttpResponse
 from django.utils.dateparse import parse_date
-from reportlab.lib.pagesizes import A4
 from .models import (
-     CurrencyExchange, Partner, PartnerTransaction, Currency, FinancialLog, convert_to_sdg
+     CurrencyExchange, Partner, PartnerTransaction, Currency, FinancialLog, convert_to_sdg,
+     fallback_rate, get_latest_exchange_rates, partner_balances,
 )
 from django.db import models
 from .forms import PartnerForm, PartnerTransactionForm, CurrencyPurchaseForm
-from panel.models import Shipment, SupplierPayment, Expense, CommissionPayment, InvoicePayment
 from django.views.decorators.http import require_GET
+from panel.export_utils import EXPORT_FORMATS, export_response, iter_queryset
+from panel.pdf_utils import table_pdf_response
+from cafe.routers import report_view
+from .balance_utils import BALANCE_SOURCES, InsufficientBalance, calculate_company_balances, spend
 
 # --- Company Balances and Dashboard ---
-def calculate_company_balance(currency):
-    # Total bought into this currency
-    bought_sum = CurrencyExchange.objects.filter(bought_currency=currency).aggregate(total=Sum('bought_amount'))['total'] or 0
-    # Total sold from this currency
-    sold_sum = CurrencyExchange.objects.filter(sold_currency=currency).aggregate(total=Sum('sold_amount'))['total'] or 0
-
-    # Partner deposits
-    deposits_sum = PartnerTransaction.objects.filter(currency=currency, transaction_type='deposit').aggregate(total=Sum('amount'))['total'] or 0
-
-    # Partner withdrawals
-    withdrawals_sum = PartnerTransaction.objects.filter(currency=currency, transaction_type='withdrawal').aggregate(total=Sum('amount'))['total'] or 0
-
-    # shipments costs
-    if currency.code == 'SDG':
-        shipment_costs = Shipment.objects.all().aggregate(total=Sum('shipment_cost'))['total'] or 0
-        expense_costs = Expense.objects.all().aggregate(total=Sum('amount'))['total'] or 0
-        commission_sum = CommissionPayment.objects.all().aggregate(total=Sum('amount'))['total'] or 0 
-        sale_payments = InvoicePayment.objects.all().aggregate(total=Sum('amount'))['total'] or 0
-    else:
-        expense_costs = 0
-        shipment_costs = 0
-        commission_sum = 0
-        sale_payments = 0
-
-    if currency.code == 'USD':
-        supplier_sum = SupplierPayment.objects.all().aggregate(total=Sum('amount'))['total'] or 0
-    else:
-        supplier_sum = 0
-    return bought_sum + deposits_sum + sale_payments - (sold_sum + withdrawals_sum + shipment_costs + supplier_sum + expense_costs + commission_sum)
-
+@report_view
 def financial_dashboard(request):
     """
     Main dashboard view.
     Shows all supported currencies, even if no balance record exists yet.
     """
-    currencies = Currency.objects.all()
+    balances = calculate_company_balances()
+    rates = get_latest_exchange_rates()
     balances_sdg = []
     balances_total_sdg = 0
-    for currency in currencies:
-        # Use reliable calculation
-        balance = calculate_company_balance(currency)
-        sdg_equiv = convert_to_sdg(balance, currency.code)
+    for code, totals in balances.items():
+        sdg_equiv = float(totals['balance']) * (rates.get(code) or fallback_rate(code))
         balances_sdg.append({
-            'currency': currency.code,
-            'balance': balance,
+            'currency': code,
+            'balance': totals['balance'],
             'sdg_equiv': sdg_equiv
         })
         balances_total_sdg += sdg_equiv
+    # Where the money came from and went, one row per source
+    breakdown = [
+        {'label': label, 'amounts': [balances[code]['sources'][source] for code in balances]}
+        for source, label in BALANCE_SOURCES
+    ]
     purchases = CurrencyExchange.objects.select_related('bought_currency').all()
     # purchase_summary = purchases.values('bought_currency__code').annotate(
     #     total_amount=Sum('bought_amount'),
@@ -81,6 +60,8 @@ def financial_dashboard(request):
     return render(request, 'finance/financial_dashboard.html', {
         'balances_sdg': balances_sdg,
         'balances_total_sdg': balances_total_sdg,
+        'breakdown': breakdown,
+        'breakdown_currencies': list(balances),
         # 'purchase_summary': purchase_summary,
         # 'partners': partners,
         # 'partner_withdrawals': partner_withdrawals,
@@ -92,17 +73,32 @@ def financial_dashboard(request):
     })
 
 
+@report_view
+def cash_flow_projection(request):
+    """
+    Projected balance per currency for the next HORIZON_DAYS days, from
+    open invoices, supplier and commission debts and average expenses.
+    """
+    from .cashflow_utils import EXPENSE_DAYS, HORIZON_DAYS, cash_flow_projection as projection
+    data = projection()
+    return render(request, 'finance/cash_flow_projection.html', {
+        'summary': data['summary'],
+        'inputs': data['inputs'],
+        'chart': {'dates': data['dates'], 'series': data['series']},
+        'horizon_days': HORIZON_DAYS,
+        'expense_days': EXPENSE_DAYS,
+        'active_sidebar': 'cash_flow',
+    })
+
 
 def partners_list(request):
     partners = Partner.objects.all()
-    # Fetch all balances for all partners and currencies
-    partner_balances = {}
-    for partner in partners:
-        partner_balances[partner.id] = partner.get_all_balances()     
+    # Balances of all partners in all currencies, from one grouped query
+    balances = partner_balances()
 
     return render(request, 'finance/partners_list.html', {
         'partners': partners,
-        'partner_balances': partner_balances,
+        'partner_balances': balances,
         'active_sidebar': 'partners_list'
     })
 
@@ -134,6 +130,22 @@ def partner_delete(request, partner_id):
         return redirect('partners_list')
     return render(request, 'finance/partner_confirm_delete.html', {'partner': partner, 'active_sidebar': 'partners_list'})
 
+def _filter_partner_transactions(request, transactions):
+    currency_id = request.GET.get('currency')
+    tx_type = request.GET.get('transaction_type')
+    date_from = request.GET.get('date_from')
+    date_to = request.GET.get('date_to')
+    if currency_id:
+        transactions = transactions.filter(currency_id=currency_id)
+    if tx_type:
+        transactions = transactions.filter(transaction_type=tx_type)
+    if date_from:
+        transactions = transactions.filter(date__gte=date_from)
+    if date_to:
+        transactions = transactions.filter(date__lte=date_to)
+    return transactions
+
+@report_view
 def partner_transactions(request, partner_id):
     try:
         partner = Partner.objects.get(pk=partner_id)
@@ -153,59 +165,36 @@ def partner_transactions(request, partner_id):
     tx_type = request.GET.get('transaction_type')
     date_from = request.GET.get('date_from')
     date_to = request.GET.get('date_to')
-    filtered_transactions = transactions
-    if currency_id:
-        filtered_transactions = filtered_transactions.filter(currency_id=currency_id)
-    if tx_type:
-        filtered_transactions = filtered_transactions.filter(transaction_type=tx_type)
-    if date_from:
-        filtered_transactions = filtered_transactions.filter(date__gte=date_from)
-    if date_to:
-        filtered_transactions = filtered_transactions.filter(date__lte=date_to)
+    filtered_transactions = _filter_partner_transactions(request, transactions)
     currencies = Currency.objects.all()
 
+    # CSV / XLSX download
+    if request.GET.get('download') in EXPORT_FORMATS and partner:
+        def row(tx):
+            return [tx.get_transaction_type_display(), tx.amount, tx.currency.code, tx.date.isoformat(), tx.note or '']
+        headers = ["Type", "Amount", "Currency", "Date", "Note"]
+        return export_response(
+            request.GET['download'], f"partner_{partner_id}_transactions", headers,
+            iter_queryset(filtered_transactions, row)
+        )
+
     # PDF download
     if request.GET.get('download') == 'pdf':
-        from reportlab.lib import colors
         from reportlab.lib.units import mm
-        from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-        from reportlab.lib.styles import getSampleStyleSheet
-
-        response = HttpResponse(content_type='application/pdf')
-        response['Content-Disposition'] = f'attachment; filename="partner_{partner_id}_transactions.pdf"'
-        doc = SimpleDocTemplate(response, pagesize=A4, rightMargin=20, leftMargin=20, topMargin=30, bottomMargin=20)
-        elements = []
-        styles = getSampleStyleSheet()
-        title = Paragraph(f"Partner Transactions: {partner.full_name}", styles['Title'])
-        elements.append(title)
-        elements.append(Spacer(1, 8))
-        data = [
-            ["Type", "Amount", "Currency", "Date", "Note"]
-        ]
-        for tx in filtered_transactions:
-            data.append([
+
+        def pdf_row(tx):
+            return [
                 tx.get_transaction_type_display(),
                 f"{int(tx.amount):,}",
                 tx.currency.code,
                 tx.date.strftime('%Y-%m-%d'),
-                (tx.note or '')[:80]
-            ])
-        table = Table(data, colWidths=[30*mm, 30*mm, 30*mm, 35*mm, 60*mm])
-        table.setStyle(TableStyle([
-            ('BACKGROUND', (0,0), (-1,0), colors.lightgrey),
-            ('TEXTCOLOR', (0,0), (-1,0), colors.black),
-            ('ALIGN', (0,0), (-2,-1), 'CENTER'),
-            ('ALIGN', (4,1), (4,-1), 'RIGHT'),
-            ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
-            ('FONTNAME', (0,1), (-1,-1), 'Helvetica'),
-            ('FONTSIZE', (0,0), (-1,0), 12),
-            ('FONTSIZE', (0,1), (-1,-1), 10),
-            ('BOTTOMPADDING', (0,0), (-1,0), 8),
-            ('GRID', (0,0), (-1,-1), 0.5, colors.grey),
-        ]))
-        elements.append(table)
-        doc.build(elements)
-        return response
+                tx.note or '',
+            ]
+        return table_pdf_response(
+            f"partner_{partner_id}_transactions", f"Partner Transactions: {partner.full_name}",
+            ["Type", "Amount", "Currency", "Date", "Note"], iter_queryset(filtered_transactions, pdf_row),
+            col_widths=[30*mm, 30*mm, 30*mm, 35*mm, 60*mm],
+        )
 
     return render(request, 'finance/partner_transactions.html', {
         'partner': partner,
@@ -220,6 +209,7 @@ def partner_transactions(request, partner_id):
     })
 
 @require_GET
+@report_view
 def partner_transactions_pdf(request, partner_id):
     """
     Export the current partner transactions as a PDF for sharing/printing.
@@ -238,15 +228,7 @@ def partner_transactions_pdf(request, partner_id):
     tx_type = request.GET.get('transaction_type')
     date_from = request.GET.get('date_from')
     date_to = request.GET.get('date_to')
-    filtered_transactions = transactions
-    if currency_id:
-        filtered_transactions = filtered_transactions.filter(currency_id=currency_id)
-    if tx_type:
-        filtered_transactions = filtered_transactions.filter(transaction_type=tx_type)
-    if date_from:
-        filtered_transactions = filtered_transactions.filter(date__gte=date_from)
-    if date_to:
-        filtered_transactions = filtered_transactions.filter(date__lte=date_to)
+    filtered_transactions = _filter_partner_transactions(request, transactions)
 
     logo_url = request.build_absolute_uri('/static/logo.png')  # Adjust path as needed
 
@@ -319,62 +301,57 @@ def transaction_delete(request, tx_id):
 
 # --- Currency Purchases ---
 
-def currency_purchases_list(request):
-    # Filtering
+def _filter_currency_purchases(request, purchases):
     currency_id = request.GET.get('currency')
     date_from = request.GET.get('date_from')
     date_to = request.GET.get('date_to')
-    purchases = CurrencyExchange.objects.select_related('bought_currency').order_by('-pk')
     if currency_id:
         purchases = purchases.filter(bought_currency__id=currency_id)
     if date_from:
         purchases = purchases.filter(date__gte=date_from)
     if date_to:
         purchases = purchases.filter(date__lte=date_to)
+    return purchases
+
+@report_view
+def currency_purchases_list(request):
+    # Filtering
+    currency_id = request.GET.get('currency')
+    date_from = request.GET.get('date_from')
+    date_to = request.GET.get('date_to')
+    purchases = _filter_currency_purchases(request, CurrencyExchange.objects.select_related('bought_currency').order_by('-pk'))
     currencies = Currency.objects.all()
 
+    # CSV / XLSX download
+    if request.GET.get('download') in EXPORT_FORMATS:
+        purchases = purchases.select_related('sold_currency')
+
+        def row(purchase):
+            return [
+                purchase.bought_currency.code, purchase.bought_amount,
+                purchase.sold_currency.code, purchase.sold_amount,
+                purchase.exchange_rate, purchase.date.isoformat(), purchase.note or '',
+            ]
+        headers = ["Bought Currency", "Bought Amount", "Sold Currency", "Sold Amount", "Exchange Rate", "Date", "Note"]
+        return export_response(request.GET['download'], "currency_purchases", headers, iter_queryset(purchases, row))
+
     # PDF download
     if request.GET.get('download') == 'pdf':
-        from reportlab.lib import colors
         from reportlab.lib.units import mm
-        from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-        from reportlab.lib.styles import getSampleStyleSheet
-
-        response = HttpResponse(content_type='application/pdf')
-        response['Content-Disposition'] = 'attachment; filename="currency_purchases.pdf"'
-        doc = SimpleDocTemplate(response, pagesize=A4, rightMargin=20, leftMargin=20, topMargin=30, bottomMargin=20)
-        elements = []
-        styles = getSampleStyleSheet()
-        title = Paragraph("Currency Purchases Log", styles['Title'])
-        elements.append(title)
-        elements.append(Spacer(1, 8))
-        data = [
-            ["Currency", "Amount", "Exchange Rate", "Date", "Note"]
-        ]
-        for purchase in purchases:
-            data.append([
-                str(purchase.bought_currency.code),
+
+        def pdf_row(purchase):
+            return [
+                purchase.bought_currency.code,
                 f"{int(purchase.bought_amount):,}",
                 f"{int(purchase.exchange_rate):,}",
                 purchase.date.strftime('%Y-%m-%d'),
-                (purchase.note or '')[:80]
-            ])
-        table = Table(data, colWidths=[30*mm, 30*mm, 30*mm, 35*mm, 60*mm])
-        table.setStyle(TableStyle([
-            ('BACKGROUND', (0,0), (-1,0), colors.lightgrey),
-            ('TEXTCOLOR', (0,0), (-1,0), colors.black),
-            ('ALIGN', (0,0), (-2,-1), 'CENTER'),
-            ('ALIGN', (4,1), (4,-1), 'RIGHT'),
-            ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
-            ('FONTNAME', (0,1), (-1,-1), 'Helvetica'),
-            ('FONTSIZE', (0,0), (-1,0), 12),
-            ('FONTSIZE', (0,1), (-1,-1), 10),
-            ('BOTTOMPADDING', (0,0), (-1,0), 8),
-            ('GRID', (0,0), (-1,-1), 0.5, colors.grey),
-        ]))
-        elements.append(table)
-        doc.build(elements)
-        return response
+                purchase.note or '',
+            ]
+        return table_pdf_response(
+            "currency_purchases", "Currency Purchases Log",
+            ["Currency", "Amount", "Exchange Rate", "Date", "Note"], iter_queryset(purchases, pdf_row),
+            col_widths=[30*mm, 30*mm, 30*mm, 35*mm, 60*mm],
+        )
 
     return render(request, 'finance/currency_purchases_list.html', {
         'purchases': purchases,
@@ -392,29 +369,54 @@ def currency_purchase_add(request):
             # ensure sold amount is existed in the company balances
             sold_currency = form.cleaned_data['sold_currency']
             sold_amount = form.cleaned_data['sold_amount']
-            if sold_currency and sold_amount:
-                balance = calculate_company_balance(sold_currency)
-                if balance < sold_amount:
-                    form.add_error('sold_amount', f"Insufficient balance for {sold_currency.code}. Available: {balance}")
-                    return render(request, 'finance/currency_purchase_form.html', {'form': form, 'active_sidebar': 'currency_purchases'})
             # calculate exchange rate
             bought_currency = form.cleaned_data['bought_currency']
             bought_amount = form.cleaned_data['bought_amount']
             if bought_currency and bought_amount and sold_currency and sold_amount:
                 exchange_rate =  sold_amount /  bought_amount
                 form.instance.exchange_rate = exchange_rate
-            form.save()
+            try:
+                with spend(sold_currency.code, sold_amount or 0):
+                    form.save()
+            except InsufficientBalance as error:
+                form.add_error('sold_amount', f"Insufficient balance for {sold_currency.code}. Available: {error.balance}")
+                return render(request, 'finance/currency_purchase_form.html', {'form': form, 'active_sidebar': 'currency_purchases'})
             return redirect('currency_purchases_list')
     else:
         form = CurrencyPurchaseForm()
     return render(request, 'finance/currency_purchase_form.html', {'form': form, 'active_sidebar': 'currency_purchases'})
 
 def currency_purchase_edit(request, purchase_id):
-    purchase = get_object_or_404(CurrencyExchange, pk=purchase_id)
+    purchase = get_object_or_404(CurrencyExchange.objects.select_related('sold_currency', 'bought_currency'), pk=purchase_id)
+    # Read before validation writes the new values onto `purchase`
+    old_sold = (purchase.sold_currency.code, purchase.sold_amount)
+    old_bought = (purchase.bought_currency.code, purchase.bought_amount)
     if request.method == 'POST':
         form = CurrencyPurchaseForm(request.POST, instance=purchase)
         if form.is_valid():
-            form.save()
+            sold_currency = form.cleaned_data['sold_currency']
+            sold_amount = form.cleaned_data['sold_amount']
+            bought_currency = form.cleaned_data['bought_currency']
+            bought_amount = form.cleaned_data['bought_amount']
+            if bought_currency and bought_amount and sold_currency and sold_amount:
+                form.instance.exchange_rate = sold_amount / bought_amount
+            # What the edit takes out of each currency: the new sale less the
+            # old one, plus any bought amount that is given back. Only a
+            # currency that loses money needs to have it available.
+            spent = {}
+            for code, amount in (
+                (sold_currency.code, sold_amount), (old_sold[0], -old_sold[1]),
+                (old_bought[0], old_bought[1]), (bought_currency.code, -bought_amount),
+            ):
+                spent[code] = spent.get(code, 0) + amount
+            try:
+                with ExitStack() as guards:
+                    for code, amount in sorted(spent.items()):
+                        guards.enter_context(spend(code, amount))
+                    form.save()
+            except InsufficientBalance as error:
+                form.add_error('sold_amount', f"Insufficient balance for {error.currency_code}. Available: {error.balance}")
+                return render(request, 'finance/currency_purchase_form.html', {'form': form, 'purchase': purchase, 'active_sidebar': 'currency_purchases'})
             return redirect('currency_purchases_list')
     else:
         form = CurrencyPurchaseForm(instance=purchase)
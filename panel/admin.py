@@ -1,7 +1,7 @@
 from django.contrib import admin
 from .models import (
     Product, Shipment, Client, Area, Employee, Sale, SaleItem,
-    Invoice, Expense, Commission, ExchangeRate
+    Invoice, Expense, Commission, ExchangeRate, NotificationOutbox
 )
 
 @admin.register(Product)
@@ -68,3 +68,9 @@ class CommissionAdmin(admin.ModelAdmin):
 class ExchangeRateAdmin(admin.ModelAdmin):
     list_display = ('rate', 'updated_at')
     list_filter = ('updated_at',)
+
+@admin.register(NotificationOutbox)
+class NotificationOutboxAdmin(admin.ModelAdmin):
+    list_display = ('kind', 'title', 'status', 'attempts', 'created_at', 'sent_at')
+    search_fields = ('title', 'body', 'dedupe_key')
+    list_filter = ('status', 'kind')
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class PanelConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'panel'
+
+    def ready(self):
+        from .search import connect_signals
+        connect_signals()
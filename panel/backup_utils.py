@@ -0,0 +1,137 @@
+import os
+import re
+import sqlite3
+import time
+from datetime import datetime
+from pathlib import Path
+
+SNAPSHOT_NAME = '{prefix}-{stamp}.sqlite3'
+STAMP_FORMAT = '%Y%m%d-%H%M%S'
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+def online_backup(source_path, dest_path, pages=256, sleep=0.05, max_restarts=5):
+    """
+    Copy the SQLite database at `source_path` to `dest_path` with the online
+    backup API, `pages` pages per step with `sleep` seconds between steps,
+    so writers only wait for one short step at a time.
+
+    SQLite restarts a stepped backup whenever another connection writes to
+    the source. After `max_restarts` of those, the rest is copied in a single
+    step (one read transaction; under WAL that still doesn't block writers).
+
+    The copy is written to `dest_path`.partial and renamed into place, so
+    `dest_path` is always a complete snapshot. Returns a stats dict.
+    """
+    dest_path = Path(dest_path)
+    partial = dest_path.with_name(dest_path.name + '.partial')
+    stats = {'steps': 0, 'restarts': 0, 'pages': 0, 'bytes': 0, 'single_step': False}
+    previous = [None]
+
+    def progress(status, remaining, total):
+        stats['steps'] += 1
+        stats['pages'] = total
+        if previous[0] is not None and remaining > previous[0]:
+            stats['restarts'] += 1
+            if stats['restarts'] >= max_restarts:
+                raise _TooManyRestarts
+        previous[0] = remaining
+        if remaining and sleep:
+            time.sleep(sleep)
+
+    start = time.perf_counter()
+    source = sqlite3.connect(source_path)
+    try:
+        partial.unlink(missing_ok=True)
+        dest = sqlite3.connect(partial)
+        try:
+            try:
+                source.backup(dest, pages=pages, progress=progress)
+            except _TooManyRestarts:
+                stats['single_step'] = True
+                source.backup(dest)
+            # A plain rollback-journal file: opens read-only without -wal/-shm
+            dest.execute("PRAGMA journal_mode = DELETE")
+            page_size = dest.execute("PRAGMA page_size").fetchone()[0]
+            stats['pages'] = dest.execute("PRAGMA page_count").fetchone()[0]
+            stats['bytes'] = stats['pages'] * page_size
+        finally:
+            dest.close()
+    finally:
+        source.close()
+    os.replace(partial, dest_path)
+    stats['seconds'] = time.perf_counter() - start
+    return stats
+
+
+def check_integrity(path):
+    """
+    Run PRAGMA integrity_check on a snapshot. Returns a list of problems,
+    empty when the file is sound.
+    """
+    conn = sqlite3.connect(Path(path).resolve().as_uri() + '?mode=ro', uri=True)
+    try:
+        rows = [row[0] for row in conn.execute("PRAGMA integrity_check")]
+    finally:
+        conn.close()
+    return [] if rows == ['ok'] else rows
+
+
+def snapshot_path(directory, prefix, when=None):
+    """
+    Path for a new snapshot taken at `when`. A second snapshot within the
+    same second gets a -2, -3, ... suffix instead of replacing the first.
+    """
+    stamp = (when or datetime.now()).strftime(STAMP_FORMAT)
+    path = Path(directory) / SNAPSHOT_NAME.format(prefix=prefix, stamp=stamp)
+    sequence = 1
+    while path.exists() or path.with_name(path.name + '.partial').exists():
+        sequence += 1
+        path = Path(directory) / SNAPSHOT_NAME.format(prefix=prefix, stamp=f'{stamp}-{sequence}')
+    return path
+
+
+def list_snapshots(directory, prefix):
+    """
+    (taken_at, path) for the snapshots in `directory`, newest first.
+    """
+    pattern = re.compile(rf'^{re.escape(prefix)}-(\d{{8}}-\d{{6}})(?:-(\d+))?\.sqlite3$')
+    found = []
+    for path in Path(directory).glob(f'{prefix}-*.sqlite3'):
+        match = pattern.match(path.name)
+        if match:
+            found.append((datetime.strptime(match.group(1), STAMP_FORMAT), int(match.group(2) or 1), path))
+    # Same second: the higher suffix is the newer snapshot
+    return [(taken, path) for taken, _, path in sorted(found, reverse=True)]
+
+
+def rotate(directory, prefix, keep_last=7, keep_daily=7, keep_weekly=4, keep_monthly=6):
+    """
+    Prune old snapshots, keeping the newest `keep_last`, plus the newest
+    one of each of the last `keep_daily` days, `keep_weekly` ISO weeks and
+    `keep_monthly` months. Returns the deleted paths.
+    """
+    snapshots = list_snapshots(directory, prefix)
+    keep = {path for _, path in snapshots[:keep_last]}
+    for count, period in (
+        (keep_daily, lambda taken: taken.date()),
+        (keep_weekly, lambda taken: taken.isocalendar()[:2]),
+        (keep_monthly, lambda taken: (taken.year, taken.month)),
+    ):
+        seen = []
+        for taken, path in snapshots:
+            key = period(taken)
+            if key not in seen:
+                seen.append(key)
+                if len(seen) > count:
+                    break
+                keep.add(path)
+    deleted = []
+    for _, path in snapshots:
+        if path not in keep:
+            path.unlink()
+            deleted.append(path)
+    return deleted
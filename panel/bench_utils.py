@@ -0,0 +1,229 @@
+"""
+View benchmarks: every panel and finance page called through the Django
+test client on a fixed synthetic dataset (panel/seed_utils.py), measured
+for wall time, query count and peak Python memory, and compared with the
+committed baseline in panel/bench_baseline.json. Used by the bench_views
+command and the query-budget tests.
+"""
+import json
+import time
+import tracemalloc
+from contextlib import nullcontext
+from importlib import import_module
+from pathlib import Path
+
+from django.db import connection, transaction
+from django.urls import reverse
+
+from .perf import RequestTimer
+
+BASELINE_PATH = Path(__file__).resolve().parent / 'bench_baseline.json'
+
+BENCH_SEED = 42
+BENCH_DAYS = 365
+BENCH_VOLUMES = {
+    'areas': 10, 'clients': 300, 'employees': 12, 'managers': 3, 'products': 60, 'suppliers': 8,
+    'sales': 1500, 'items_per_sale': 4, 'return_rate': 0.02, 'expenses': 300, 'partners': 4,
+    'partner_transactions': 300, 'exchanges': 200,
+}
+
+# Must be in every run and in the baseline
+HOT_VIEWS = [
+    'panel:index', 'panel:sale_list', 'panel:sale_create', 'panel:sale_create [POST]',
+    'panel:employee_list', 'panel:debts', 'panel:net_profit_dashboard',
+    'financial_dashboard', 'partners_list',
+]
+
+# Actions (they change data on GET or only accept POST) and the
+# instrumentation pages themselves
+SKIP_VIEWS = {
+    'panel:product_delete', 'panel:invoice_mark_paid', 'panel:invoice_mark_unpaid',
+    'panel:invoice_add_payment', 'panel:supplier_add_payment', 'panel:sale_return_product',
+    'panel:commission_pay', 'panel:manager_commission_pay',
+    'panel:perf_stats', 'panel:perf_metrics', 'panel:profile_list', 'panel:profile_detail',
+    'panel:profile_download',
+}
+
+URLCONFS = (('panel.urls', 'panel:'), ('finance.urls', ''))
+
+
+def _models():
+    from finance.models import CurrencyExchange, Partner, PartnerTransaction
+    from .models import (
+        Area, Client, Employee, Expense, Invoice, Manager, Product, Sale, Shipment, Supplier,
+    )
+    # <int:pk> by URL name prefix, other parameters by name
+    by_prefix = {
+        'product': Product, 'sale': Sale, 'shipment': Shipment, 'employee': Employee,
+        'client': Client, 'area': Area, 'expense': Expense, 'invoice': Invoice,
+        'supplier': Supplier, 'manager': Manager,
+    }
+    by_param = {
+        'employee_id': Employee, 'manager_id': Manager, 'partner_id': Partner,
+        'tx_id': PartnerTransaction, 'purchase_id': CurrencyExchange,
+    }
+    return by_prefix, by_param
+
+
+def _argument(url_name, param, by_prefix, by_param):
+    if param == 'fmt':
+        return 'csv'
+    if param == 'kind':
+        return 'client'
+    model = by_param.get(param) if param != 'pk' else by_prefix.get(url_name.split('_')[0])
+    if model is None:
+        return None
+    # The lowest pk is the busiest client/product in the generated data
+    return model.objects.order_by('pk').values_list('pk', flat=True).first()
+
+
+def discover():
+    """
+    (view name, url) for every GET page of the panel and finance URL confs
+    that can be filled in from the current data.
+    """
+    by_prefix, by_param = _models()
+    found = []
+    for module, prefix in URLCONFS:
+        for pattern in import_module(module).urlpatterns:
+            if not pattern.name:
+                continue
+            view_name = prefix + pattern.name
+            # PDF exports are WeasyPrint-bound; bench_pdf covers them
+            if view_name in SKIP_VIEWS or pattern.name.endswith('_pdf'):
+                continue
+            params = list(getattr(pattern.pattern, 'converters', {}))
+            kwargs = {param: _argument(pattern.name, param, by_prefix, by_param) for param in params}
+            if None in kwargs.values():
+                continue
+            found.append((view_name, reverse(view_name, kwargs=kwargs)))
+    return found
+
+
+def sale_payload():
+    """
+    A valid sale_create POST for the current data, as the browser sends it.
+    """
+    from datetime import timedelta
+    from django.utils import timezone
+    from .models import Client, Employee, Inventory
+
+    inventory = Inventory.objects.filter(quantity__gte=5).order_by('pk').first()
+    return {
+        'client': Client.objects.order_by('pk').values_list('pk', flat=True).first(),
+        'employee': Employee.objects.order_by('pk').values_list('pk', flat=True).first(),
+        'due_date': (timezone.localdate() + timedelta(days=30)).isoformat(),
+        'items-TOTAL_FORMS': '1',
+        'items-INITIAL_FORMS': '0',
+        'items-0-product': inventory.product_id,
+        'items-0-batch': inventory.pk,
+        'items-0-quantity': '2',
+        'items-0-free_goods_discount': '0',
+        'items-0-price_discount': '0',
+    }
+
+
+def cases():
+    """
+    Everything to measure: (view name, method, url, POST data).
+    """
+    found = [(view_name, 'get', url, None) for view_name, url in discover()]
+    found.append(('panel:sale_create [POST]', 'post', reverse('panel:sale_create'), sale_payload()))
+    return sorted(found)
+
+
+def _call(client, method, url, data, counter=None):
+    # Rolled back, so pages that write (and the sale POST) leave the data as it was.
+    # The counter goes inside the atomic block so a savepoint is never counted.
+    with transaction.atomic():
+        with connection.execute_wrapper(counter) if counter else nullcontext():
+            response = getattr(client, method)(url, data) if data is not None else getattr(client, method)(url)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        else:
+            response.content
+        transaction.set_rollback(True)
+    return response
+
+
+def measure(client, method, url, data=None, repeat=5):
+    """
+    Status, query count, best wall time in ms and peak traced memory in
+    KiB of one page. The first call warms caches and counts the queries;
+    memory is traced on a separate call since tracing slows Python down.
+    The best of `repeat` calls is kept: noise only ever adds time.
+    """
+    # An execute wrapper rather than CaptureQueriesContext: the test client's
+    # request_started signal clears connection.queries mid-capture
+    counter = RequestTimer()
+    response = _call(client, method, url, data, counter)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        _call(client, method, url, data)
+        timings.append((time.perf_counter() - start) * 1000)
+    tracemalloc.start()
+    try:
+        _call(client, method, url, data)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {
+        'status': response.status_code,
+        'queries': counter.sql_count,
+        'ms': round(min(timings), 2),
+        'peak_kib': round(peak / 1024),
+    }
+
+
+def load_baseline(path=BASELINE_PATH):
+    path = Path(path)
+    return json.loads(path.read_text(encoding='utf-8')) if path.exists() else {'views': {}}
+
+
+def save_baseline(results, path=BASELINE_PATH, previous=None):
+    """
+    Write `results` as the new baseline. Existing query budgets are kept
+    (they only change by editing the file); new views get their current
+    query count as budget.
+    """
+    previous = (previous or {}).get('views', {})
+    views = {}
+    for name, result in sorted(results.items()):
+        budget = previous.get(name, {}).get('budget', result['queries'])
+        views[name] = dict(result, budget=budget)
+    data = {'seed': BENCH_SEED, 'days': BENCH_DAYS, 'volumes': BENCH_VOLUMES, 'views': views}
+    Path(path).write_text(json.dumps(data, indent=2, ensure_ascii=False) + '\n', encoding='utf-8')
+
+
+def compare(results, baseline, tolerance=50, min_delta_ms=10):
+    """
+    Compare `results` with `baseline`: a changed status or queries over
+    budget fail any page, wall time more than `tolerance` percent (and
+    `min_delta_ms`) slower fails the hot views and only warns for the rest.
+    Returns ({view name: [reason, ...]} failures, same for warnings).
+    """
+    failures, warnings = {}, {}
+    expected = baseline.get('views', {})
+    for name in HOT_VIEWS:
+        if name not in results:
+            failures.setdefault(name, []).append("hot path not measured")
+    for name, result in results.items():
+        base = expected.get(name)
+        if base is None:
+            continue
+        reasons = []
+        if result['status'] != base['status']:
+            reasons.append(f"status {result['status']} (baseline {base['status']})")
+        if result['queries'] > base['budget']:
+            reasons.append(f"{result['queries']} queries, budget {base['budget']}")
+        limit = base['ms'] * (1 + tolerance / 100)
+        if result['ms'] > limit and result['ms'] - base['ms'] > min_delta_ms:
+            slower = f"{result['ms']:.1f} ms, baseline {base['ms']:.1f} ms (+{tolerance}% allowed)"
+            if name in HOT_VIEWS:
+                reasons.append(slower)
+            else:
+                warnings[name] = [slower]
+        if reasons:
+            failures[name] = reasons
+    return failures, warnings
@@ -0,0 +1,104 @@
+"""
+Batches to act on before they become a loss, and writing them off in bulk.
+
+expiring_batches() finds in-stock batches that expire within N days
+(already expired ones included) through shipment_expiry_idx.
+dead_batches() finds batches that have sat in stock for N days without a
+sale. Both value the stock at its purchase cost (Shipment.cost_sdg).
+
+write_off() records the loss of many batches at once: one bulk_create of
+LostProduct rows and one F() update of the stock, in a single
+transaction, without the per-row queries of LostProduct.save(). The bulk
+update sends no post_save, so the low-stock check that Inventory.save()
+would trigger is run once per product after the commit instead.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Case, DecimalField, Exists, ExpressionWrapper, F, OuterRef, When
+from django.utils import timezone
+
+from .models import Inventory, LostProduct, SaleItem
+from .notifications import schedule_low_stock_check
+
+EXPIRY_DAYS = 30
+DEAD_STOCK_DAYS = 90
+
+_VALUE = DecimalField(max_digits=16, decimal_places=2)
+
+
+class WriteOffError(Exception):
+    def __init__(self, batches):
+        self.batches = batches
+        super().__init__(f"Not enough stock in batches {batches}")
+
+
+def _in_stock():
+    return (
+        Inventory.objects.filter(quantity__gt=0)
+        .select_related('product', 'shipment')
+        .annotate(value=ExpressionWrapper(F('quantity') * F('shipment__cost_sdg'), output_field=_VALUE))
+    )
+
+
+def expiring_batches(days=EXPIRY_DAYS, today=None):
+    """
+    In-stock batches expiring within `days` days or already expired,
+    soonest first, with their cost `value`.
+    """
+    today = today or timezone.localdate()
+    return (
+        _in_stock().filter(shipment__expiry_date__lte=today + timedelta(days=days))
+        .order_by('shipment__expiry_date', 'pk')
+    )
+
+
+def dead_batches(days=DEAD_STOCK_DAYS, now=None):
+    """
+    In-stock batches received more than `days` days ago with no sale in
+    the last `days` days, oldest first, with their cost `value`.
+    """
+    since = (now or timezone.now()) - timedelta(days=days)
+    recent_sales = SaleItem.objects.filter(inventory=OuterRef('pk'), sale__created_at__gte=since)
+    return (
+        _in_stock().filter(shipment__received_at__lt=since)
+        .exclude(Exists(recent_sales))
+        .order_by('shipment__received_at', 'pk')
+    )
+
+
+def write_off(quantities, note=''):
+    """
+    Record the loss of quantities[inventory id] units of each batch.
+    Returns the new LostProduct rows. Raises WriteOffError, and writes
+    nothing, if a batch is gone, holds fewer units than asked or is asked
+    for less than one.
+    """
+    quantities = {int(pk): int(quantity) for pk, quantity in quantities.items()}
+    if not quantities:
+        return []
+    invalid = [pk for pk, quantity in quantities.items() if quantity < 1]
+    if invalid:
+        raise WriteOffError(invalid)
+    with transaction.atomic():
+        # Take the write lock before reading the stock, so a sale can't
+        # take units between the check and the update
+        Inventory.objects.filter(pk__in=quantities).update(quantity=F('quantity'))
+        stock = {
+            pk: (quantity, product)
+            for pk, quantity, product in Inventory.objects.filter(pk__in=quantities).values_list('pk', 'quantity', 'product')
+        }
+        short = [pk for pk, quantity in quantities.items() if stock.get(pk, (0, None))[0] < quantity]
+        if short:
+            raise WriteOffError(short)
+        now = timezone.now()
+        lost = LostProduct.objects.bulk_create([
+            LostProduct(product_id=stock[pk][1], inventory_id=pk, quantity=quantity, note=note, lost_at=now)
+            for pk, quantity in quantities.items()
+        ])
+        Inventory.objects.filter(pk__in=quantities).update(
+            quantity=F('quantity') - Case(*[When(pk=pk, then=quantity) for pk, quantity in quantities.items()])
+        )
+        for product in {product for _, product in stock.values()}:
+            schedule_low_stock_check(product)
+    return lost
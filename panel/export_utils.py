@@ -0,0 +1,80 @@
+import csv
+import tempfile
+from django.http import StreamingHttpResponse, FileResponse, Http404
+
+# Rows fetched per round trip when streaming a queryset into an export
+EXPORT_CHUNK_SIZE = 2000
+
+EXPORT_FORMATS = ('csv', 'xlsx')
+
+
+class Echo:
+    """
+    File-like object that hands back whatever is written to it, so csv.writer
+    can format one row at a time without buffering the whole file.
+    """
+    def write(self, value):
+        return value
+
+
+def iter_queryset(queryset, row_func, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yield one export row per object, reading the queryset in chunks
+    instead of loading (and caching) every row at once.
+    """
+    for obj in queryset.iterator(chunk_size=chunk_size):
+        yield row_func(obj)
+
+
+def csv_response(filename, headers, rows):
+    """
+    Stream rows as a CSV attachment. Bytes start flowing as soon as the
+    first chunk is read from the database.
+    """
+    writer = csv.writer(Echo())
+
+    def stream():
+        # BOM so Excel opens the Arabic text as UTF-8
+        yield '\ufeff'
+        yield writer.writerow(headers)
+        for row in rows:
+            yield writer.writerow(row)
+
+    response = StreamingHttpResponse(stream(), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="{filename}.csv"'
+    return response
+
+
+def xlsx_response(filename, headers, rows, sheet_name='Sheet1'):
+    """
+    Write rows to an XLSX file in constant-memory mode (each row is flushed
+    to disk as soon as it is written) and return it as a file attachment.
+    """
+    import xlsxwriter
+
+    output = tempfile.TemporaryFile(suffix='.xlsx')
+    workbook = xlsxwriter.Workbook(output, {
+        'constant_memory': True,
+        'in_memory': False,
+        'remove_timezone': True,
+    })
+    worksheet = workbook.add_worksheet(sheet_name)
+    worksheet.right_to_left()
+    header_format = workbook.add_format({'bold': True, 'bg_color': '#f0f0f0'})
+    worksheet.write_row(0, 0, headers, header_format)
+    for row_index, row in enumerate(rows, start=1):
+        worksheet.write_row(row_index, 0, row)
+    workbook.close()
+    output.seek(0)
+    return FileResponse(output, as_attachment=True, filename=f'{filename}.xlsx')
+
+
+def export_response(fmt, filename, headers, rows):
+    """
+    Return the export in the requested format ('csv' or 'xlsx').
+    """
+    if fmt == 'csv':
+        return csv_response(filename, headers, rows)
+    if fmt == 'xlsx':
+        return xlsx_response(filename, headers, rows)
+    raise Http404("Unsupported export format.")
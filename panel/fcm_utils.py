@@ -1,102 +1,287 @@
-import requests
 import json
-from google.oauth2 import service_account
-from google.auth.transport.requests import Request
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
 from django.contrib.auth import get_user_model
 
-# Path to your Firebase service account JSON
+logger = logging.getLogger(__name__)
+
+# Defaults; override with the FCM_* settings
 FIREBASE_SERVICE_ACCOUNT_FILE = '/home/mazin/projects/maha/firebase_service_account.json'
 FCM_PROJECT_ID = 'alsinary-973fa'  # Replace with your project ID
+FCM_ENDPOINT = 'https://fcm.googleapis.com/v1/projects/{project_id}/messages:send'
+FCM_SCOPES = ["https://www.googleapis.com/auth/firebase.messaging"]
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# The only FCM error meaning the device token will never work again.
+# INVALID_ARGUMENT is also returned for a bad payload, so it is logged as a
+# failure instead of dropping a token that may be fine.
+INVALID_TOKEN_ERRORS = {'UNREGISTERED'}
+# Longest wait between retries, whatever Retry-After asks for (seconds)
+MAX_RETRY_DELAY = 30
+
+
+class ServiceAccountTokenSource:
+    """
+    OAuth access token for the Firebase service account, refreshed only when
+    it is missing or about to expire.
+    """
+    def __init__(self, service_account_file, scopes=FCM_SCOPES, leeway=60):
+        self.service_account_file = service_account_file
+        self.scopes = scopes
+        self.leeway = timedelta(seconds=leeway)
+        self._credentials = None
+        self._lock = threading.Lock()
+
+    def _expiring(self):
+        creds = self._credentials
+        if creds is None or not creds.token:
+            return True
+        if creds.expiry is None:
+            return False
+        # google-auth stores expiry as a naive UTC datetime
+        now = datetime.now(dt_timezone.utc).replace(tzinfo=None)
+        return creds.expiry - self.leeway <= now
+
+    def __call__(self):
+        with self._lock:
+            if self._expiring():
+                from google.oauth2 import service_account
+                from google.auth.transport.requests import Request
+                if self._credentials is None:
+                    self._credentials = service_account.Credentials.from_service_account_file(
+                        self.service_account_file, scopes=self.scopes
+                    )
+                self._credentials.refresh(Request())
+                logger.info("FCM access token refreshed, expires %s", self._credentials.expiry)
+            return self._credentials.token
+
+    def invalidate(self):
+        with self._lock:
+            if self._credentials is not None:
+                self._credentials.token = None
+
+
+class FCMDispatcher:
+    """
+    Sends one FCM message per device token over a pooled HTTP session, with
+    bounded concurrency and retry/backoff on throttling and server errors.
+
+    `token_source` is a callable returning an OAuth access token (and may
+    have an `invalidate()` method); `endpoint` may point at a local stub.
+    """
+    def __init__(self, endpoint=None, token_source=None, max_workers=None, max_retries=None,
+                 timeout=None, backoff=0.5, max_retry_delay=None):
+        project_id = getattr(settings, 'FCM_PROJECT_ID', FCM_PROJECT_ID)
+        self.endpoint = (endpoint or getattr(settings, 'FCM_ENDPOINT', FCM_ENDPOINT)).format(project_id=project_id)
+        self.token_source = token_source or ServiceAccountTokenSource(
+            getattr(settings, 'FCM_SERVICE_ACCOUNT_FILE', FIREBASE_SERVICE_ACCOUNT_FILE)
+        )
+        self.max_workers = max_workers or getattr(settings, 'FCM_MAX_WORKERS', 8)
+        self.max_retries = max_retries if max_retries is not None else getattr(settings, 'FCM_MAX_RETRIES', 3)
+        self.timeout = timeout or getattr(settings, 'FCM_TIMEOUT', 10)
+        self.backoff = backoff
+        self.max_retry_delay = max_retry_delay or getattr(settings, 'FCM_MAX_RETRY_DELAY', MAX_RETRY_DELAY)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def _retry_delay(self, attempt, response=None):
+        delay = self.backoff * (2 ** attempt) * (1 + random.random())
+        if response is not None and response.headers.get('Retry-After', '').isdigit():
+            delay = max(delay, int(response.headers['Retry-After']))
+        # A send runs inside a worker thread; don't let one throttled
+        # message hold it for minutes
+        return min(delay, self.max_retry_delay)
+
+    def _sleep_before_retry(self, attempt, response=None):
+        time.sleep(self._retry_delay(attempt, response))
+
+    @staticmethod
+    def _error_code(response):
+        try:
+            error = response.json().get('error', {})
+        except ValueError:
+            return None
+        for detail in error.get('details', []):
+            if detail.get('errorCode'):
+                return detail['errorCode']
+        return error.get('status')
+
+    def send_one(self, message):
+        """
+        Send one message; returns 'sent', 'invalid' or 'failed'.
+        """
+        token_refreshed = False
+        attempt = 0
+        while True:
+            headers = {
+                "Authorization": f"Bearer {self.token_source()}",
+                "Content-Type": "application/json; UTF-8",
+            }
+            try:
+                response = self.session.post(self.endpoint, headers=headers, data=json.dumps(message), timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as exc:
+                if attempt >= self.max_retries:
+                    logger.warning("FCM send failed after %s attempts: %s", attempt + 1, exc)
+                    return 'failed'
+                self._sleep_before_retry(attempt)
+                attempt += 1
+                continue
+
+            if response.status_code == 200:
+                return 'sent'
+            if response.status_code == 401 and not token_refreshed and hasattr(self.token_source, 'invalidate'):
+                self.token_source.invalidate()
+                token_refreshed = True
+                continue
+            if response.status_code in RETRY_STATUSES and attempt < self.max_retries:
+                self._sleep_before_retry(attempt, response)
+                attempt += 1
+                continue
+            code = self._error_code(response)
+            if response.status_code == 404 and code in INVALID_TOKEN_ERRORS:
+                return 'invalid'
+            logger.warning("FCM send failed: %s %s", response.status_code, code or response.text[:200])
+            return 'failed'
+
+    def send(self, tokens, build_message):
+        """
+        Fan `build_message(token)` out to every token. Returns a dict with
+        'sent' and 'failed' counts and the list of 'invalid' tokens.
+        """
+        tokens = list(dict.fromkeys(t for t in tokens if t))
+        result = {'sent': 0, 'failed': 0, 'invalid': []}
+        if not tokens:
+            return result
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(tokens))) as pool:
+            outcomes = pool.map(lambda token: self.send_one(build_message(token)), tokens)
+            for token, outcome in zip(tokens, outcomes):
+                if outcome == 'invalid':
+                    result['invalid'].append(token)
+                else:
+                    result[outcome] += 1
+        logger.info("FCM batch: %s sent, %s failed, %s invalid tokens", result['sent'], result['failed'], len(result['invalid']))
+        return result
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    """
+    Process-wide dispatcher, so the access token and HTTP connections are reused.
+    """
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = FCMDispatcher()
+        return _dispatcher
+
 
 def get_access_token():
-    credentials = service_account.Credentials.from_service_account_file(
-        FIREBASE_SERVICE_ACCOUNT_FILE,
-        scopes=["https://www.googleapis.com/auth/firebase.messaging"]
-    )
-    credentials.refresh(Request())
-    print("Access token obtained successfully.")
-    print(f"Access token: {credentials.token}")  # Debugging line to check the token
-    return credentials.token
+    return get_dispatcher().token_source()
 
-def send_fcm_notification_to_staff(title, body, data=None, order_id=None, type="house"):
-    print("Preparing to send FCM notification to staff...")
-    User = get_user_model()
-    staff_users = User.objects.filter(is_active=True).filter(is_staff=True) | User.objects.filter(is_superuser=True)
-    print(f"Found {staff_users.count()} staff users to send notifications to.")
-    if not staff_users.exists():
-        print("No staff users found to send notifications.")
-        return
-    tokens = []
-    for user in staff_users.distinct():
-        token = getattr(getattr(user, 'profile', user), 'fcm_token', None)
-        if token:
-            tokens.append(token)
-    if not tokens:
-        print("No FCM tokens found for staff or superusers.")
-        return
-
-    access_token = get_access_token()
-    url = f"https://fcm.googleapis.com/v1/projects/{FCM_PROJECT_ID}/messages:send"
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json; UTF-8",
-    }
-    safe_data = {str(k): str(v) for k, v in (data or {}).items()}
-    # if order_id:
-    order_id = str(safe_data["appointment_id"])
-    type = safe_data["type"]
-    if type == "construction":
-        order_url = f"/maha/admin-panel/show-construction-appointment/{order_id}/"
-    else:
-        order_url = f"/maha/admin-panel/show-appointment/{order_id}/"
-    # else:
-    #     order_url = "/"
 
-    for token in tokens:
-        message = {
-            "message": {
-                "token": token,
+def build_staff_message(token, title, body, safe_data, order_url):
+    return {
+        "message": {
+            "token": token,
+            "notification": {
+                "title": title,
+                "body": body,
+            },
+            "data": safe_data,
+            "android": {
+                "priority": "HIGH",
                 "notification": {
-                    "title": title,
-                    "body": body,
+                    "sound": "default",
+                    "color": "#1c6cb8",
+                    "click_action": "VIEW_ORDER",
+                    "channel_id": "default_channel",
                 },
-                "data": safe_data,
-                "android": {
-                    "priority": "HIGH",
-                    "notification": {
+            },
+            "apns": {
+                "payload": {
+                    "aps": {
                         "sound": "default",
-                        "color": "#1c6cb8",
-                        "click_action": "VIEW_ORDER",
-                        "channel_id": "default_channel",
-                    },
-                },
-                "apns": {
-                    "payload": {
-                        "aps": {
-                            "sound": "default",
-                            "category": "VIEW_ORDER",
-                            "content-available": 1,
-                        }
-                    },
-                    "headers": {
-                        "apns-priority": "10",
+                        "category": "VIEW_ORDER",
+                        "content-available": 1,
                     }
                 },
-                "webpush": {
-                    "headers": {
-                        "Urgency": "high"
-                    },
-                    "notification": {
-                        "icon": "/home/mazin/maha/static/img/micro.svg",
-                        "badge": "/home/mazin/maha/static/img/micro.svg",
-                        "click_action": order_url,
-                    }
+                "headers": {
+                    "apns-priority": "10",
+                }
+            },
+            "webpush": {
+                "headers": {
+                    "Urgency": "high"
+                },
+                "notification": {
+                    "icon": "/home/mazin/maha/static/img/micro.svg",
+                    "badge": "/home/mazin/maha/static/img/micro.svg",
+                    "click_action": order_url,
                 }
             }
         }
-        response = requests.post(url, headers=headers, data=json.dumps(message))
-        if response.status_code == 200:
-            print(f"Notification sent successfully to {token}")
-        else:
-            print(f"Failed to send notification to {token}: {response.status_code} - {response.text}")
-        # Optionally log or handle errors here
+    }
+
+
+def _clear_invalid_tokens(owners, invalid):
+    for owner in owners:
+        if getattr(owner, 'fcm_token', None) in invalid:
+            owner.fcm_token = None
+            owner.save(update_fields=['fcm_token'])
+            logger.info("Dropped invalid FCM token for %s", owner)
+
+
+def _staff_token_owners():
+    User = get_user_model()
+    staff_users = User.objects.filter(is_active=True).filter(is_staff=True) | User.objects.filter(is_superuser=True)
+    owners = []
+    for user in staff_users.distinct():
+        owner = getattr(user, 'profile', user)
+        if getattr(owner, 'fcm_token', None):
+            owners.append(owner)
+    return owners
+
+
+def notify_staff(title, body, data=None, url='/', dispatcher=None):
+    """
+    Push one notification to every active staff member and superuser with
+    an FCM token. Returns the dispatcher result, or None if nobody has a token.
+    """
+    owners = _staff_token_owners()
+    if not owners:
+        logger.info("No FCM tokens found for staff or superusers.")
+        return None
+    safe_data = {str(k): str(v) for k, v in (data or {}).items()}
+    dispatcher = dispatcher or get_dispatcher()
+    result = dispatcher.send(
+        [owner.fcm_token for owner in owners],
+        lambda token: build_staff_message(token, title, body, safe_data, url),
+    )
+    if result['invalid']:
+        _clear_invalid_tokens(owners, set(result['invalid']))
+    return result
+
+
+def send_fcm_notification_to_staff(title, body, data=None, order_id=None, type="house", dispatcher=None):
+    safe_data = {str(k): str(v) for k, v in (data or {}).items()}
+    order_id = safe_data.get("appointment_id", order_id)
+    type = safe_data.get("type", type)
+    if type == "construction":
+        order_url = f"/maha/admin-panel/show-construction-appointment/{order_id}/"
+    else:
+        order_url = f"/maha/admin-panel/show-appointment/{order_id}/"
+
+    return notify_staff(title, body, safe_data, order_url, dispatcher=dispatcher)
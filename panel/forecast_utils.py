@@ -0,0 +1,153 @@
+"""
+Stock forecasting from sales velocity.
+
+Units sold per product per day over the last HISTORY_DAYS days come from
+one grouped SaleItem query: paid plus free units, less what was returned.
+They are laid out as a products x days NumPy array. Two velocities are
+computed for every product at once:
+
+- the moving average over the last MOVING_AVERAGE_DAYS days;
+- an exponentially smoothed average, weighting day k back by
+  (1 - SMOOTHING)**k. This one drives the forecast because it reacts
+  faster to a change in demand.
+
+Batches are used first-expired-first-out. Stock that will still be on the
+shelf when its batch expires cannot be sold; it is reported as expiring and
+not counted as cover. The reorder quantity brings the usable stock up to
+LEAD_TIME_DAYS + COVER_DAYS of sales.
+"""
+import math
+from datetime import timedelta
+
+from django.db.models import F, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Cast, Coalesce, TruncDate
+from django.utils import timezone
+
+from .periods import date_range, in_period
+
+HISTORY_DAYS = 90
+MOVING_AVERAGE_DAYS = 28
+SMOOTHING = 0.1
+LEAD_TIME_DAYS = 30
+COVER_DAYS = 30
+
+
+def daily_units(start, end):
+    """
+    {(product id, date): net units} for sales made between the dates
+    `start` and `end` (inclusive).
+    """
+    from .models import ReturnedProduct, SaleItem
+
+    returned = (
+        ReturnedProduct.objects.filter(sale_item=OuterRef('pk')).values('sale_item')
+        .annotate(total=Sum('quantity')).values('total')
+    )
+    # Free units are floor(quantity * free_goods_discount / 100), as SaleItem.free_units
+    free = Cast(F('quantity') * F('free_goods_discount') / 100, IntegerField())
+    rows = (
+        SaleItem.objects.filter(**in_period('sale__created_at', date_range(start, end)))
+        .values(product=F('inventory__product'), day=TruncDate('sale__created_at'))
+        .annotate(units=Sum(F('quantity') + free - Coalesce(Subquery(returned), Value(0))))
+        .values_list('product', 'day', 'units')
+    )
+    return {(product, day): units for product, day, units in rows}
+
+
+def velocities(units, moving_average_days=MOVING_AVERAGE_DAYS, smoothing=SMOOTHING):
+    """
+    Moving-average and exponentially smoothed units per day for every row
+    of `units` (products x days, oldest day first).
+    """
+    import numpy as np
+
+    days = units.shape[1]
+    moving_average = units[:, -moving_average_days:].mean(axis=1)
+    weights = (1 - smoothing) ** np.arange(days)[::-1]
+    smoothed = units @ weights / weights.sum()
+    return moving_average, smoothed
+
+
+def usable_stock(batches, velocity):
+    """
+    Units of `batches` [(quantity, days until expiry), ...] that can be
+    sold before they expire at `velocity` units a day, oldest expiry first.
+    """
+    sold = 0.0
+    for quantity, days_left in sorted(batches, key=lambda batch: batch[1]):
+        # Everything sold by the day this batch expires, this batch included
+        sold = max(sold, min(sold + quantity, velocity * max(days_left, 0)))
+    return sold
+
+
+def forecast(today=None, history_days=HISTORY_DAYS, lead_time_days=LEAD_TIME_DAYS, cover_days=COVER_DAYS):
+    """
+    One row per product with stock or sales in the history window, the
+    soonest stock-out first (products that don't sell come last).
+    """
+    import numpy as np
+    from .models import Inventory, Product
+
+    today = today or timezone.localdate()
+    start = today - timedelta(days=history_days)
+    sold = daily_units(start, today - timedelta(days=1))
+
+    batches = {}
+    for product, quantity, expiry in (
+        Inventory.objects.filter(quantity__gt=0)
+        .values_list('product', 'quantity', 'shipment__expiry_date')
+    ):
+        batches.setdefault(product, []).append((quantity, (expiry - today).days))
+
+    product_ids = sorted({product for product, _ in sold} | set(batches))
+    names = dict(Product.objects.filter(pk__in=product_ids).values_list('pk', 'name'))
+    index = {product: row for row, product in enumerate(product_ids)}
+
+    units = np.zeros((len(product_ids), history_days))
+    if sold:
+        rows = np.array([index[product] for product, _ in sold])
+        columns = np.array([(day - start).days for _, day in sold])
+        np.add.at(units, (rows, columns), np.array([float(value) for value in sold.values()]))
+    moving_average, smoothed = velocities(units) if product_ids else (units[:, 0], units[:, 0])
+
+    result = []
+    for product, row in index.items():
+        velocity = float(smoothed[row])
+        stock = sum(quantity for quantity, _ in batches.get(product, []))
+        usable = usable_stock(batches.get(product, []), velocity) if velocity > 0 else 0.0
+        days_of_cover = usable / velocity if velocity > 0 else None
+        target = velocity * (lead_time_days + cover_days)
+        result.append({
+            'product_id': product,
+            'product': names.get(product, ''),
+            'stock': stock,
+            'expiring': stock - int(usable) if velocity > 0 else stock,
+            'sold': int(units[row].sum()),
+            'moving_average': float(moving_average[row]),
+            'velocity': velocity,
+            'days_of_cover': days_of_cover,
+            'stockout_date': today + timedelta(days=int(days_of_cover)) if days_of_cover is not None else None,
+            'reorder': max(0, math.ceil(target - usable)),
+        })
+    result.sort(key=lambda row: (row['days_of_cover'] is None, row['days_of_cover'] or 0, row['product']))
+    return result
+
+
+def forecast_rows(rows):
+    """
+    Headers and export rows for forecast() output.
+    """
+    headers = [
+        "المنتج", "المخزون", "غير قابل للبيع قبل الانتهاء", "المبيع خلال الفترة", "المتوسط المتحرك/يوم",
+        "معدل البيع/يوم", "أيام التغطية", "تاريخ النفاد", "كمية إعادة الطلب",
+    ]
+
+    def row(item):
+        return [
+            item['product'], item['stock'], item['expiring'], item['sold'], round(item['moving_average'], 2),
+            round(item['velocity'], 2),
+            round(item['days_of_cover']) if item['days_of_cover'] is not None else '',
+            item['stockout_date'].isoformat() if item['stockout_date'] else '',
+            item['reorder'],
+        ]
+    return headers, (row(item) for item in rows)
@@ -0,0 +1,302 @@
+"""
+Concurrent write load against a running server (see the load_test command).
+
+Worker threads each keep their own session (cookies and CSRF token, as a
+browser would) and post a random mix of sales, invoice payments, returns,
+expenses and supplier payments through the real views. The rows they
+write to are drawn from a small "hot" set so that requests actually race
+on the same batches, invoices and balances.
+
+Every request is classified by its response:
+
+- ok: the view redirected (a saved form);
+- rejected: the form came back with errors (200) or a 4xx;
+- locked: a 500 whose page mentions "database is locked" (DEBUG only;
+  with DEBUG off a lock shows up as a plain error);
+- error: any other 500, a timeout or a refused connection.
+
+Payment and return views redirect on validation errors as well, so for
+them a rejection counts as ok; the invariant checks afterwards are what
+tell whether the data is still right.
+"""
+import random
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import connection
+from django.db.models import Count, DecimalField, F, Sum, Value
+from django.db.models.functions import Coalesce
+from django.urls import reverse
+from django.utils import timezone
+
+DEFAULT_MIX = {'sale': 40, 'payment': 25, 'return': 10, 'expense': 15, 'supplier_payment': 10}
+
+OUTCOMES = ('ok', 'rejected', 'locked', 'error')
+
+NEGATIVE_STOCK_SQL = "SELECT COUNT(*) FROM panel_inventory WHERE quantity < 0"
+
+
+def parse_mix(text):
+    """
+    "sale=50,expense=10" -> {'sale': 50, 'expense': 10}
+    """
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in DEFAULT_MIX:
+            raise ValueError(f"Unknown operation '{name}' (choose from {', '.join(DEFAULT_MIX)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+class Targets:
+    """
+    The rows the workers write to, read once from the database before the
+    run: the busiest batches, open invoices, returnable sale items and
+    suppliers with something left to pay.
+    """
+    def __init__(self, hot=10):
+        from .models import Client, Employee, Inventory, Invoice, SaleItem, Supplier
+
+        self.batches = list(
+            Inventory.objects.filter(quantity__gt=0).order_by('-quantity')
+            .values_list('pk', 'product_id')[:hot]
+        )
+        self.invoices = list(
+            Invoice.objects.exclude(status='paid')
+            .annotate(paid=Coalesce(Sum('payments__amount'), Value(Decimal('0')), output_field=DecimalField()))
+            .annotate(remaining=F('sale__total') - F('paid'))
+            .filter(remaining__gt=1).order_by('-pk')
+            .values_list('pk', 'remaining')[:hot]
+        )
+        self.sale_items = list(
+            SaleItem.objects.annotate(returned=Coalesce(Sum('returns__quantity'), Value(0)))
+            .filter(quantity__gt=F('returned')).order_by('-pk')
+            .values_list('pk', 'sale_id')[:hot]
+        )
+        self.suppliers = list(
+            Supplier.objects.annotate(shipments_count=Count('shipments')).filter(shipments_count__gt=0)
+            .order_by('pk').values_list('pk', flat=True)[:hot]
+        )
+        self.clients = list(Client.objects.order_by('pk').values_list('pk', flat=True)[:200])
+        self.employees = list(Employee.objects.order_by('pk').values_list('pk', flat=True))
+
+    def missing(self, mix):
+        """
+        Operations in `mix` that have nothing to write to.
+        """
+        needs = {
+            'sale': self.batches and self.clients and self.employees,
+            'payment': self.invoices,
+            'return': self.sale_items,
+            'expense': True,
+            'supplier_payment': self.suppliers,
+        }
+        return [name for name in mix if not needs[name]]
+
+
+def build_request(name, rng, targets):
+    """
+    (path, POST data) of one `name` operation, as the browser forms send it.
+    """
+    if name == 'sale':
+        batch, product = rng.choice(targets.batches)
+        return reverse('panel:sale_create'), {
+            'client': rng.choice(targets.clients),
+            'employee': rng.choice(targets.employees),
+            'due_date': (timezone.localdate() + timedelta(days=30)).isoformat(),
+            'items-TOTAL_FORMS': '1',
+            'items-INITIAL_FORMS': '0',
+            'items-0-product': product,
+            'items-0-batch': batch,
+            'items-0-quantity': rng.randint(1, 3),
+            'items-0-free_goods_discount': '0',
+            'items-0-price_discount': '0',
+        }
+    if name == 'payment':
+        # Settling what was open before the run: racing payments on the
+        # same invoice must not add up to more than its total
+        invoice, remaining = rng.choice(targets.invoices)
+        remaining = float(remaining)
+        amount = remaining if rng.random() < 0.5 else rng.uniform(1, remaining)
+        return reverse('panel:invoice_add_payment', args=[invoice]), {'amount': f'{amount:.2f}', 'note': 'load test'}
+    if name == 'return':
+        sale_item, sale = rng.choice(targets.sale_items)
+        return reverse('panel:sale_return_product', args=[sale]), {
+            'sale_item': sale_item, 'quantity': 1, 'note': 'load test',
+        }
+    if name == 'expense':
+        return reverse('panel:expense_add'), {
+            'description': 'load test', 'amount': rng.randint(1000, 50000),
+            'date': timezone.localdate().isoformat(),
+        }
+    supplier = rng.choice(targets.suppliers)
+    return reverse('panel:supplier_add_payment', args=[supplier]), {
+        'amount': rng.randint(1, 500), 'note': 'load test',
+    }
+
+
+class Session:
+    """
+    One simulated browser: cookies plus CSRF token.
+    """
+    def __init__(self, base_url, timeout=30):
+        import requests
+
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.http = requests.Session()
+
+    def start(self):
+        # Any form page sets the csrftoken cookie
+        self.http.get(self.base_url + reverse('panel:expense_add'), timeout=self.timeout)
+        if not self.http.cookies.get('csrftoken'):
+            raise RuntimeError(f"No CSRF cookie from {self.base_url}; is this the panel server?")
+
+    def post(self, path, data):
+        """
+        (status, body) of a POST; a refused connection or a timeout is status 0.
+        """
+        import requests
+
+        token = self.http.cookies.get('csrftoken', '')
+        try:
+            response = self.http.post(
+                self.base_url + path, data=dict(data, csrfmiddlewaretoken=token),
+                headers={'Referer': self.base_url + path}, allow_redirects=False, timeout=self.timeout,
+            )
+        except requests.RequestException as error:
+            return 0, str(error).encode()
+        return response.status_code, response.content
+
+
+def classify(status, body):
+    if 300 <= status < 400:
+        return 'ok'
+    if status == 200 or 400 <= status < 500:
+        return 'rejected'
+    if status >= 500 and b'database is locked' in body:
+        return 'locked'
+    return 'error'
+
+
+class Results:
+    """
+    Latencies and outcomes per operation, shared by the worker threads.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.outcomes = defaultdict(lambda: dict.fromkeys(OUTCOMES, 0))
+        self.errors = []
+
+    def add(self, name, outcome, ms, status=None, body=b''):
+        with self.lock:
+            self.latencies[name].append(ms)
+            self.outcomes[name][outcome] += 1
+            if outcome == 'error' and len(self.errors) < 10:
+                self.errors.append(f"{name}: HTTP {status} {body[:200].decode(errors='replace')}")
+
+    def rows(self, elapsed):
+        """
+        Per operation and in total: count, throughput, outcome counts and
+        p50/p90/p99/max latency in ms.
+        """
+        rows = []
+        everything = [ms for values in self.latencies.values() for ms in values]
+        names = sorted(self.latencies) + ['total']
+        for name in names:
+            values = sorted(everything if name == 'total' else self.latencies[name])
+            if name == 'total':
+                outcomes = {key: sum(o[key] for o in self.outcomes.values()) for key in OUTCOMES}
+            else:
+                outcomes = self.outcomes[name]
+            rows.append(dict(
+                outcomes, name=name, count=len(values), rps=len(values) / elapsed if elapsed else 0,
+                p50=percentile(values, 50), p90=percentile(values, 90), p99=percentile(values, 99),
+                max=values[-1] if values else 0,
+            ))
+        return rows
+
+
+def percentile(ordered, pct):
+    if not ordered:
+        return 0
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def worker(base_url, mix, targets, results, seed, deadline, max_requests, timeout):
+    rng = random.Random(seed)
+    names, weights = list(mix), list(mix.values())
+    session = Session(base_url, timeout=timeout)
+    try:
+        session.start()
+    except Exception as error:  # refused connection, no CSRF cookie, ...
+        results.add('session', 'error', 0, 0, str(error).encode())
+        return
+    done = 0
+    while time.monotonic() < deadline and (not max_requests or done < max_requests):
+        name = rng.choices(names, weights)[0]
+        path, data = build_request(name, rng, targets)
+        start = time.perf_counter()
+        status, body = session.post(path, data)
+        ms = (time.perf_counter() - start) * 1000
+        results.add(name, classify(status, body), ms, status, body)
+        done += 1
+
+
+def run(base_url, mix, targets, clients=8, duration=30, max_requests=0, seed=1, timeout=30):
+    """
+    Run `clients` workers for `duration` seconds (or `max_requests` each).
+    Returns (Results, elapsed seconds).
+    """
+    results = Results()
+    deadline = time.monotonic() + duration
+    threads = [
+        threading.Thread(
+            target=worker, daemon=True,
+            args=(base_url, mix, targets, results, seed + number, deadline, max_requests, timeout),
+        )
+        for number in range(clients)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - start
+
+
+def balances():
+    """
+    Company balance per currency code, from the ledger.
+    """
+    from finance.balance_utils import calculate_company_balances
+    return {code: float(totals['balance']) for code, totals in calculate_company_balances().items()}
+
+
+def verify(balances_before):
+    """
+    Invariant checks after a run: everything check_invariants() covers
+    (stock per batch against the sales, returns and losses; invoice status
+    against its payments; ...), no negative stock, and no currency the
+    balance guards let go below zero (or below where it already was).
+    """
+    from .seed_utils import check_invariants
+
+    problems = check_invariants()
+    with connection.cursor() as cursor:
+        cursor.execute(NEGATIVE_STOCK_SQL)
+        negative = cursor.fetchone()[0]
+    if negative:
+        problems.append(f"negative stock: {negative} batches")
+    for code, balance in balances().items():
+        floor = min(balances_before.get(code, 0), 0)
+        if balance < floor - 0.005:
+            problems.append(f"{code} balance {balance:,.2f} went below {floor:,.2f}")
+    return problems
@@ -0,0 +1,60 @@
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from panel.backup_utils import check_integrity, online_backup, rotate, snapshot_path
+
+
+class Command(BaseCommand):
+    help = (
+        'Take a consistent snapshot of the SQLite database while the app keeps running, '
+        'verify it with PRAGMA integrity_check and prune old snapshots.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+        parser.add_argument('--dest', default=str(settings.BACKUP_DIR),
+                            help="Directory the snapshots are written to")
+        parser.add_argument('--prefix', default='db')
+        parser.add_argument('--pages', type=int, default=256, help="Pages copied per backup step")
+        parser.add_argument('--sleep', type=float, default=0.05, help="Seconds to pause between steps")
+        parser.add_argument('--keep-last', type=int, default=7)
+        parser.add_argument('--keep-daily', type=int, default=7)
+        parser.add_argument('--keep-weekly', type=int, default=4)
+        parser.add_argument('--keep-monthly', type=int, default=6)
+        parser.add_argument('--no-rotate', action='store_true', help="Keep every snapshot")
+
+    def handle(self, *args, **options):
+        db = connections[options['database']]
+        if db.vendor != 'sqlite' or db.is_in_memory_db():
+            raise CommandError("backup_db only supports file-based SQLite databases")
+        source = Path(db.settings_dict['NAME'])
+        dest_dir = Path(options['dest'])
+        dest_dir.mkdir(parents=True, exist_ok=True)
+        target = snapshot_path(dest_dir, options['prefix'])
+
+        stats = online_backup(source, target, pages=options['pages'], sleep=options['sleep'])
+        self.stdout.write(
+            f"Backed up {source} to {target}: {stats['bytes'] / 1048576:.1f} MiB "
+            f"({stats['pages']} pages) in {stats['seconds']:.2f}s, {stats['steps']} steps"
+            + (f", {stats['restarts']} restarts" if stats['restarts'] else '')
+            + (" (finished in one step after repeated restarts)" if stats['single_step'] else '')
+        )
+
+        problems = check_integrity(target)
+        if problems:
+            bad = target.with_name(target.name + '.corrupt')
+            target.replace(bad)
+            raise CommandError(f"Integrity check failed, kept as {bad}: {'; '.join(problems[:5])}")
+        self.stdout.write("Integrity check: ok")
+
+        if not options['no_rotate']:
+            deleted = rotate(
+                dest_dir, options['prefix'],
+                keep_last=options['keep_last'], keep_daily=options['keep_daily'],
+                keep_weekly=options['keep_weekly'], keep_monthly=options['keep_monthly'],
+            )
+            if deleted:
+                self.stdout.write(f"Rotated out {len(deleted)} old snapshot(s)")
@@ -0,0 +1,132 @@
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, close_old_connections, connection, connections
+from django.urls import reverse
+from django.utils import timezone
+
+from panel.models import Client, Employee, Inventory
+
+
+class Command(BaseCommand):
+    help = (
+        'Fire parallel sale_create POSTs and report throughput and "database is locked" '
+        'errors. Creates real sales: run it against a copy of the database. Compare profiles '
+        'by running it with and without DJANGO_PRODUCTION=1.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8, help="Concurrent salespeople")
+        parser.add_argument('--requests', type=int, default=200, help="Total sales to post")
+        parser.add_argument('--url', help="Base URL of a running server (e.g. http://127.0.0.1:8000); "
+                                          "by default requests go through the test client in-process")
+
+    def handle(self, *args, **options):
+        client = Client.objects.first()
+        employee = Employee.objects.first()
+        inventory = (
+            Inventory.objects.select_related('product')
+            .filter(quantity__gte=options['requests']).order_by('-quantity').first()
+        )
+        if not (client and employee and inventory):
+            raise CommandError(
+                f"Needs a client, an employee and a batch with at least {options['requests']} units in stock"
+            )
+        due = timezone.localdate() + timedelta(days=30)
+        payload = {
+            'client': client.pk,
+            'employee': employee.pk,
+            # What the browser's <input type="date"> submits
+            'due_date': due.isoformat(),
+            'items-TOTAL_FORMS': '1',
+            'items-INITIAL_FORMS': '0',
+            'items-0-product': inventory.product_id,
+            'items-0-batch': inventory.pk,
+            'items-0-quantity': '1',
+            'items-0-free_goods_discount': '0',
+            'items-0-price_discount': '0',
+        }
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA journal_mode")
+            journal = cursor.fetchone()[0]
+        self.stdout.write(
+            f"engine={connection.settings_dict['ENGINE']} journal_mode={journal} "
+            f"workers={options['workers']} requests={options['requests']}"
+        )
+
+        post = self.http_poster(options['url']) if options['url'] else self.client_poster()
+        outcomes = Counter()
+        latencies = []
+        lock = threading.Lock()
+
+        def run(_):
+            start = time.perf_counter()
+            outcome = post(payload)
+            with lock:
+                outcomes[outcome] += 1
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            list(pool.map(run, range(options['requests'])))
+        elapsed = time.perf_counter() - start
+
+        latencies.sort()
+        p95 = latencies[int(len(latencies) * 0.95) - 1] if latencies else 0
+        self.stdout.write(
+            f"{outcomes['ok']} sales in {elapsed:.2f}s ({outcomes['ok'] / elapsed:.1f}/s), "
+            f"p95 {p95 * 1000:.0f} ms, locked {outcomes['locked']}, other errors {outcomes['error']}"
+        )
+        inventory.refresh_from_db()
+        self.stdout.write(f"Batch {inventory.pk} stock now {inventory.quantity}")
+
+    def client_poster(self):
+        from django.test import Client as TestClient
+        url = reverse('panel:sale_create')
+        local = threading.local()
+
+        def post(payload):
+            if not hasattr(local, 'client'):
+                local.client = TestClient()
+            try:
+                response = local.client.post(url, payload)
+            except OperationalError as exc:
+                return 'locked' if 'locked' in str(exc) else 'error'
+            finally:
+                # Like the end of a real request: drop connections past CONN_MAX_AGE
+                close_old_connections()
+            return 'ok' if response.status_code == 302 else 'error'
+
+        self.stdout.write("Posting through the test client")
+        # Each worker thread opens its own connection
+        connections.close_all()
+        return post
+
+    def http_poster(self, base_url):
+        import requests
+
+        url = base_url.rstrip('/') + reverse('panel:sale_create')
+        local = threading.local()
+
+        def post(payload):
+            if not hasattr(local, 'session'):
+                local.session = requests.Session()
+                local.session.get(url, timeout=30)
+            token = local.session.cookies.get('csrftoken', '')
+            try:
+                response = local.session.post(
+                    url, data=dict(payload, csrfmiddlewaretoken=token),
+                    headers={'Referer': url}, allow_redirects=False, timeout=60,
+                )
+            except requests.RequestException:
+                return 'error'
+            if response.status_code == 302:
+                return 'ok'
+            return 'locked' if 'database is locked' in response.text else 'error'
+
+        self.stdout.write(f"Posting to {url}")
+        return post
@@ -0,0 +1,77 @@
+import io
+import time
+from django.core.management.base import BaseCommand
+from panel.pdf_utils import build_table_pdf, get_fonts, shape_text
+
+HEADERS = ["#", "العميل", "المندوب", "التاريخ", "الإجمالي", "الحالة"]
+
+
+def sample_rows(count):
+    for i in range(count):
+        yield [i + 1, f"عميل رقم {i % 500}", f"مندوب {i % 20}", "2025-01-15", 1500.5 + i, "مدفوعة"]
+
+
+class Command(BaseCommand):
+    help = 'Benchmark tabular PDF generation: chunked ReportLab builder vs single Table vs WeasyPrint'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000)
+        parser.add_argument('--skip-single-table', action='store_true',
+                            help="Skip the single-Table ReportLab run (slow on large row counts)")
+
+    def handle(self, *args, **options):
+        count = options['rows']
+        self.stdout.write(f"Rendering {count} rows")
+        self.run('chunked reportlab', lambda: self.chunked(count))
+        if not options['skip_single_table']:
+            self.run('single-table reportlab', lambda: self.single_table(count))
+        self.run('weasyprint', lambda: self.weasyprint(count))
+
+    def run(self, label, func):
+        start = time.perf_counter()
+        try:
+            size = func()
+        except (ImportError, OSError) as exc:
+            self.stdout.write(self.style.WARNING(f"{label:<24} skipped: {exc}"))
+            return
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f"{label:<24} {elapsed:8.2f}s {size / 1024:10.0f} KiB")
+
+    def chunked(self, count):
+        output = io.BytesIO()
+        build_table_pdf(output, "قائمة المبيعات", HEADERS, sample_rows(count), rtl=True)
+        return len(output.getvalue())
+
+    def single_table(self, count):
+        # What partner_transactions used to do: one Table holding every row
+        from reportlab.lib import colors
+        from reportlab.lib.pagesizes import A4
+        from reportlab.platypus import SimpleDocTemplate, Table, TableStyle
+
+        regular, bold = get_fonts()
+        data = [[shape_text(h, True) for h in HEADERS]]
+        for row in sample_rows(count):
+            data.append([shape_text(v, True) for v in row])
+        table = Table(data, repeatRows=1)
+        table.setStyle(TableStyle([
+            ('FONTNAME', (0, 0), (-1, -1), regular),
+            ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+        ]))
+        output = io.BytesIO()
+        SimpleDocTemplate(output, pagesize=A4).build([table])
+        return len(output.getvalue())
+
+    def weasyprint(self, count):
+        from django.utils.html import escape
+        from weasyprint import HTML
+
+        body = "".join(
+            "<tr>" + "".join(f"<td>{escape(v)}</td>" for v in row) + "</tr>"
+            for row in sample_rows(count)
+        )
+        head = "".join(f"<th>{h}</th>" for h in HEADERS)
+        html = (
+            '<html dir="rtl"><body><table border="1">'
+            f"<thead><tr>{head}</tr></thead><tbody>{body}</tbody></table></body></html>"
+        )
+        return len(HTML(string=html).write_pdf())
@@ -0,0 +1,80 @@
+import random
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from panel.models import Employee, Sale
+from panel.periods import in_period, month_range
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark monthly sales filters: created_at__year/__month extracts vs the '
+        'half-open ranges from panel.periods. With --seed, synthetic sales are '
+        'inserted for the run and rolled back afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0, help="Insert this many synthetic sales first (e.g. 1000000)")
+        parser.add_argument('--employees', type=int, default=50, help="Employees to spread seeded sales over")
+        parser.add_argument('--days', type=int, default=730, help="Spread seeded sales over this many past days")
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            if options['seed']:
+                self.seed(options['seed'], options['employees'], options['days'])
+            self.bench(options['repeat'])
+            # Never keep benchmark data
+            transaction.set_rollback(True)
+
+    def seed(self, count, employee_count, days):
+        start = time.perf_counter()
+        employees = list(Employee.objects.all()[:employee_count])
+        missing = employee_count - len(employees)
+        if missing > 0:
+            employees += Employee.objects.bulk_create([Employee(name=f"bench {i}") for i in range(missing)])
+        now = timezone.now()
+        seconds = days * 86400
+        batch = []
+        for i in range(count):
+            batch.append(Sale(
+                employee=random.choice(employees),
+                created_at=now - timedelta(seconds=random.randrange(seconds)),
+                total=Decimal(random.randrange(100, 100000)),
+            ))
+            if len(batch) == 10000:
+                Sale.objects.bulk_create(batch)
+                batch = []
+        Sale.objects.bulk_create(batch)
+        self.stdout.write(f"Seeded {count} sales in {time.perf_counter() - start:.1f}s")
+
+    def bench(self, repeat):
+        today = timezone.localdate()
+        year, month = today.year, today.month
+        period = month_range(year, month)
+        employee_ids = list(Employee.objects.values_list('pk', flat=True))
+        self.stdout.write(
+            f"{Sale.objects.count()} sales, {len(employee_ids)} employees, month {year}-{month:02d}"
+        )
+
+        cases = {
+            'extract (__year/__month)': lambda qs: qs.filter(created_at__year=year, created_at__month=month),
+            'range (periods)': lambda qs: qs.filter(**in_period('created_at', period)),
+        }
+        for label, apply in cases.items():
+            # All sales in the month, then one query per employee as employee_list does
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                total = apply(Sale.objects.all()).aggregate(total=Sum('total'))['total']
+                for pk in employee_ids:
+                    apply(Sale.objects.filter(employee_id=pk)).aggregate(total=Sum('total'))
+                timings.append(time.perf_counter() - start)
+            self.stdout.write(f"{label:<26} best {min(timings) * 1000:9.1f} ms  (month total {total})")
+            self.stdout.write(f"    {apply(Sale.objects.filter(employee_id=employee_ids[0] if employee_ids else 0)).explain()}")
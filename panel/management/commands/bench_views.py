@@ -0,0 +1,86 @@
+import fnmatch
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.test.utils import (
+    override_settings, setup_databases, setup_test_environment, teardown_databases,
+    teardown_test_environment,
+)
+
+from panel import bench_utils
+from panel.seed_utils import LoadDataGenerator
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark every panel and finance page on a fixed synthetic dataset in a throwaway '
+        'test database: wall time, query count and peak memory, compared with '
+        'panel/bench_baseline.json. Fails when a page goes over its query budget or changes '
+        'status, or a hot page gets slower than the tolerance allows.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5, help="Timed calls per page (the best is kept)")
+        parser.add_argument('--tolerance', type=float, default=50, help="Allowed slowdown in percent")
+        parser.add_argument('--only', help="Only pages whose view name matches this glob, e.g. 'panel:sale*'")
+        parser.add_argument('--baseline', default=str(bench_utils.BASELINE_PATH))
+        parser.add_argument('--update', action='store_true', help="Write the results as the new baseline")
+        parser.add_argument('--current-db', action='store_true',
+                            help="Measure against the configured database instead of seeding a test one "
+                                 "(no baseline comparison; every request is rolled back)")
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_config = None
+        try:
+            if not options['current_db']:
+                old_config = setup_databases(verbosity=0, interactive=False, aliases={'default'})
+                self.stdout.write(f"Seeding {bench_utils.BENCH_VOLUMES['sales']} sales (seed {bench_utils.BENCH_SEED})...")
+                LoadDataGenerator(seed=bench_utils.BENCH_SEED, days=bench_utils.BENCH_DAYS).run(bench_utils.BENCH_VOLUMES)
+            # The instrumentation middleware would be measured too
+            with override_settings(PERF_ENABLED=False, QUERY_LOG_ENABLED=False, REPORTS_DATABASE='off'):
+                results = self.run_cases(options)
+        finally:
+            if old_config is not None:
+                teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+        if options['current_db']:
+            return
+        baseline = bench_utils.load_baseline(options['baseline'])
+        if options['update']:
+            bench_utils.save_baseline(results, options['baseline'], previous=baseline)
+            self.stdout.write(self.style.SUCCESS(f"Baseline written to {options['baseline']}"))
+            return
+        failures, warnings = bench_utils.compare(results, baseline, tolerance=options['tolerance'])
+        if options['only']:
+            failures = {name: reasons for name, reasons in failures.items() if name in results}
+        for name, reasons in sorted(warnings.items()):
+            self.stdout.write(self.style.WARNING(f"SLOWER {name}: {'; '.join(reasons)}"))
+        for name, reasons in sorted(failures.items()):
+            self.stdout.write(self.style.ERROR(f"FAIL {name}: {'; '.join(reasons)}"))
+        if failures:
+            raise CommandError(f"{len(failures)} page(s) over budget or slower than the baseline")
+        self.stdout.write(self.style.SUCCESS(f"{len(results)} pages within budget"))
+
+    def run_cases(self, options):
+        user, _ = User.objects.get_or_create(username='bench', defaults={'is_staff': True, 'is_superuser': True})
+        client = Client(raise_request_exception=False)
+        client.force_login(user)
+        baseline = bench_utils.load_baseline(options['baseline']).get('views', {})
+        results = {}
+        self.stdout.write(f"{'view':<42} {'status':>6} {'queries':>12} {'ms':>18} {'peak KiB':>9}")
+        for name, method, url, data in bench_utils.cases():
+            if options['only'] and not fnmatch.fnmatch(name, options['only']):
+                continue
+            result = bench_utils.measure(client, method, url, data, repeat=options['repeat'])
+            results[name] = result
+            base = baseline.get(name)
+            budget = f"/{base['budget']}" if base else ''
+            was = f" ({base['ms']:.1f})" if base else ''
+            self.stdout.write(
+                f"{name:<42} {result['status']:>6} {str(result['queries']) + budget:>12} "
+                f"{result['ms']:>9.1f}{was:>9} {result['peak_kib']:>9}"
+            )
+        return results
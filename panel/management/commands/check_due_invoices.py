@@ -1,16 +1,155 @@
-from django.core.management.base import BaseCommand
+import hashlib
+from collections import defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery, Sum, DecimalField
+from django.db.models.functions import Coalesce
 from django.utils import timezone
-from panel.models import Invoice
-from datetime import timedelta
+
+from panel.models import Invoice, InvoicePayment
+from panel.notifications import enqueue
+
+OPEN_STATUSES = ('unpaid', 'partial')
+UPDATE_CHUNK = 500
+
+
+def parse_days(value):
+    try:
+        days = sorted({int(v) for v in value.split(',') if v.strip()})
+    except ValueError:
+        raise CommandError(f"Expected a comma-separated list of days, got {value!r}")
+    if any(d < 0 for d in days):
+        raise CommandError("Days must not be negative")
+    return days
+
 
 class Command(BaseCommand):
-    help = 'Check for invoices due in 3 days and send alerts'
-
-    def handle(self, *args, **kwargs):
-        target_date = timezone.now().date() + timedelta(days=3)
-        invoices = Invoice.objects.filter(due_date=target_date, status='unpaid')
-        for invoice in invoices:
-            # Replace this with actual email or system alert logic
-            self.stdout.write(
-                f"ALERT: Invoice #{invoice.pk} for client '{invoice.sale.client}' is due on {invoice.due_date}."
+    help = (
+        'Scan open (unpaid/partial) invoices for upcoming and overdue due dates and queue '
+        'one alert per client and per employee. Each invoice is alerted once per stage.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lead-days', default='7,3,1',
+                            help="Alert when an invoice is due within this many days (comma-separated)")
+        parser.add_argument('--overdue-days', default='1,7,30',
+                            help="Escalate when an invoice is this many days overdue (comma-separated)")
+        parser.add_argument('--date', help="Run as of this date (YYYY-MM-DD) instead of today")
+        parser.add_argument('--chunk-size', type=int, default=2000)
+        parser.add_argument('--dry-run', action='store_true', help="Report what would be queued without writing")
+
+    def stage_for(self, days_left, lead_days, overdue_days):
+        """
+        Returns (stage, rank); later stages rank higher so an invoice only
+        moves forward through them.
+        """
+        if days_left >= 0:
+            # The most urgent lead day reached, so a missed run (or an
+            # invoice created inside the window) still gets its alert;
+            # the stage check in handle() keeps it from repeating
+            reached = [d for d in lead_days if days_left <= d]
+            if not reached:
+                return None, None
+            return f"due_{reached[0]}", -reached[0]
+        overdue = -days_left
+        reached = [d for d in overdue_days if d <= overdue]
+        if not reached:
+            return None, None
+        return f"overdue_{reached[-1]}", reached[-1]
+
+    @staticmethod
+    def stage_rank(stage):
+        if not stage:
+            return None
+        kind, _, days = stage.partition('_')
+        return -int(days) if kind == 'due' else int(days)
+
+    def handle(self, *args, **options):
+        lead_days = parse_days(options['lead_days'])
+        overdue_days = parse_days(options['overdue_days'])
+        if not lead_days and not overdue_days:
+            raise CommandError("Nothing to check: both --lead-days and --overdue-days are empty")
+        try:
+            today = date.fromisoformat(options['date']) if options['date'] else timezone.localdate()
+        except ValueError:
+            raise CommandError("--date must be YYYY-MM-DD")
+
+        paid = (
+            InvoicePayment.objects.filter(invoice=OuterRef('pk'))
+            .values('invoice').annotate(total=Sum('amount')).values('total')
+        )
+        # Range scan on (status, due_date)
+        invoices = (
+            Invoice.objects.filter(status__in=OPEN_STATUSES, due_date__isnull=False,
+                                   due_date__lte=today + timedelta(days=max(lead_days or [0])))
+            .annotate(paid=Coalesce(Subquery(paid), Decimal('0'), output_field=DecimalField(max_digits=12, decimal_places=2)))
+            .values_list(
+                'pk', 'number', 'due_date', 'alert_stage', 'alert_due_date', 'paid', 'sale__total',
+                'sale__client_id', 'sale__client__name', 'sale__employee_id', 'sale__employee__name',
             )
+        )
+
+        by_client = defaultdict(lambda: defaultdict(list))
+        by_employee = defaultdict(lambda: defaultdict(list))
+        to_mark = defaultdict(list)
+        scanned = 0
+        for (pk, number, due_date, alert_stage, alert_due_date, paid_amount, total,
+             client_id, client_name, employee_id, employee_name) in invoices.iterator(chunk_size=options['chunk_size']):
+            scanned += 1
+            stage, rank = self.stage_for((due_date - today).days, lead_days, overdue_days)
+            if stage is None:
+                continue
+            if alert_due_date == due_date and alert_stage and self.stage_rank(alert_stage) >= rank:
+                continue
+            entry = (pk, number or pk, (total or 0) - paid_amount)
+            if client_id:
+                by_client[(client_id, client_name)][stage].append(entry)
+            if employee_id:
+                by_employee[(employee_id, employee_name)][stage].append(entry)
+            to_mark[stage].append(pk)
+
+        new_invoices = sum(len(ids) for ids in to_mark.values())
+        if options['dry_run']:
+            self.stdout.write(f"Scanned {scanned} open invoices; {new_invoices} need an alert (dry run).")
+            return
+
+        queued = 0
+        with transaction.atomic():
+            for scope, groups in (('client', by_client), ('employee', by_employee)):
+                for (owner_id, owner_name), stages in groups.items():
+                    for stage, entries in stages.items():
+                        queued += self.enqueue_summary(scope, owner_id, owner_name, stage, entries, today)
+            for stage, ids in to_mark.items():
+                for i in range(0, len(ids), UPDATE_CHUNK):
+                    Invoice.objects.filter(pk__in=ids[i:i + UPDATE_CHUNK]).update(
+                        alert_stage=stage, alert_due_date=F('due_date')
+                    )
+        self.stdout.write(
+            f"Scanned {scanned} open invoices; {new_invoices} reached a new stage; queued {queued} alerts."
+        )
+
+    def enqueue_summary(self, scope, owner_id, owner_name, stage, entries, today):
+        kind, _, days = stage.partition('_')
+        count = len(entries)
+        remaining = sum(amount for _, _, amount in entries)
+        numbers = ', '.join(f"#{number}" for _, number, _ in entries[:5]) + ('…' if count > 5 else '')
+        who = f"العميل {owner_name}" if scope == 'client' else f"المندوب {owner_name}"
+        if kind == 'due':
+            title = "فواتير مستحقة قريباً"
+            body = f"{who}: {count} فاتورة تستحق خلال {days} يوم بمبلغ متبقٍ {remaining:,.2f} ({numbers})"
+        else:
+            title = "فواتير متأخرة السداد"
+            body = f"{who}: {count} فاتورة متأخرة {days} يوم أو أكثر بمبلغ متبقٍ {remaining:,.2f} ({numbers})"
+        digest = hashlib.sha1(','.join(str(pk) for pk, _, _ in entries).encode()).hexdigest()[:12]
+        return enqueue(
+            'due_invoice' if kind == 'due' else 'overdue_invoice',
+            title,
+            body,
+            f"{stage}:{scope}:{owner_id}:{today.isoformat()}:{digest}",
+            # FCM data payloads are capped at 4KB, so only a sample of ids is kept
+            {'scope': scope, f'{scope}_id': owner_id, 'stage': stage, 'count': count,
+             'invoice_ids': [pk for pk, _, _ in entries[:50]]},
+        )
@@ -0,0 +1,66 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from panel import loadtest_utils
+
+
+class Command(BaseCommand):
+    help = (
+        'Run parallel clients against a running server, posting a mix of sales, invoice '
+        'payments, returns, expenses and supplier payments. Reports throughput, latency '
+        'percentiles and lock errors, then checks the data: stock per batch, invoice status '
+        'against payments, no negative stock or balances. Writes real rows: point the server '
+        'and this command at the same copy of the database, never the live one.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help="Base URL of the running server")
+        parser.add_argument('--clients', type=int, default=8, help="Parallel clients")
+        parser.add_argument('--duration', type=float, default=30, help="Seconds to run")
+        parser.add_argument('--requests', type=int, default=0, help="Stop each client after this many requests")
+        parser.add_argument('--mix', help="Operation weights, e.g. 'sale=40,payment=25,return=10,"
+                                          "expense=15,supplier_payment=10' (the default)")
+        parser.add_argument('--hot', type=int, default=10,
+                            help="Rows per kind the clients share; fewer means more contention")
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--timeout', type=float, default=30, help="Per-request timeout in seconds")
+        parser.add_argument('--no-check', action='store_true', help="Skip the invariant checks at the end")
+
+    def handle(self, *args, **options):
+        try:
+            mix = loadtest_utils.parse_mix(options['mix']) if options['mix'] else loadtest_utils.DEFAULT_MIX
+        except ValueError as error:
+            raise CommandError(error)
+        targets = loadtest_utils.Targets(hot=options['hot'])
+        missing = targets.missing(mix)
+        if missing:
+            raise CommandError(f"Nothing to write to for: {', '.join(missing)} (seed the database first)")
+
+        balances_before = loadtest_utils.balances()
+        self.stdout.write(
+            f"{options['clients']} clients against {options['url']} for "
+            f"{options['requests'] or 'unlimited'} requests / {options['duration']:g}s"
+        )
+        results, elapsed = loadtest_utils.run(
+            options['url'], mix, targets, clients=options['clients'], duration=options['duration'],
+            max_requests=options['requests'], seed=options['seed'], timeout=options['timeout'],
+        )
+
+        self.stdout.write(
+            f"{'operation':<18} {'count':>7} {'req/s':>7} {'ok':>6} {'rejected':>8} {'locked':>6} "
+            f"{'error':>6} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8}"
+        )
+        for row in results.rows(elapsed):
+            self.stdout.write(
+                f"{row['name']:<18} {row['count']:>7} {row['rps']:>7.1f} {row['ok']:>6} {row['rejected']:>8} "
+                f"{row['locked']:>6} {row['error']:>6} {row['p50']:>8.0f} {row['p90']:>8.0f} "
+                f"{row['p99']:>8.0f} {row['max']:>8.0f}"
+            )
+        for error in results.errors:
+            self.stdout.write(self.style.WARNING(error))
+
+        if options['no_check']:
+            return
+        problems = loadtest_utils.verify(balances_before)
+        if problems:
+            raise CommandError("Invariant checks failed after the run:\n  " + "\n  ".join(problems))
+        self.stdout.write(self.style.SUCCESS("Invariant checks passed"))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from panel.search import SEARCH_TABLE, is_available, rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index from the client, product, supplier, shipment and invoice tables'
+
+    def handle(self, *args, **kwargs):
+        if not is_available():
+            raise CommandError("The search index is only available on SQLite.")
+        with transaction.atomic(), connection.cursor() as cursor:
+            rebuild_index(cursor)
+            cursor.execute(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('optimize')")
+            cursor.execute(f"SELECT COUNT(*) FROM {SEARCH_TABLE}")
+            count = cursor.fetchone()[0]
+        self.stdout.write(self.style.SUCCESS(f"Indexed {count} rows."))
@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from panel.backup_utils import online_backup
+
+
+class Command(BaseCommand):
+    help = (
+        'Copy the live database to the snapshot file report views read from '
+        '(REPORTS_DATABASE set to a path). Run it periodically, e.g. from cron.'
+    )
+
+    def handle(self, *args, **options):
+        target = getattr(settings, 'REPORTS_DATABASE', 'off')
+        if target in ('off', 'readonly'):
+            raise CommandError(f"REPORTS_DATABASE is {target!r}; set DJANGO_REPORTS_DB to a snapshot path to use this")
+        if connection.vendor != 'sqlite':
+            raise CommandError("Snapshots are only supported for SQLite")
+
+        # Swapped in atomically: open report connections keep the old file until they reconnect
+        stats = online_backup(connection.settings_dict['NAME'], target)
+        self.stdout.write(
+            f"Snapshot written to {target} ({stats['bytes'] / 1048576:.1f} MiB) in {stats['seconds']:.2f}s"
+        )
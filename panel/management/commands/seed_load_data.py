@@ -0,0 +1,47 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from panel.models import Sale
+from panel.seed_utils import DEFAULT_VOLUMES, LoadDataGenerator, check_invariants
+
+
+class Command(BaseCommand):
+    help = (
+        'Fill the database with synthetic data at production volumes: areas, clients, '
+        'employees, managers, products, suppliers, shipments with inventory, sales with '
+        'items, returns, invoices, payments and commissions, expenses, partner transactions '
+        'and currency exchanges. Run it on a fresh or copied database, never the live one.'
+    )
+
+    def add_arguments(self, parser):
+        for name, default in DEFAULT_VOLUMES.items():
+            kind = float if isinstance(default, float) else int
+            parser.add_argument(f"--{name.replace('_', '-')}", type=kind, default=default, dest=name)
+        parser.add_argument('--days', type=int, default=730, help="Spread the data over this many past days")
+        parser.add_argument('--seed', type=int, default=42, help="Random seed; the same seed gives the same data")
+        parser.add_argument('--batch-size', type=int, default=2000, help="Rows per bulk INSERT")
+        parser.add_argument('--force', action='store_true', help="Add to a database that already has sales")
+        parser.add_argument('--no-check', action='store_true', help="Skip the invariant checks at the end")
+
+    def handle(self, *args, **options):
+        if Sale.objects.exists() and not options['force']:
+            raise CommandError("The database already has sales; use a fresh copy or pass --force")
+
+        volumes = {name: options[name] for name in DEFAULT_VOLUMES}
+        generator = LoadDataGenerator(
+            seed=options['seed'], days=options['days'], batch_size=options['batch_size'],
+            log=self.stdout.write,
+        )
+        start = time.perf_counter()
+        counts = generator.run(volumes)
+        self.stdout.write(f"Done in {time.perf_counter() - start:.1f}s:")
+        for model, count in sorted(counts.items()):
+            self.stdout.write(f"  {model:<32} {count:>10,}")
+
+        if options['no_check']:
+            return
+        problems = check_invariants()
+        if problems:
+            raise CommandError("Invariant checks failed:\n  " + "\n  ".join(problems))
+        self.stdout.write(self.style.SUCCESS("Invariant checks passed"))
@@ -0,0 +1,28 @@
+import time
+from django.core.management.base import BaseCommand
+from panel.fcm_utils import notify_staff
+from panel.notifications import claim_batch, deliver
+
+
+class Command(BaseCommand):
+    help = 'Deliver pending staff alerts from the notification outbox'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--max-attempts', type=int, default=5)
+        parser.add_argument('--loop', action='store_true', help="Keep polling instead of exiting when the outbox is empty")
+        parser.add_argument('--interval', type=float, default=5.0, help="Seconds between polls with --loop")
+
+    def handle(self, *args, **options):
+        while True:
+            alerts = claim_batch(options['batch_size'])
+            if alerts:
+                counts = deliver(alerts, notify_staff, max_attempts=options['max_attempts'])
+                self.stdout.write(
+                    f"{len(alerts)} alerts: {counts['sent']} sent, {counts['skipped']} skipped, "
+                    f"{counts['retry']} to retry, {counts['failed']} failed"
+                )
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
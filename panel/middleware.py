@@ -0,0 +1,123 @@
+import time
+from contextlib import ExitStack
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+from django.urls import Resolver404, resolve
+
+from . import perf, profiling, querylog
+
+
+class PerfMiddleware:
+    """
+    Record latency, SQL query count and time, and template render time per
+    resolved view name (see panel/perf.py). Disabled with PERF_ENABLED = False.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = getattr(settings, 'PERF_ENABLED', True)
+        if self.enabled:
+            perf.install_template_timer()
+
+    def __call__(self, request):
+        if not self.enabled:
+            return self.get_response(request)
+        timer = perf.RequestTimer()
+        perf.set_timer(timer)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(timer))
+                response = self.get_response(request)
+        finally:
+            perf.set_timer(None)
+        latency = time.perf_counter() - start
+
+        match = getattr(request, 'resolver_match', None)
+        view_name = match.view_name if match else '<unresolved>'
+        perf.store.record(
+            view_name, latency, timer.sql_count, timer.sql_time, timer.template_time,
+            response.status_code >= 500,
+        )
+        perf.store.maybe_flush()
+        return response
+
+
+class QueryLogMiddleware:
+    """
+    Log repeated (N+1) and slow queries of each request to the query log
+    (see panel/querylog.py). Off unless QUERY_LOG_ENABLED = True.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = getattr(settings, 'QUERY_LOG_ENABLED', False)
+        if self.enabled:
+            querylog.install_template_tracker()
+            Path(settings.QUERY_LOG_FILE).parent.mkdir(parents=True, exist_ok=True)
+
+    def __call__(self, request):
+        if not self.enabled:
+            return self.get_response(request)
+        inspector = querylog.QueryInspector()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(inspector))
+            response = self.get_response(request)
+
+        match = getattr(request, 'resolver_match', None)
+        inspector.view_name = match.view_name if match else '<unresolved>'
+        inspector.report(request.get_full_path())
+        return response
+
+
+class ProfilerMiddleware:
+    """
+    Profile a single request of a staff user on demand, for views of the
+    apps in PROFILE_APPS (see panel/profiling.py). Needs request.user, so
+    it goes after AuthenticationMiddleware.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.apps = tuple(getattr(settings, 'PROFILE_APPS', ('panel', 'finance')))
+
+    def __call__(self, request):
+        mode = profiling.requested_mode(request)
+        if mode is None or not (request.user.is_active and request.user.is_staff):
+            return self.get_response(request)
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return self.get_response(request)
+        if match.func.__module__.split('.')[0] not in self.apps:
+            return self.get_response(request)
+        if not profiling.allow(request.user):
+            response = self.get_response(request)
+            response['X-Profile'] = 'rate-limited'
+            return response
+
+        sql = profiling.SqlSummary()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(sql))
+            response, profiler = profiling.run(mode, self.get_response, request)
+        duration = time.perf_counter() - start
+        if profiler is None:
+            response['X-Profile'] = 'busy'
+            return response
+
+        profile_id = profiling.save(mode, profiler, {
+            'view': match.view_name,
+            'path': request.get_full_path(),
+            'method': request.method,
+            'user': request.user.get_username(),
+            'status': response.status_code,
+            'ms': duration * 1000,
+            'sql_count': sql.count,
+            'sql_ms': sql.time * 1000,
+            'queries': sql.top(),
+        })
+        response['X-Profile'] = profile_id
+        return response
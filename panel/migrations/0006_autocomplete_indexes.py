@@ -0,0 +1,43 @@
+# Generated by Django 5.0.1 on 2026-10-19 08:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('panel', '0005_managercommissionpayment'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='client',
+            name='name',
+            field=models.CharField(db_index=True, max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='client',
+            name='phone',
+            field=models.CharField(blank=True, db_index=True, max_length=20, null=True),
+        ),
+        migrations.AlterField(
+            model_name='employee',
+            name='name',
+            field=models.CharField(db_index=True, max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='name',
+            field=models.CharField(db_index=True, max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='shipment',
+            name='batch_number',
+            field=models.CharField(db_index=True, max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='supplier',
+            name='name',
+            field=models.CharField(db_index=True, max_length=100),
+        ),
+    ]
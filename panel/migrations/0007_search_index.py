@@ -0,0 +1,30 @@
+# Generated by Django 5.0.1 on 2026-10-19 09:10
+
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    from panel.search import install
+    with schema_editor.connection.cursor() as cursor:
+        install(cursor)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    from panel.search import uninstall
+    with schema_editor.connection.cursor() as cursor:
+        uninstall(cursor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('panel', '0006_autocomplete_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.0.1 on 2026-10-19 08:30
+
+from django.db import migrations, models
+
+
+def create_invoice_sequence(apps, schema_editor):
+    # Existing invoice numbers are left as they are. The allocator does not
+    # skip them; 0013_invoice_number_length moves the sequence past
+    # the highest one.
+    Sequence = apps.get_model('panel', 'Sequence')
+    Sequence.objects.get_or_create(name='invoice', defaults={'next_value': 100000})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('panel', '0007_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Sequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('next_value', models.BigIntegerField()),
+            ],
+        ),
+        migrations.RunPython(create_invoice_sequence, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.0.1 on 2026-10-19 08:32
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('panel', '0008_invoice_number_sequence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationOutbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('due_invoice', 'Invoice due soon'), ('overdue_invoice', 'Invoice overdue'), ('low_stock', 'Low stock'), ('large_payment', 'Large payment')], max_length=30)),
+                ('title', models.CharField(max_length=255)),
+                ('body', models.TextField()),
+                ('data', models.JSONField(blank=True, default=dict)),
+                ('dedupe_key', models.CharField(max_length=200, unique=True)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('sending', 'Sending'), ('sent', 'Sent'), ('skipped', 'Skipped'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('available_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'available_at'], name='outbox_status_available_idx')],
+            },
+        ),
+    ]
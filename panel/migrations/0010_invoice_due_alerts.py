@@ -0,0 +1,27 @@
+# Generated by Django 5.0.1 on 2026-10-19 08:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('panel', '0009_notification_outbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='alert_due_date',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='alert_stage',
+            field=models.CharField(blank=True, default='', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['status', 'due_date'], name='invoice_status_due_idx'),
+        ),
+    ]
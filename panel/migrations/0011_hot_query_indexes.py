@@ -0,0 +1,49 @@
+# Generated by Django 5.0.1 on 2026-10-19 08:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('panel', '0010_invoice_due_alerts'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='commission',
+            index=models.Index(fields=['employee', 'created_at'], name='commission_employee_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='inventory',
+            index=models.Index(fields=['product', 'quantity'], name='inventory_product_qty_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['created_at'], name='invoice_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoicepayment',
+            index=models.Index(fields=['invoice', 'paid_at'], name='invoicepayment_invoice_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sale',
+            index=models.Index(fields=['created_at'], name='sale_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sale',
+            index=models.Index(fields=['employee', 'created_at'], name='sale_employee_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sale',
+            index=models.Index(fields=['client', 'created_at'], name='sale_client_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shipment',
+            index=models.Index(fields=['received_at'], name='shipment_received_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shipment',
+            index=models.Index(fields=['expiry_date'], name='shipment_expiry_idx'),
+        ),
+    ]
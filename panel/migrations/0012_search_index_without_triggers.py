@@ -0,0 +1,25 @@
+# Generated by Django 5.0.1 on 2026-10-19 08:50
+
+from django.db import migrations
+
+
+def drop_triggers(apps, schema_editor):
+    # The triggers called arabic_normalize(), a Python function only Django
+    # connections had; model signals keep the index current now
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    from panel.search import drop_triggers, rebuild_index
+    with schema_editor.connection.cursor() as cursor:
+        drop_triggers(cursor)
+        rebuild_index(cursor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('panel', '0011_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_triggers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.0.1 on 2026-10-19 08:51
+
+from django.db import migrations, models
+from django.db.models import BigIntegerField, Max
+from django.db.models.functions import Cast
+
+
+def skip_old_numbers(apps, schema_editor):
+    # Move the invoice sequence past every number the old random
+    # generator handed out (100000-999999), so new numbers never collide
+    Invoice = apps.get_model('panel', 'Invoice')
+    Sequence = apps.get_model('panel', 'Sequence')
+    highest = Invoice.objects.filter(number__regex=r'^[0-9]+$').aggregate(
+        highest=Max(Cast('number', BigIntegerField()))
+    )['highest']
+    sequence, _ = Sequence.objects.get_or_create(name='invoice', defaults={'next_value': 100000})
+    if highest is not None and highest >= sequence.next_value:
+        sequence.next_value = highest + 1
+        sequence.save(update_fields=['next_value'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('panel', '0012_search_index_without_triggers'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='invoice',
+            name='number',
+            field=models.CharField(blank=True, max_length=12, null=True, unique=True),
+        ),
+        migrations.RunPython(skip_old_numbers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.1 on 2026-10-19 08:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('panel', '0013_invoice_number_length'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notificationoutbox',
+            name='claim_token',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+    ]
@@ -3,7 +3,6 @@ from django.utils import timezone
 from decimal import Decimal
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-import random
 
 USD_TO_SDG_RATE = Decimal('600')  # Example conversion rate
 
@@ -14,8 +13,8 @@ class Area(models.Model):
         return self.name
 
 class Client(models.Model):
-    name = models.CharField(max_length=100)
-    phone = models.CharField(max_length=20, blank=True, null=True)
+    name = models.CharField(max_length=100, db_index=True)
+    phone = models.CharField(max_length=20, blank=True, null=True, db_index=True)
     address = models.CharField(max_length=255, blank=True, null=True)
     area = models.ForeignKey(Area, on_delete=models.SET_NULL, null=True, blank=True)
 
@@ -23,7 +22,7 @@ class Client(models.Model):
         return self.name
 
 class Employee(models.Model):
-    name = models.CharField(max_length=100)
+    name = models.CharField(max_length=100, db_index=True)
     commission_percentage = models.DecimalField(max_digits=5, decimal_places=2, default=0)  # %
     sales_target = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name="الهدف الشهري")
     created_at = models.DateTimeField(default=timezone.now)
@@ -42,7 +41,8 @@ class Employee(models.Model):
             month = today.month
         if not year:
             year = today.year
-        return Sale.objects.filter(employee=self, created_at__year=year, created_at__month=month).aggregate(total=models.Sum('total'))['total'] or 0
+        from .periods import in_period, month_range
+        return Sale.objects.filter(employee=self, **in_period('created_at', month_range(year, month))).aggregate(total=models.Sum('total'))['total'] or 0
 
     def get_monthly_commission(self, month=None, year=None):
         # check for all commision in the time period
@@ -53,7 +53,8 @@ class Employee(models.Model):
             month = today.month
         if not year:
             year = today.year
-        commissions = Commission.objects.filter(employee=self, sale__created_at__year=year, sale__created_at__month=month)
+        from .periods import in_period, month_range
+        commissions = Commission.objects.filter(employee=self, **in_period('sale__created_at', month_range(year, month)))
         return sum([c.amount for c in commissions])
 
 
@@ -64,7 +65,8 @@ class Employee(models.Model):
         from .models import Commission, Sale
         sales = Sale.objects.filter(employee=self)
         if month and year:
-            sales = sales.filter(created_at__year=year, created_at__month=month)
+            from .periods import in_period, month_range
+            sales = sales.filter(**in_period('created_at', month_range(year, month)))
         commissions = Commission.objects.filter(employee=self, sale__in=sales)
         return sum([c.unpaid_amount for c in commissions])
 
@@ -91,7 +93,7 @@ class Product(models.Model):
         ('sup', 'Supplement'),
         ('oth', 'Other'),
     ]
-    name = models.CharField(max_length=100)
+    name = models.CharField(max_length=100, db_index=True)
     description = models.CharField(max_length=300, null=True)  
     unit = models.CharField(max_length=50, null=True)  
     # cost_usd = models.DecimalField(max_digits=10, decimal_places=2, null=True)
@@ -119,7 +121,7 @@ class Product(models.Model):
         return self.name
 
 class Supplier(models.Model):
-    name = models.CharField(max_length=100)
+    name = models.CharField(max_length=100, db_index=True)
     phone = models.CharField(max_length=30, blank=True, null=True)
     address = models.CharField(max_length=255, blank=True, null=True)
     note = models.TextField(blank=True, null=True)
@@ -162,12 +164,18 @@ class Shipment(models.Model):
     cost_usd = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     cost_sdg = models.DecimalField(max_digits=12, decimal_places=2, null=True)
     sale_usd = models.DecimalField(max_digits=10, decimal_places=2, null=True)
-    batch_number = models.CharField(max_length=100)  # <-- moved here
+    batch_number = models.CharField(max_length=100, db_index=True)  # <-- moved here
     expiry_date = models.DateField() 
     exchange_rate = models.IntegerField(null=True)
                     # <-- moved here
     supplier = models.ForeignKey('Supplier', on_delete=models.SET_NULL, null=True, blank=True, related_name='shipments')
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['received_at'], name='shipment_received_idx'),
+            models.Index(fields=['expiry_date'], name='shipment_expiry_idx'),
+        ]
+
     # @property
     # def profit(self):
     #     # Example: profit = (selling price - cost_sdg) * quantity - shipment_cost
@@ -211,6 +219,19 @@ class Inventory(models.Model):
     shipment = models.OneToOneField(Shipment, on_delete=models.CASCADE, related_name='inventory')
     quantity = models.PositiveIntegerField(default=0)
 
+    class Meta:
+        indexes = [
+            # In-stock batches of a product (quantity > 0)
+            models.Index(fields=['product', 'quantity'], name='inventory_product_qty_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Quantity as loaded, so post_save can tell whether stock went down
+        instance._loaded_quantity = instance.__dict__.get('quantity')
+        return instance
+
     def __str__(self):
         return f"{self.product.name} - Batch {self.shipment.batch_number} (Exp: {self.shipment.expiry_date})"
 
@@ -239,6 +260,13 @@ class Sale(models.Model):
     created_at = models.DateTimeField(default=timezone.now)
     total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at'], name='sale_created_idx'),
+            models.Index(fields=['employee', 'created_at'], name='sale_employee_created_idx'),
+            models.Index(fields=['client', 'created_at'], name='sale_client_created_idx'),
+        ]
+
     def calculate_total(self):
         total = sum(item.get_total for item in self.items.all())
         # Subtract returned products value
@@ -328,17 +356,27 @@ class Invoice(models.Model):
         ('partial', 'Partial'),
     ]
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='unpaid')
-    number = models.CharField(max_length=6, unique=True, blank=True, null=True)  # <-- new field
+    number = models.CharField(max_length=12, unique=True, blank=True, null=True)  # <-- new field
+    # Last due/overdue alert stage queued by check_due_invoices, and the due date it was for
+    alert_stage = models.CharField(max_length=20, blank=True, default='')
+    alert_due_date = models.DateField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'due_date'], name='invoice_status_due_idx'),
+            models.Index(fields=['created_at'], name='invoice_created_idx'),
+        ]
 
     def save(self, *args, **kwargs):
-        if not self.number:
-            # Generate a unique 6-digit number
-            while True:
-                num = f"{random.randint(100000, 999999)}"
-                if not Invoice.objects.filter(number=num).exists():
-                    self.number = num
-                    break
-        super().save(*args, **kwargs)
+        if self.number:
+            return super().save(*args, **kwargs)
+        from .numbering import next_number
+        # The sequence starts past the old random numbers (migration 0013),
+        # so the unique constraint is only a backstop
+        self.number = str(next_number('invoice'))
+        if len(self.number) > self._meta.get_field('number').max_length:
+            raise ValueError(f"Invoice number {self.number} is longer than the number field")
+        return super().save(*args, **kwargs)
 
     def update_status(self):
         # Subtract returned products value from sale total
@@ -369,12 +407,27 @@ class Invoice(models.Model):
     def __str__(self):
         return f"Invoice #{self.number or self.pk} for Sale #{self.sale.pk}"
 
+class Sequence(models.Model):
+    """
+    Counter row for numbers handed out in blocks by panel.numbering.
+    """
+    name = models.CharField(max_length=50, unique=True)
+    next_value = models.BigIntegerField()
+
+    def __str__(self):
+        return f"{self.name}: {self.next_value}"
+
 class InvoicePayment(models.Model):
     invoice = models.ForeignKey(Invoice, on_delete=models.CASCADE, related_name='payments')
     amount = models.DecimalField(max_digits=12, decimal_places=2)
     paid_at = models.DateTimeField(default=timezone.now)
     note = models.CharField(max_length=255, blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['invoice', 'paid_at'], name='invoicepayment_invoice_idx'),
+        ]
+
     def save(self, *args, **kwargs):
         super().save(*args, **kwargs)
         self.invoice.update_status()
@@ -416,6 +469,9 @@ class Commission(models.Model):
 
     class Meta:
         unique_together = ('employee', 'sale')
+        indexes = [
+            models.Index(fields=['employee', 'created_at'], name='commission_employee_idx'),
+        ]
 
     @property
     def unpaid_amount(self):
@@ -498,4 +554,64 @@ class ManagerCommissionPayment(models.Model):
     note = models.CharField(max_length=255, blank=True, null=True)
 
     def __str__(self):
-        return f"Commission Payment {self.amount} to Manager {self.manager.name} at {self.paid_at}"
\ No newline at end of file
+        return f"Commission Payment {self.amount} to Manager {self.manager.name} at {self.paid_at}"
+
+
+class NotificationOutbox(models.Model):
+    """
+    Staff alert written in the same transaction as the change that caused
+    it and delivered later by the send_notifications command.
+    """
+    KIND_CHOICES = [
+        ('due_invoice', 'Invoice due soon'),
+        ('overdue_invoice', 'Invoice overdue'),
+        ('low_stock', 'Low stock'),
+        ('large_payment', 'Large payment'),
+    ]
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sending', 'Sending'),
+        ('sent', 'Sent'),
+        ('skipped', 'Skipped'),
+        ('failed', 'Failed'),
+    ]
+    kind = models.CharField(max_length=30, choices=KIND_CHOICES)
+    title = models.CharField(max_length=255)
+    body = models.TextField()
+    data = models.JSONField(default=dict, blank=True)
+    # Same key -> same alert; enqueueing it again is a no-op
+    dedupe_key = models.CharField(max_length=200, unique=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(default=timezone.now)
+    available_at = models.DateTimeField(default=timezone.now)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    # Set by the worker that claimed the alert (see claim_batch)
+    claim_token = models.CharField(max_length=32, blank=True, default='')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'available_at'], name='outbox_status_available_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind}: {self.title} ({self.status})"
+
+def enqueue_low_stock_alert(sender, instance, created, **kwargs):
+    # Only a decrease can cross the threshold; a new batch adds stock
+    previous = getattr(instance, '_loaded_quantity', None)
+    instance._loaded_quantity = instance.quantity
+    if created or (previous is not None and instance.quantity >= previous):
+        return
+    from .notifications import schedule_low_stock_check
+    schedule_low_stock_check(instance.product_id)
+
+post_save.connect(enqueue_low_stock_alert, sender=Inventory)
+
+def enqueue_large_payment_alert(sender, instance, created, **kwargs):
+    if created:
+        from .notifications import check_large_payment
+        check_large_payment(instance)
+
+post_save.connect(enqueue_large_payment_alert, sender=InvoicePayment)
@@ -0,0 +1,156 @@
+import logging
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from .models import NotificationOutbox, Inventory
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue(kind, title, body, dedupe_key, data=None):
+    """
+    Record a staff alert in the outbox. Call it inside the transaction that
+    makes the change, so the alert is committed (or rolled back) with it.
+    Returns False when an alert with the same dedupe_key already exists.
+    """
+    try:
+        with transaction.atomic():
+            NotificationOutbox.objects.create(
+                kind=kind, title=title, body=body, data=data or {}, dedupe_key=dedupe_key,
+            )
+    except IntegrityError:
+        return False
+    return True
+
+
+def check_low_stock(product_id):
+    """
+    Queue a low-stock alert (once per product per day) when the product's
+    remaining quantity across all batches drops below LOW_STOCK_THRESHOLD.
+    """
+    threshold = getattr(settings, 'LOW_STOCK_THRESHOLD', 10)
+    remaining = Inventory.objects.filter(product_id=product_id).aggregate(total=Sum('quantity'))['total'] or 0
+    if remaining >= threshold:
+        return False
+    from .models import Product
+    name = Product.objects.values_list('name', flat=True).filter(pk=product_id).first()
+    return enqueue(
+        'low_stock',
+        "مخزون منخفض",
+        f"الكمية المتبقية من {name}: {remaining}",
+        f"low_stock:{product_id}:{timezone.localdate().isoformat()}",
+        {'product_id': product_id, 'remaining': remaining},
+    )
+
+
+class _LowStockChecks:
+    """
+    on_commit callback checking each product it collected once.
+    """
+    def __init__(self):
+        self.product_ids = set()
+
+    def __call__(self):
+        for product_id in sorted(self.product_ids):
+            check_low_stock(product_id)
+
+
+def schedule_low_stock_check(product_id):
+    """
+    Run check_low_stock(product_id) when the current transaction commits
+    (right away outside one). A sale that takes stock from several
+    batches of a product checks it once, after all of them are saved.
+    """
+    connection = transaction.get_connection()
+    if not connection.in_atomic_block:
+        check_low_stock(product_id)
+        return
+    # Dropped with the rest of the callbacks if the transaction rolls back
+    for _, callback, _ in connection.run_on_commit:
+        if isinstance(callback, _LowStockChecks):
+            callback.product_ids.add(product_id)
+            return
+    checks = _LowStockChecks()
+    checks.product_ids.add(product_id)
+    transaction.on_commit(checks)
+
+
+def check_large_payment(payment):
+    threshold = Decimal(str(getattr(settings, 'LARGE_PAYMENT_THRESHOLD', 1000000)))
+    if payment.amount < threshold:
+        return False
+    return enqueue(
+        'large_payment',
+        "دفعة كبيرة",
+        f"تم استلام دفعة بمبلغ {payment.amount:,.2f} على الفاتورة #{payment.invoice.number or payment.invoice_id}",
+        f"large_payment:{payment.pk}",
+        {'invoice_id': payment.invoice_id, 'amount': str(payment.amount)},
+    )
+
+
+def claim_batch(batch_size=100, stale_after=timedelta(minutes=10)):
+    """
+    Mark up to `batch_size` due alerts as 'sending' and return them. Alerts
+    stuck in 'sending' (worker died mid-batch) are put back first.
+
+    The claiming UPDATE stamps the rows with a token of this call, so when
+    two workers race for the same alerts each gets back only the rows its
+    own UPDATE changed.
+    """
+    now = timezone.now()
+    token = uuid.uuid4().hex
+    NotificationOutbox.objects.filter(status='sending', available_at__lt=now - stale_after).update(status='pending')
+    with transaction.atomic():
+        ids = list(
+            NotificationOutbox.objects.filter(status='pending', available_at__lte=now)
+            .order_by('available_at', 'pk')
+            .values_list('pk', flat=True)[:batch_size]
+        )
+        # available_at doubles as the claim time for the stale check above
+        NotificationOutbox.objects.filter(pk__in=ids, status='pending').update(
+            status='sending', available_at=now, claim_token=token,
+        )
+    return list(NotificationOutbox.objects.filter(pk__in=ids, status='sending', claim_token=token).order_by('pk'))
+
+
+def deliver(alerts, send, max_attempts=5):
+    """
+    Send claimed alerts with `send(title, body, data)` and record the outcome.
+    Alerts with identical title and body in one batch go out once.
+    `send` returns the FCM dispatcher result, or None if there is nobody to notify.
+    """
+    groups = {}
+    for alert in alerts:
+        groups.setdefault((alert.title, alert.body), []).append(alert)
+    counts = {'sent': 0, 'skipped': 0, 'retry': 0, 'failed': 0}
+    for (title, body), group in groups.items():
+        first = group[0]
+        data = dict(first.data, kind=first.kind, outbox_id=first.pk)
+        try:
+            result = send(title, body, data)
+            error = '' if result is None or result['sent'] or not result['failed'] else f"{result['failed']} deliveries failed"
+        except Exception as exc:  # keep draining the rest of the batch
+            logger.exception("Notification %s failed", first.pk)
+            result, error = None, str(exc) or exc.__class__.__name__
+        now = timezone.now()
+        for alert in group:
+            alert.attempts += 1
+            if not error:
+                alert.status = 'sent' if result is not None else 'skipped'
+                alert.sent_at = now
+                alert.last_error = '' if result is not None else 'no recipients'
+            elif alert.attempts >= max_attempts:
+                alert.status = 'failed'
+                alert.last_error = error
+            else:
+                alert.status = 'pending'
+                alert.available_at = now + timedelta(minutes=2 ** alert.attempts)
+                alert.last_error = error
+            counts['retry' if alert.status == 'pending' else alert.status] += 1
+        NotificationOutbox.objects.bulk_update(group, ['status', 'attempts', 'sent_at', 'last_error', 'available_at'])
+    return counts
@@ -0,0 +1,79 @@
+import threading
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+# First value handed out by a sequence that does not exist yet
+DEFAULT_START = 100000
+
+_blocks = {}
+_lock = threading.Lock()
+
+
+def _block_size():
+    return max(int(getattr(settings, 'INVOICE_NUMBER_BLOCK_SIZE', 20)), 1)
+
+
+def _reserve_block(name, size, start):
+    """
+    Claim the next `size` values of sequence `name` with one atomic
+    UPDATE on the counter row and return them as [first, end).
+    """
+    from .models import Sequence
+    with transaction.atomic():
+        updated = Sequence.objects.filter(name=name).update(next_value=F('next_value') + size)
+        if not updated:
+            Sequence.objects.get_or_create(name=name, defaults={'next_value': start})
+            Sequence.objects.filter(name=name).update(next_value=F('next_value') + size)
+        end = Sequence.objects.values_list('next_value', flat=True).get(name=name)
+    return [end - size, end]
+
+
+def next_number(name, start=DEFAULT_START):
+    """
+    Next value of sequence `name`. Each process reserves a block of
+    INVOICE_NUMBER_BLOCK_SIZE values at a time and hands them out from
+    memory, so most calls touch no table at all. Values are unique across
+    processes; numbers left in a block when a process exits are skipped.
+
+    A block reserved inside the caller's transaction (sale_create is
+    atomic) is only kept for later calls once that transaction commits.
+    If it rolls back, so does the counter UPDATE, and another process may
+    be handed the same range, so the rest of the block is dropped.
+    """
+    connection = transaction.get_connection()
+    with _lock:
+        block = _blocks.get(name)
+        if block is not None and block[0] < block[1]:
+            value = block[0]
+            block[0] += 1
+            return value
+    first, end = _reserve_block(name, _block_size(), start)
+    rest = [first + 1, end]
+    if connection.in_atomic_block:
+        transaction.on_commit(lambda: _keep_block(name, rest))
+    else:
+        _keep_block(name, rest)
+    return first
+
+
+def _keep_block(name, block):
+    with _lock:
+        _blocks[name] = block
+
+
+def reserve(name, count, start=DEFAULT_START):
+    """
+    Claim `count` consecutive values of sequence `name` at once, for bulk
+    inserts that don't go through next_number(). Returns them as a range.
+    """
+    first, end = _reserve_block(name, count, start)
+    return range(first, end)
+
+
+def reset_blocks():
+    """
+    Forget reserved blocks (after restoring a database).
+    """
+    with _lock:
+        _blocks.clear()
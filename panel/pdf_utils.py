@@ -0,0 +1,180 @@
+import os
+from decimal import Decimal
+from functools import lru_cache
+from django.conf import settings
+from django.http import HttpResponse
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+
+# Fixed row height (points) so we know exactly how many rows fit on a page
+ROW_HEIGHT = 16
+FONT_SIZE = 9
+HEADER_FONT_SIZE = 10
+# Rows lost to the title block on the first page
+TITLE_ROWS = 3
+# SimpleDocTemplate's frame keeps this much padding (points) on each side
+FRAME_PADDING = 6
+
+# Fallback TTFs with Arabic glyphs, tried when settings.PDF_FONT_PATH is not set
+DEFAULT_FONT_PATHS = [
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
+    '/usr/share/fonts/dejavu/DejaVuSans.ttf',
+]
+
+_fonts = None
+_reshaper = None
+
+
+def get_fonts():
+    """
+    Register the PDF body font once per process and return (regular, bold)
+    font names. Falls back to Helvetica when no TTF is available, which
+    renders Latin text only.
+    """
+    global _fonts
+    if _fonts is not None:
+        return _fonts
+    candidates = [getattr(settings, 'PDF_FONT_PATH', None)] + DEFAULT_FONT_PATHS
+    for path in candidates:
+        if path and os.path.exists(path):
+            pdfmetrics.registerFont(TTFont('TablePDF', path))
+            bold_path = path.replace('.ttf', '-Bold.ttf')
+            if os.path.exists(bold_path):
+                pdfmetrics.registerFont(TTFont('TablePDF-Bold', bold_path))
+                _fonts = ('TablePDF', 'TablePDF-Bold')
+            else:
+                _fonts = ('TablePDF', 'TablePDF')
+            return _fonts
+    _fonts = ('Helvetica', 'Helvetica-Bold')
+    return _fonts
+
+
+@lru_cache(maxsize=4096)
+def _shape_rtl(text):
+    try:
+        from arabic_reshaper import ArabicReshaper
+        from bidi.algorithm import get_display
+    except ImportError:
+        return text
+    global _reshaper
+    if _reshaper is None:
+        _reshaper = ArabicReshaper()
+    return get_display(_reshaper.reshape(text))
+
+
+def shape_text(value, rtl=False):
+    """
+    Convert a cell value to display text. For RTL documents Arabic letters
+    are joined and reordered (arabic_reshaper + python-bidi) because
+    ReportLab draws glyphs left to right without shaping.
+    """
+    if value is None:
+        return ''
+    text = str(value)
+    if not rtl or text.isascii():
+        return text
+    return _shape_rtl(text)
+
+
+class _StreamedFlowables(list):
+    """
+    List of flowables that refills itself from a generator as ReportLab
+    consumes it, so only a page or two of tables is held in memory.
+    """
+    def __init__(self, source, buffer_size=2):
+        super().__init__()
+        self._source = source
+        self._buffer_size = buffer_size
+        self._fill()
+
+    def _fill(self):
+        while super().__len__() < self._buffer_size:
+            try:
+                self.append(next(self._source))
+            except StopIteration:
+                self._source = iter(())
+                break
+
+    def __delitem__(self, index):
+        super().__delitem__(index)
+        self._fill()
+
+
+def _format_cell(value, max_chars):
+    if value is None:
+        return ''
+    if isinstance(value, (float, Decimal)):
+        return f"{value:,.2f}"
+    if isinstance(value, int) and not isinstance(value, bool):
+        return f"{value:,}"
+    return str(value)[:max_chars]
+
+
+def _table_chunks(headers, rows, col_widths, rows_per_page, first_page_rows, rtl, max_chars):
+    regular, bold = get_fonts()
+    header_row = [shape_text(h, rtl) for h in headers]
+    if rtl:
+        header_row.reverse()
+        col_widths = list(reversed(col_widths)) if col_widths else None
+    style = TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.black),
+        ('ALIGN', (0, 0), (-1, -1), 'RIGHT' if rtl else 'CENTER'),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ('FONTNAME', (0, 0), (-1, 0), bold),
+        ('FONTNAME', (0, 1), (-1, -1), regular),
+        ('FONTSIZE', (0, 0), (-1, 0), HEADER_FONT_SIZE),
+        ('FONTSIZE', (0, 1), (-1, -1), FONT_SIZE),
+        ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+    ])
+
+    chunk = [header_row]
+    limit = first_page_rows
+    for row in rows:
+        cells = [shape_text(_format_cell(v, max_chars), rtl) for v in row]
+        if rtl:
+            cells.reverse()
+        chunk.append(cells)
+        if len(chunk) > limit:
+            yield Table(chunk, colWidths=col_widths, rowHeights=ROW_HEIGHT, style=style)
+            chunk = [header_row]
+            limit = rows_per_page
+    if len(chunk) > 1 or limit == first_page_rows:
+        yield Table(chunk, colWidths=col_widths, rowHeights=ROW_HEIGHT, style=style)
+
+
+def build_table_pdf(output, title, headers, rows, col_widths=None, rtl=False, pagesize=A4, max_chars=80):
+    """
+    Write a tabular PDF to `output` (a path or file-like object).
+
+    Rows are split into page-sized Tables (one header row each) instead of a
+    single large Table, which ReportLab lays out in quadratic time. `rows`
+    may be any iterable, e.g. a queryset .iterator(); it is consumed lazily.
+    """
+    doc = SimpleDocTemplate(output, pagesize=pagesize, rightMargin=20, leftMargin=20, topMargin=30, bottomMargin=20)
+    regular, bold = get_fonts()
+    styles = getSampleStyleSheet()
+    title_style = styles['Title'].clone('TablePDFTitle', fontName=bold)
+    rows_per_page = max(int((doc.height - 2 * FRAME_PADDING) // ROW_HEIGHT) - 1, 1)
+    first_page_rows = max(rows_per_page - TITLE_ROWS, 1)
+
+    def flowables():
+        yield Paragraph(shape_text(title, rtl), title_style)
+        yield Spacer(1, 8)
+        yield from _table_chunks(headers, iter(rows), col_widths, rows_per_page, first_page_rows, rtl, max_chars)
+
+    doc.build(_StreamedFlowables(flowables()))
+
+
+def table_pdf_response(filename, title, headers, rows, col_widths=None, rtl=False, pagesize=A4):
+    """
+    Build a tabular PDF straight into an attachment response.
+    """
+    response = HttpResponse(content_type='application/pdf')
+    response['Content-Disposition'] = f'attachment; filename="{filename}.pdf"'
+    build_table_pdf(response, title, headers, rows, col_widths=col_widths, rtl=rtl, pagesize=pagesize)
+    return response
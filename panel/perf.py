@@ -0,0 +1,286 @@
+"""
+Per-view request statistics collected by panel.middleware.PerfMiddleware.
+
+Each process keeps its stats in memory (bounded: at most PERF_MAX_VIEWS
+view names and PERF_SAMPLES latency samples per view) and periodically
+writes a snapshot to PERF_STATS_DIR/perf-<pid>.json. The stats page and
+the Prometheus endpoint merge the snapshots of all worker processes.
+"""
+import json
+import os
+import random
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+
+OTHER_VIEW = '<other>'
+PERCENTILES = (0.5, 0.9, 0.95, 0.99)
+
+_local = threading.local()
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class ViewStats:
+    __slots__ = ('count', 'errors', 'total', 'max', 'sql_count', 'sql_time', 'template_time', 'samples')
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.samples = []
+
+    def add(self, latency, sql_count, sql_time, template_time, error, max_samples):
+        self.count += 1
+        self.errors += error
+        self.total += latency
+        self.max = max(self.max, latency)
+        self.sql_count += sql_count
+        self.sql_time += sql_time
+        self.template_time += template_time
+        # Reservoir sampling keeps a uniform sample in bounded memory
+        if len(self.samples) < max_samples:
+            self.samples.append(latency)
+        else:
+            slot = random.randrange(self.count)
+            if slot < max_samples:
+                self.samples[slot] = latency
+
+    def merge(self, other):
+        self.count += other.count
+        self.errors += other.errors
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        self.sql_count += other.sql_count
+        self.sql_time += other.sql_time
+        self.template_time += other.template_time
+        self.samples = self.samples + other.samples
+
+    def percentile(self, q):
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        for name in cls.__slots__:
+            setattr(stats, name, data.get(name, getattr(stats, name)))
+        return stats
+
+
+class StatsStore:
+    """
+    In-process stats, keyed by resolved view name.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}
+        self.started = time.time()
+        self.last_flush = time.monotonic()
+
+    def record(self, view_name, latency, sql_count, sql_time, template_time, error):
+        with self.lock:
+            stats = self.views.get(view_name)
+            if stats is None:
+                if len(self.views) >= _setting('PERF_MAX_VIEWS', 300):
+                    view_name = OTHER_VIEW
+                stats = self.views.setdefault(view_name, ViewStats())
+            stats.add(latency, sql_count, sql_time, template_time, error, _setting('PERF_SAMPLES', 512))
+
+    def snapshot(self):
+        with self.lock:
+            return {name: stats.as_dict() for name, stats in self.views.items()}
+
+    def reset(self):
+        with self.lock:
+            self.views.clear()
+            self.started = time.time()
+
+    def maybe_flush(self):
+        """
+        Write this process's snapshot if PERF_FLUSH_INTERVAL has passed.
+        Called at the end of a request; never raises.
+        """
+        interval = _setting('PERF_FLUSH_INTERVAL', 60)
+        if time.monotonic() - self.last_flush < interval:
+            return
+        self.last_flush = time.monotonic()
+        try:
+            self.flush()
+        except OSError:
+            pass
+
+    def flush(self):
+        directory = Path(_setting('PERF_STATS_DIR', settings.BASE_DIR / 'perf'))
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f'perf-{os.getpid()}.json'
+        tmp = path.with_suffix('.tmp')
+        tmp.write_text(json.dumps({'pid': os.getpid(), 'started': self.started, 'views': self.snapshot()}))
+        os.replace(tmp, path)
+
+
+store = StatsStore()
+
+
+def collect():
+    """
+    Stats of every process: this one live, the others from their last snapshot.
+    Returns {view_name: ViewStats}.
+    """
+    merged = {}
+
+    def add(views):
+        for name, data in views.items():
+            merged.setdefault(name, ViewStats()).merge(ViewStats.from_dict(data))
+
+    directory = Path(_setting('PERF_STATS_DIR', settings.BASE_DIR / 'perf'))
+    own = f'perf-{os.getpid()}.json'
+    for path in sorted(directory.glob('perf-*.json')) if directory.is_dir() else []:
+        if path.name == own:
+            continue
+        try:
+            add(json.loads(path.read_text()).get('views', {}))
+        except (OSError, ValueError):
+            continue
+    add(store.snapshot())
+    return merged
+
+
+def reset_all():
+    store.reset()
+    directory = Path(_setting('PERF_STATS_DIR', settings.BASE_DIR / 'perf'))
+    for path in directory.glob('perf-*.json') if directory.is_dir() else []:
+        path.unlink(missing_ok=True)
+
+
+def rows(merged):
+    """
+    Table rows for the stats page, slowest total time first.
+    """
+    result = []
+    for name, stats in merged.items():
+        count = stats.count or 1
+        result.append({
+            'view': name,
+            'count': stats.count,
+            'errors': stats.errors,
+            'avg_ms': stats.total / count * 1000,
+            'p50_ms': stats.percentile(0.5) * 1000,
+            'p95_ms': stats.percentile(0.95) * 1000,
+            'p99_ms': stats.percentile(0.99) * 1000,
+            'max_ms': stats.max * 1000,
+            'queries': stats.sql_count / count,
+            'sql_ms': stats.sql_time / count * 1000,
+            'template_ms': stats.template_time / count * 1000,
+            'total_s': stats.total,
+        })
+    result.sort(key=lambda row: row['total_s'], reverse=True)
+    return result
+
+
+def _label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def prometheus_text(merged):
+    """
+    Prometheus text exposition format (version 0.0.4).
+    """
+    metrics = [
+        ('qur_view_requests_total', 'counter', 'Requests handled per view', lambda s: s.count),
+        ('qur_view_errors_total', 'counter', 'Responses with status >= 500 per view', lambda s: s.errors),
+        ('qur_view_sql_queries_total', 'counter', 'SQL queries executed per view', lambda s: s.sql_count),
+        ('qur_view_sql_seconds_total', 'counter', 'Time spent in SQL per view', lambda s: s.sql_time),
+        ('qur_view_template_seconds_total', 'counter', 'Time spent rendering templates per view', lambda s: s.template_time),
+    ]
+    lines = []
+    for metric, kind, help_text, value in metrics:
+        lines.append(f'# HELP {metric} {help_text}')
+        lines.append(f'# TYPE {metric} {kind}')
+        for name, stats in sorted(merged.items()):
+            lines.append(f'{metric}{{view="{_label(name)}"}} {value(stats)}')
+    lines.append('# HELP qur_view_latency_seconds Request latency per view')
+    lines.append('# TYPE qur_view_latency_seconds summary')
+    for name, stats in sorted(merged.items()):
+        view = _label(name)
+        for q in PERCENTILES:
+            lines.append(f'qur_view_latency_seconds{{view="{view}",quantile="{q}"}} {stats.percentile(q):.6f}')
+        lines.append(f'qur_view_latency_seconds_sum{{view="{view}"}} {stats.total:.6f}')
+        lines.append(f'qur_view_latency_seconds_count{{view="{view}"}} {stats.count}')
+    return '\n'.join(lines) + '\n'
+
+
+class RequestTimer:
+    """
+    SQL and template time of the request running on this thread.
+    """
+    __slots__ = ('sql_count', 'sql_time', 'template_time', 'template_depth')
+
+    def __init__(self):
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.template_depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper hook
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - start
+            self.sql_count += 1
+
+
+def current_timer():
+    return getattr(_local, 'timer', None)
+
+
+def set_timer(timer):
+    _local.timer = timer
+
+
+_template_timer_installed = False
+
+
+def install_template_timer():
+    """
+    Time Django template rendering by wrapping the template backend's
+    render(). Only the outermost render of a request is counted, so
+    render_to_string() inside a template tag isn't counted twice.
+    """
+    global _template_timer_installed
+    if _template_timer_installed:
+        return
+    from django.template.backends.django import Template
+
+    original = Template.render
+
+    def render(self, context=None, request=None):
+        timer = current_timer()
+        if timer is None:
+            return original(self, context, request)
+        timer.template_depth += 1
+        start = time.perf_counter()
+        try:
+            return original(self, context, request)
+        finally:
+            timer.template_depth -= 1
+            if not timer.template_depth:
+                timer.template_time += time.perf_counter() - start
+
+    Template.render = render
+    _template_timer_installed = True
@@ -0,0 +1,46 @@
+from datetime import date, datetime, time, timedelta
+from django.utils import timezone
+
+# Period filters as half-open ranges (start <= value < end) on the raw
+# column, so SQLite can use the (…, created_at) indexes. Lookups such as
+# created_at__month compile to django_datetime_extract(), which converts
+# every row to local time and can't use an index.
+
+
+def month_bounds(year, month):
+    """
+    First day of the month and first day of the following month.
+    """
+    start = date(year, month, 1)
+    end = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+    return start, end
+
+
+def _start_of_day(day, tz=None):
+    return timezone.make_aware(datetime.combine(day, time.min), tz or timezone.get_current_timezone())
+
+
+def date_range(start, end, tz=None):
+    """
+    Aware datetimes covering the local days `start`..`end` inclusive:
+    midnight of `start` up to (not including) midnight after `end`.
+    """
+    return _start_of_day(start, tz), _start_of_day(end + timedelta(days=1), tz)
+
+
+def month_range(year, month, tz=None):
+    """
+    Aware datetimes covering the calendar month in the current time zone.
+    """
+    start, end = month_bounds(year, month)
+    return _start_of_day(start, tz), _start_of_day(end, tz)
+
+
+def in_period(field, bounds):
+    """
+    Filter kwargs for `field` in the half-open range `bounds`, e.g.
+    Sale.objects.filter(**in_period('created_at', month_range(2025, 3))).
+    Works for DateFields too when given month_bounds().
+    """
+    start, end = bounds
+    return {f'{field}__gte': start, f'{field}__lt': end}
@@ -0,0 +1,235 @@
+"""
+On-demand profiling of single staff requests, used by
+panel.middleware.ProfilerMiddleware.
+
+A staff user adds ?_profile=cprofile (or ?_profile=sample) to a panel or
+finance URL, or sends an "X-Profile: cprofile|sample" header. The request
+runs under cProfile or a stack sampler and the result is kept in
+PROFILE_DIR as <id>.json (view, path, timings, SQL summary) next to
+<id>.prof (pstats) or <id>.collapsed (one "frame;frame;frame count" line
+per stack, the input format of flamegraph.pl and speedscope).
+"""
+import cProfile
+import io
+import json
+import pstats
+import re
+import secrets
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .querylog import fingerprint
+
+MODES = ('cprofile', 'sample')
+PROFILE_ID = re.compile(r'^\d{8}-\d{6}-[0-9a-f]{6}$')
+EXTENSIONS = {'cprofile': '.prof', 'sample': '.collapsed'}
+
+# cProfile can't run twice at once, and one profile at a time is plenty
+_running = threading.Lock()
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def profile_dir():
+    return Path(_setting('PROFILE_DIR', settings.BASE_DIR / 'profiles'))
+
+
+def requested_mode(request):
+    """
+    The profiling mode asked for by the request, or None.
+    """
+    value = request.GET.get('_profile') or request.headers.get('X-Profile')
+    if not value:
+        return None
+    value = value.lower()
+    return value if value in MODES else 'cprofile'
+
+
+def allow(user):
+    """
+    Rate limit: at most PROFILE_RATE_LIMIT profiles per user per minute.
+    """
+    key = f'profiler:{user.pk}'
+    cache.add(key, 0, 60)
+    try:
+        return cache.incr(key) <= _setting('PROFILE_RATE_LIMIT', 5)
+    except ValueError:
+        return True
+
+
+class SqlSummary:
+    """
+    connection.execute_wrapper hook: query count and time, per fingerprint.
+    """
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+        self.by_query = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.count += 1
+            self.time += duration
+            entry = self.by_query.setdefault(fingerprint(sql), [0, 0.0])
+            entry[0] += 1
+            entry[1] += duration
+
+    def top(self, limit=15):
+        ordered = sorted(self.by_query.items(), key=lambda item: item[1][1], reverse=True)
+        return [{'sql': sql, 'count': count, 'ms': seconds * 1000} for sql, (count, seconds) in ordered[:limit]]
+
+
+class StackSampler:
+    """
+    Sample the stack of one thread every `interval` seconds from a
+    background thread. Cheaper than cProfile on deep call trees and
+    gives real call stacks (collapsed format) instead of per-function totals.
+    """
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = Counter()
+        self.target = threading.get_ident()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self):
+        base = str(settings.BASE_DIR)
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.target)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                filename = code.co_filename
+                if filename.startswith(base):
+                    filename = filename[len(base) + 1:]
+                elif 'site-packages/' in filename:
+                    filename = filename.split('site-packages/', 1)[1]
+                names.append(f'{code.co_name} ({filename}:{code.co_firstlineno})')
+                frame = frame.f_back
+            if names:
+                self.stacks[';'.join(reversed(names))] += 1
+
+    def collapsed(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+
+def run(mode, func, *args):
+    """
+    Call func(*args) under the profiler for `mode`. Returns (result,
+    profiler), or (result, None) when another profile is already running.
+    """
+    if not _running.acquire(blocking=False):
+        return func(*args), None
+    try:
+        if mode == 'sample':
+            profiler = StackSampler(_setting('PROFILE_SAMPLE_INTERVAL', 0.005))
+            profiler.start()
+            try:
+                return func(*args), profiler
+            finally:
+                profiler.stop()
+        profiler = cProfile.Profile()
+        return profiler.runcall(func, *args), profiler
+    finally:
+        _running.release()
+
+
+def save(mode, profiler, meta):
+    """
+    Store a profile and its metadata; returns the profile id.
+    """
+    directory = profile_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    profile_id = f"{datetime.now():%Y%m%d-%H%M%S}-{secrets.token_hex(3)}"
+    data_path = directory / (profile_id + EXTENSIONS[mode])
+    if mode == 'sample':
+        data_path.write_text(profiler.collapsed(), encoding='utf-8')
+    else:
+        profiler.dump_stats(data_path)
+    meta = dict(meta, id=profile_id, mode=mode, created=datetime.now().isoformat(timespec='seconds'))
+    (directory / f'{profile_id}.json').write_text(json.dumps(meta, ensure_ascii=False), encoding='utf-8')
+    prune(directory)
+    return profile_id
+
+
+def prune(directory):
+    """
+    Keep the newest PROFILE_KEEP profiles.
+    """
+    metas = sorted(directory.glob('*.json'), reverse=True)
+    for meta in metas[_setting('PROFILE_KEEP', 50):]:
+        for path in directory.glob(meta.stem + '.*'):
+            path.unlink(missing_ok=True)
+
+
+def list_profiles():
+    profiles = []
+    for path in sorted(profile_dir().glob('*.json'), reverse=True):
+        try:
+            profiles.append(json.loads(path.read_text(encoding='utf-8')))
+        except (OSError, ValueError):
+            continue
+    return profiles
+
+
+def load(profile_id):
+    """
+    (metadata, data file path) of a stored profile, or None.
+    """
+    if not PROFILE_ID.match(profile_id):
+        return None
+    directory = profile_dir()
+    try:
+        meta = json.loads((directory / f'{profile_id}.json').read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return None
+    data_path = directory / (profile_id + EXTENSIONS.get(meta.get('mode'), '.prof'))
+    return (meta, data_path) if data_path.exists() else None
+
+
+def summary_text(meta, data_path, limit=40):
+    """
+    Readable summary: pstats sorted by cumulative time, or for samples
+    the functions with the most samples (inclusive and on top of the stack).
+    """
+    if meta['mode'] != 'sample':
+        stream = io.StringIO()
+        stats = pstats.Stats(str(data_path), stream=stream)
+        stats.sort_stats('cumulative').print_stats(limit)
+        return stream.getvalue()
+
+    inclusive, own = Counter(), Counter()
+    total = 0
+    for line in data_path.read_text(encoding='utf-8').splitlines():
+        stack, _, count = line.rpartition(' ')
+        frames = stack.split(';')
+        count = int(count)
+        total += count
+        own[frames[-1]] += count
+        for frame in set(frames):
+            inclusive[frame] += count
+    lines = [f'{total} samples', '', 'Inclusive:']
+    lines += [f'{count:8d} {count / total:6.1%}  {frame}' for frame, count in inclusive.most_common(limit)]
+    lines += ['', 'Self:']
+    lines += [f'{count:8d} {count / total:6.1%}  {frame}' for frame, count in own.most_common(limit)]
+    return '\n'.join(lines) if total else 'No samples (the request was shorter than the sampling interval).'
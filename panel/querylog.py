@@ -0,0 +1,171 @@
+"""
+Slow and repeated (N+1) query detection, used by
+panel.middleware.QueryLogMiddleware.
+
+Every query of a request goes through a QueryInspector. Queries are
+grouped by fingerprint (the SQL with literals and parameter lists
+normalized), so `WHERE sale_id = 1` and `WHERE sale_id = 2` count as the
+same query. At the end of the request the inspector logs, to the
+"panel.querylog" logger (a rotating file, see LOGGING in settings):
+
+- every fingerprint run more than DUPLICATE_QUERY_THRESHOLD times,
+- every query slower than SLOW_QUERY_MS, with its EXPLAIN QUERY PLAN,
+
+each with the view, the template being rendered and the innermost frame
+of project code that issued the query.
+"""
+import logging
+import re
+import threading
+import time
+import traceback
+from pathlib import Path
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+_HERE = Path(__file__).resolve().parent
+_INSTRUMENTATION = {str(_HERE / name) for name in ('querylog.py', 'perf.py', 'middleware.py')}
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER = re.compile(r'%s|\?')
+_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_SPACE = re.compile(r'\s+')
+
+
+def fingerprint(sql):
+    """
+    The query with literals replaced by "?" and IN (...) lists collapsed,
+    so the same statement with different values gives the same string.
+    """
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _PLACEHOLDER.sub('?', sql)
+    sql = _LIST.sub('(...)', sql)
+    return _SPACE.sub(' ', sql).strip()
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def code_origin():
+    """
+    "path:line in function" of the innermost frame outside Django and the
+    instrumentation itself, i.e. the project code that ran the query.
+    """
+    base = str(settings.BASE_DIR)
+    for frame in reversed(traceback.extract_stack()[:-1]):
+        filename = frame.filename
+        if filename.startswith(base) and 'site-packages' not in filename and filename not in _INSTRUMENTATION:
+            return f"{Path(filename).relative_to(base)}:{frame.lineno} in {frame.name}"
+    return '?'
+
+
+def current_template():
+    stack = getattr(_local, 'templates', None)
+    return stack[-1] if stack else None
+
+
+class QueryInspector:
+    """
+    connection.execute_wrapper hook collecting the queries of one request.
+    """
+    def __init__(self):
+        self.view_name = '?'
+        self.threshold = _setting('DUPLICATE_QUERY_THRESHOLD', 5)
+        self.slow = _setting('SLOW_QUERY_MS', 100) / 1000
+        self.counts = {}
+        self.origins = {}
+        self.slow_queries = []
+        self.explaining = False
+
+    def __call__(self, execute, sql, params, many, context):
+        if self.explaining:
+            return execute(sql, params, many, context)
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            key = fingerprint(sql)
+            count = self.counts.get(key, 0) + 1
+            self.counts[key] = count
+            if count == self.threshold + 1:
+                # Where the loop is: only worked out once per fingerprint
+                self.origins[key] = (current_template(), code_origin())
+            if duration >= self.slow and not many:
+                self.slow_queries.append((duration, sql, params, self.explain(context['connection'], sql, params),
+                                          current_template(), code_origin()))
+
+    def explain(self, connection, sql, params):
+        if connection.vendor != 'sqlite' or not sql.lstrip().upper().startswith(('SELECT', 'WITH')):
+            return None
+        self.explaining = True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+                return '\n'.join(f'  {row[3]}' for row in cursor.fetchall())
+        except Exception as exc:
+            return f'  (EXPLAIN failed: {exc})'
+        finally:
+            self.explaining = False
+
+    def duplicates(self):
+        """
+        (count, fingerprint, template, code origin) of each fingerprint over
+        the threshold, most repeated first.
+        """
+        found = []
+        for key, count in self.counts.items():
+            if count > self.threshold:
+                template, origin = self.origins[key]
+                found.append((count, key, template, origin))
+        return sorted(found, key=lambda item: item[0], reverse=True)
+
+    def report(self, path=''):
+        for count, key, template, origin in self.duplicates():
+            logger.warning(
+                "Repeated query: %d times in %s [%s] template=%s at %s\n  %s",
+                count, path, self.view_name, template or '-', origin, key,
+            )
+        for duration, sql, params, plan, template, origin in self.slow_queries:
+            logger.warning(
+                "Slow query: %.1f ms in %s [%s] template=%s at %s\n  %s\n  params=%r%s",
+                duration * 1000, path, self.view_name, template or '-', origin, sql, params,
+                '\n' + plan if plan else '',
+            )
+
+
+_template_tracker_installed = False
+
+
+def install_template_tracker():
+    """
+    Keep a per-thread stack of the templates being rendered, so a query run
+    from a template (a lazy relation or method call) is logged with it.
+    {% include %} renders through Template.render too, so includes show up.
+    """
+    global _template_tracker_installed
+    if _template_tracker_installed:
+        return
+    from django.template.base import Template
+
+    original = Template.render
+
+    def render(self, context):
+        stack = getattr(_local, 'templates', None)
+        if stack is None:
+            stack = _local.templates = []
+        stack.append(self.origin.template_name if self.origin else self.name)
+        try:
+            return original(self, context)
+        finally:
+            stack.pop()
+
+    Template.render = render
+    _template_tracker_installed = True
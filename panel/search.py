@@ -0,0 +1,225 @@
+import re
+from django.db import connection, connections
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+# FTS5 index shared by every searchable model. Rows are keyed by
+# rowid = object id * 8 + kind code, so one table holds all kinds and a
+# row can be replaced without a lookup.
+SEARCH_TABLE = 'panel_search'
+
+SEARCH_KINDS = {
+    'client': 1,
+    'product': 2,
+    'supplier': 3,
+    'shipment': 4,
+    'invoice': 5,
+}
+
+# kind -> (model name, fields joined into the indexed text)
+SEARCH_SOURCES = {
+    'client': ('Client', ('name', 'phone')),
+    'product': ('Product', ('name',)),
+    'supplier': ('Supplier', ('name', 'phone')),
+    'shipment': ('Shipment', ('batch_number',)),
+    'invoice': ('Invoice', ('number',)),
+}
+
+_DIACRITICS = re.compile('[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]')
+_LETTERS = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
+    'ة': 'ه',
+    'ى': 'ي', 'ئ': 'ي',
+    'ؤ': 'و',
+    '٠': '0', '١': '1', '٢': '2', '٣': '3', '٤': '4',
+    '٥': '5', '٦': '6', '٧': '7', '٨': '8', '٩': '9',
+})
+_TOKEN = re.compile(r'\w+')
+# Definite-article prefixes, longest first
+_ARTICLES = ('وال', 'بال', 'فال', 'كال', 'ال', 'لل')
+
+
+def normalize_arabic(text):
+    """
+    Fold Arabic spelling variants so they index and match the same way:
+    strip harakat and tatweel, unify alef/hamza forms, ta marbuta -> ha,
+    alef maqsura -> ya, Arabic-Indic digits -> ASCII.
+    """
+    if text is None:
+        return ''
+    return _DIACRITICS.sub('', str(text)).translate(_LETTERS).lower()
+
+
+def index_text(text):
+    """
+    Normalized text as stored in the index. Words carrying the definite
+    article (optionally after و/ب/ف/ك/ل) are indexed with and without it,
+    so "ايمان" finds "الإيمان".
+    """
+    text = normalize_arabic(text)
+    extra = []
+    for word in _TOKEN.findall(text):
+        for prefix in _ARTICLES:
+            if word.startswith(prefix) and len(word) - len(prefix) >= 2:
+                extra.append(word[len(prefix):])
+                break
+    return ' '.join([text] + extra)
+
+
+def match_expression(term):
+    """
+    Turn user input into an FTS5 query: every word must match as a prefix.
+    Returns None when the input has nothing searchable.
+    """
+    tokens = _TOKEN.findall(normalize_arabic(term))
+    if not tokens:
+        return None
+    return ' '.join('"%s"*' % token.replace('"', '""') for token in tokens)
+
+
+def is_available():
+    return connection.vendor == 'sqlite'
+
+
+def search_q(term, kind, lookup='pk', fallback=None):
+    """
+    Q object restricting `lookup` to ids of `kind` objects matching `term`.
+    The FTS lookup runs as a subquery so the whole filter is one query.
+    Off SQLite, `fallback` (e.g. 'name__icontains') is used instead.
+    """
+    if not is_available():
+        return Q(**{fallback: term}) if fallback else Q()
+    match = match_expression(term)
+    if match is None:
+        return Q(**{f'{lookup}__in': []})
+    ids = RawSQL(
+        f"SELECT obj_id FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s AND kind = %s",
+        (match, SEARCH_KINDS[kind]),
+    )
+    return Q(**{f'{lookup}__in': ids})
+
+
+def search(term, kinds=None, limit=20):
+    """
+    Ranked hits across all indexed kinds, best first, as (kind, id) pairs.
+    """
+    match = match_expression(term)
+    if match is None or not is_available():
+        return []
+    codes = {code: kind for kind, code in SEARCH_KINDS.items()}
+    sql = f"SELECT kind, obj_id FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s"
+    params = [match]
+    if kinds:
+        sql += " AND kind IN (%s)" % ', '.join('%s' for _ in kinds)
+        params += [SEARCH_KINDS[k] for k in kinds]
+    sql += " ORDER BY bm25(%s) LIMIT %%s" % SEARCH_TABLE
+    params.append(limit)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [(codes[code], obj_id) for code, obj_id in cursor.fetchall()]
+
+
+def _row(kind, obj_id, values):
+    """
+    (rowid, body, kind, obj_id) of one index row. The text is normalized
+    here in Python, so writes to the indexed tables never depend on a
+    function registered on the connection (dbshell, the sqlite3 CLI and
+    restore scripts can still write to them).
+    """
+    code = SEARCH_KINDS[kind]
+    text = ' '.join(str(value) for value in values if value)
+    return obj_id * 8 + code, index_text(text), code, obj_id
+
+
+_INSERT = f"INSERT INTO {SEARCH_TABLE}(rowid, body, kind, obj_id) VALUES (%s, %s, %s, %s)"
+_DELETE = f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s"
+
+
+def update_index(sender, instance, created=False, update_fields=None, using='default', **kwargs):
+    """
+    post_save receiver: replace the object's index row.
+    """
+    kind = SEARCH_MODELS[sender]
+    fields = SEARCH_SOURCES[kind][1]
+    if connections[using].vendor != 'sqlite':
+        return
+    # e.g. Invoice.update_status() saving only the status
+    if update_fields is not None and not set(update_fields) & set(fields):
+        return
+    row = _row(kind, instance.pk, [getattr(instance, field) for field in fields])
+    # Saved again with the same text since this instance last wrote it
+    if not created and getattr(instance, '_search_row', None) == row:
+        return
+    with connections[using].cursor() as cursor:
+        if not created:
+            cursor.execute(_DELETE, [row[0]])
+        cursor.execute(_INSERT, row)
+    instance._search_row = row
+
+
+def remove_from_index(sender, instance, using='default', **kwargs):
+    """
+    post_delete receiver: drop the object's index row.
+    """
+    if connections[using].vendor != 'sqlite':
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute(_DELETE, [instance.pk * 8 + SEARCH_KINDS[SEARCH_MODELS[sender]]])
+
+
+# model class -> kind, filled by connect_signals()
+SEARCH_MODELS = {}
+
+
+def connect_signals():
+    """
+    Keep the index current on every save and delete of an indexed model.
+    bulk_create and queryset.update() skip these: run rebuild_index()
+    after them (the seed generator does).
+    """
+    from django.apps import apps
+    from django.db.models.signals import post_delete, post_save
+
+    for kind, (model_name, _) in SEARCH_SOURCES.items():
+        model = apps.get_model('panel', model_name)
+        SEARCH_MODELS[model] = kind
+        post_save.connect(update_index, sender=model)
+        post_delete.connect(remove_from_index, sender=model)
+
+
+def rebuild_index(cursor):
+    """
+    Repopulate the index from the source tables.
+    """
+    cursor.execute(f"DELETE FROM {SEARCH_TABLE}")
+    for kind, (model_name, fields) in SEARCH_SOURCES.items():
+        cursor.execute(f"SELECT id, {', '.join(fields)} FROM panel_{model_name.lower()}")
+        rows = [_row(kind, obj_id, values) for obj_id, *values in cursor.fetchall()]
+        cursor.executemany(_INSERT, rows)
+
+
+def drop_triggers(cursor):
+    """
+    Remove the SQL triggers that maintained the index before it moved to
+    model signals.
+    """
+    for model_name, _ in SEARCH_SOURCES.values():
+        for suffix in ('ai', 'au', 'ad'):
+            cursor.execute(f"DROP TRIGGER IF EXISTS panel_{model_name.lower()}_search_{suffix}")
+
+
+def install(cursor):
+    """
+    Create the FTS5 table and backfill it.
+    """
+    cursor.execute(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+        "body, kind UNINDEXED, obj_id UNINDEXED, "
+        "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+    )
+    rebuild_index(cursor)
+
+
+def uninstall(cursor):
+    drop_triggers(cursor)
+    cursor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
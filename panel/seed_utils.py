@@ -0,0 +1,602 @@
+"""
+Synthetic data at production volumes, for benchmarks and load tests
+(see the seed_load_data command).
+
+Everything is drawn from one random.Random(seed), so the same seed and
+volumes give the same data. Rows are written with bulk_create in batches,
+which skips save() and signals, so the generator keeps the invariants the
+views rely on itself:
+
+- a batch's Inventory.quantity is its Shipment.quantity minus the units
+  sold from it (paid and free) plus the units returned;
+- Sale.total is the sum of SaleItem.get_total minus the returned value,
+  and Invoice.total equals it;
+- invoice payments never exceed the total and Invoice.status matches them;
+- Commission.amount is the sale total times the employee's percentage,
+  and CommissionPayment rows add up to the paid amounts;
+- supplier payments never exceed what the supplier's shipments cost;
+- partner withdrawals never exceed deposits in the same currency.
+
+check_invariants() verifies them with SQL.
+"""
+import math
+import random
+import time
+from collections import Counter, defaultdict
+from datetime import timedelta
+from decimal import Decimal
+from itertools import accumulate
+
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from finance.balance_utils import COMPANY_FLOWS_SQL, rebuild_balances
+
+from .search import rebuild_index
+
+DEFAULT_VOLUMES = {
+    'areas': 30,
+    'clients': 20000,
+    'employees': 60,
+    'managers': 6,
+    'products': 400,
+    'suppliers': 40,
+    'sales': 200000,
+    'items_per_sale': 5,
+    'return_rate': 0.02,
+    'expenses': 5000,
+    'partners': 8,
+    'partner_transactions': 4000,
+    'exchanges': 2000,
+}
+
+FIRST_NAMES = [
+    'محمد', 'أحمد', 'علي', 'عمر', 'عثمان', 'إبراهيم', 'يوسف', 'حسن', 'خالد', 'مصطفى',
+    'فاطمة', 'آمنة', 'مريم', 'خديجة', 'سارة', 'هبة', 'إيمان', 'نور', 'سلمى', 'رقية',
+]
+LAST_NAMES = [
+    'عبدالله', 'الأمين', 'الطيب', 'بشير', 'عوض', 'الفاتح', 'حامد', 'عبدالرحمن', 'صالح', 'النور',
+    'إدريس', 'موسى', 'آدم', 'الحسن', 'عبدالقادر', 'يعقوب', 'الخير', 'المهدي', 'سليمان', 'عيسى',
+]
+PLACES = ['الخرطوم', 'أم درمان', 'بحري', 'مدني', 'كسلا', 'القضارف', 'عطبرة', 'بورتسودان', 'الأبيض', 'سنار']
+PRODUCT_WORDS = ['أموكسيسيلين', 'باراسيتامول', 'إيبوبروفين', 'أوميبرازول', 'ميتفورمين', 'فيتامين', 'زنك', 'حديد', 'كالسيوم', 'أزيثرومايسين']
+FORMS = ['أقراص', 'شراب', 'كبسولات', 'حقن', 'مرهم']
+UNITS = ['علبة', 'زجاجة', 'شريط', 'أمبولة']
+EXPENSES = ['إيجار', 'رواتب', 'كهرباء', 'وقود', 'ترحيل', 'صيانة', 'اتصالات']
+
+USD_RATES = (Decimal('2000'), Decimal('2600'))  # SDG per USD at the start and end of the period
+AED_RATES = (Decimal('540'), Decimal('710'))
+
+
+def _money(value):
+    return Decimal(str(round(value, 2)))
+
+
+def _zipf_weights(count, exponent):
+    # A few products and clients account for most of the sales
+    return list(accumulate(1 / (rank + 1) ** exponent for rank in range(count)))
+
+
+class LoadDataGenerator:
+    def __init__(self, seed=42, days=730, batch_size=2000, log=None):
+        self.random = random.Random(seed)
+        self.days = days
+        self.batch_size = batch_size
+        self.log = log or (lambda message: None)
+        self.end = timezone.now().replace(microsecond=0)
+        self.start = self.end - timedelta(days=days)
+        self.counts = Counter()
+        # Units returned per inventory id, added back to the batch at the end
+        self.returned = Counter()
+
+    def moment(self, after=None, within=None):
+        """
+        Random datetime in the period, or up to `within` after `after`.
+        """
+        if after is None:
+            return self.start + timedelta(seconds=self.random.randrange(self.days * 86400))
+        span = int(min(within, self.end - after).total_seconds()) if after < self.end else 0
+        return after + timedelta(seconds=self.random.randrange(span + 1))
+
+    def rate_at(self, when, rates):
+        progress = (when - self.start) / (self.end - self.start)
+        low, high = rates
+        return (low + (high - low) * Decimal(str(round(progress, 4)))).quantize(Decimal('0.01'))
+
+    def person(self):
+        return f"{self.random.choice(FIRST_NAMES)} {self.random.choice(LAST_NAMES)}"
+
+    def phone(self):
+        return '09' + ''.join(self.random.choice('0123456789') for _ in range(8))
+
+    def bulk(self, model, objects):
+        model.objects.bulk_create(objects, batch_size=self.batch_size)
+        self.counts[model._meta.object_name] += len(objects)
+        return objects
+
+    def run(self, volumes=None):
+        volumes = {**DEFAULT_VOLUMES, **(volumes or {})}
+        with transaction.atomic():
+            self.seed_reference_data(volumes)
+        self.seed_sales(volumes)
+        with transaction.atomic():
+            self.seed_commission_payments()
+            self.seed_supplier_payments()
+            self.seed_expenses(volumes['expenses'])
+            self.seed_partner_transactions(volumes['partners'], volumes['partner_transactions'])
+            self.seed_exchanges(volumes['exchanges'])
+            # bulk_create skips the signals that keep CurrencyBalance and
+            # the search index current
+            rebuild_balances()
+            if connection.vendor == 'sqlite':
+                with connection.cursor() as cursor:
+                    rebuild_index(cursor)
+        return self.counts
+
+    def seed_reference_data(self, volumes):
+        from finance.models import Currency
+        from .models import Area, Client, Employee, ExchangeRate, Manager, Product, Supplier
+
+        for code, name in Currency.CODE_CHOICES:
+            Currency.objects.get_or_create(code=code, defaults={'name': name})
+
+        areas = self.bulk(Area, [
+            Area(name=f"{self.random.choice(PLACES)} - مربع {i + 1}") for i in range(volumes['areas'])
+        ])
+        self.clients = self.bulk(Client, [
+            Client(
+                name=self.person(), phone=self.phone(),
+                address=f"{self.random.choice(PLACES)} شارع {self.random.randint(1, 60)}",
+                area=self.random.choice(areas) if areas else None,
+            )
+            for _ in range(volumes['clients'])
+        ])
+        self.employees = self.bulk(Employee, [
+            Employee(
+                name=self.person(),
+                commission_percentage=self.random.choice([Decimal('0'), Decimal('1'), Decimal('2'), Decimal('2.5'), Decimal('3')]),
+                sales_target=Decimal(self.random.randrange(20, 200) * 100000),
+                created_at=self.start,
+            )
+            for _ in range(volumes['employees'])
+        ])
+        managers = self.bulk(Manager, [
+            Manager(name=self.person(), commission_percentage=Decimal(self.random.choice([1, 2])))
+            for _ in range(volumes['managers'])
+        ])
+        Through = Manager.employees.through
+        self.bulk(Through, [
+            Through(manager_id=managers[i % len(managers)].pk, employee_id=employee.pk)
+            for i, employee in enumerate(self.employees)
+        ] if managers else [])
+
+        self.bulk(ExchangeRate, [
+            ExchangeRate(rate=self.rate_at(self.start + timedelta(days=day), USD_RATES),
+                         updated_at=self.start + timedelta(days=day))
+            for day in range(0, self.days + 1, 30)
+        ])
+        rate = int(self.rate_at(self.end, USD_RATES))
+        self.products = self.bulk(Product, [
+            Product(
+                name=f"{self.random.choice(PRODUCT_WORDS)} {self.random.choice(FORMS)} {self.random.choice([50, 100, 250, 500])} ملغ #{i + 1}",
+                description='', unit=self.random.choice(UNITS), exchange_rate=rate,
+            )
+            for i in range(volumes['products'])
+        ])
+        self.suppliers = self.bulk(Supplier, [
+            Supplier(name=f"شركة {self.random.choice(LAST_NAMES)} للأدوية {i + 1}", phone=self.phone(),
+                     address=self.random.choice(PLACES))
+            for i in range(volumes['suppliers'])
+        ])
+        self.seed_shipments(volumes)
+
+    def seed_shipments(self, volumes):
+        """
+        Restock every product at regular intervals with enough units to
+        cover its share of the sales (popular products get more), so sales
+        can always be served from a batch already received.
+        """
+        from .models import Inventory, Shipment
+
+        self.product_weights = _zipf_weights(len(self.products), 0.8)
+        total_weight = self.product_weights[-1]
+        # Paid units average 10.5 per item plus free goods, with headroom
+        units = volumes['sales'] * volumes['items_per_sale'] * 13
+        restocks = max(2, self.days // 45)
+        shipments = []
+        previous = 0
+        for product, cumulative in zip(self.products, self.product_weights):
+            share = (cumulative - previous) / total_weight
+            previous = cumulative
+            per_shipment = max(50, math.ceil(units * share / restocks))
+            supplier = self.random.choice(self.suppliers) if self.suppliers else None
+            cost_usd = Decimal(self.random.randrange(50, 3000)) / 100
+            for index in range(restocks):
+                received = self.start + timedelta(days=index * self.days / restocks - 10)
+                rate = self.rate_at(max(received, self.start), USD_RATES)
+                shipments.append(Shipment(
+                    product=product, supplier=supplier,
+                    quantity=per_shipment,
+                    cost_usd=cost_usd,
+                    cost_sdg=(cost_usd * rate).quantize(Decimal('0.01')),
+                    sale_usd=(cost_usd * Decimal(self.random.choice(['1.25', '1.35', '1.5']))).quantize(Decimal('0.01')),
+                    shipment_cost=(cost_usd * rate * per_shipment * Decimal('0.05')).quantize(Decimal('0.01')),
+                    exchange_rate=int(rate),
+                    received_at=received,
+                    expiry_date=(received + timedelta(days=self.random.randrange(240, 1100))).date(),
+                    batch_number=f"B{product.pk:05d}-{index + 1:03d}",
+                ))
+        self.bulk(Shipment, shipments)
+        inventories = self.bulk(Inventory, [
+            Inventory(product=shipment.product, shipment=shipment, quantity=shipment.quantity)
+            for shipment in shipments
+        ])
+        # FIFO batches per product: [inventory, units left, received_at]
+        self.batches = defaultdict(list)
+        for inventory, shipment in zip(inventories, shipments):
+            self.batches[inventory.product_id].append([inventory, shipment.quantity, shipment.received_at])
+        self.next_batch = defaultdict(int)
+        self.prices = {
+            inventory.pk: float(shipment.sale_usd) * float(shipment.product.exchange_rate)
+            for inventory, shipment in zip(inventories, shipments)
+        }
+
+    def take_units(self, product_id, when, wanted):
+        """
+        The batch to sell `wanted` units of a product from at `when`, oldest
+        first. Returns (batch, units) with units <= wanted, or None when
+        nothing received by then is left.
+        """
+        batches = self.batches[product_id]
+        index = self.next_batch[product_id]
+        while index < len(batches):
+            batch = batches[index]
+            if batch[2] > when:
+                return None
+            if batch[1] > 0:
+                units = min(wanted, batch[1])
+                batch[1] -= units
+                return batch, units
+            index += 1
+            self.next_batch[product_id] = index
+        return None
+
+    def seed_sales(self, volumes):
+        """
+        Sales in chronological order, each with items, maybe returns, an
+        invoice with payments and a commission; one transaction per chunk.
+        """
+        count = volumes['sales']
+        seconds = self.days * 86400
+        offsets = sorted(self.random.randrange(seconds) for _ in range(count))
+        client_weights = _zipf_weights(len(self.clients), 0.6)
+        chunk = self.batch_size * 5
+        started = time.perf_counter()
+        for first in range(0, count, chunk):
+            with transaction.atomic():
+                self.seed_sale_chunk(offsets[first:first + chunk], volumes, client_weights)
+            done = min(first + chunk, count)
+            elapsed = time.perf_counter() - started
+            self.log(f"{done}/{count} sales, {self.counts['SaleItem']} items ({done / elapsed:,.0f} sales/s)")
+
+        # Plain executemany: bulk_update's CASE WHEN per row is far slower here
+        from .models import Inventory
+        rows = [
+            (left + self.returned[inventory.pk], inventory.pk)
+            for batches in self.batches.values() for inventory, left, _ in batches
+        ]
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.executemany(f"UPDATE {Inventory._meta.db_table} SET quantity = %s WHERE id = %s", rows)
+
+    def seed_sale_chunk(self, offsets, volumes, client_weights):
+        from .models import Commission, Invoice, InvoicePayment, ReturnedProduct, Sale, SaleItem
+        rnd = self.random
+        numbers = self.invoice_numbers(len(offsets))
+        clients = rnd.choices(self.clients, cum_weights=client_weights, k=len(offsets)) if self.clients else [None] * len(offsets)
+        sales, sale_items, sale_returns = [], [], []
+        for offset, client in zip(offsets, clients):
+            when = self.start + timedelta(seconds=offset)
+            sale = Sale(client=client, employee=rnd.choice(self.employees) if self.employees else None, created_at=when)
+            items, returns, total = [], [], 0.0
+            for product in rnd.choices(self.products, cum_weights=self.product_weights,
+                                       k=max(1, round(rnd.gauss(volumes['items_per_sale'], 1.5)))):
+                quantity = rnd.randint(1, 20)
+                free = rnd.choice([0, 0, 0, 5, 10, 20]) if quantity >= 5 else 0
+                free_units = math.floor(quantity * free / 100)
+                taken = self.take_units(product.pk, when, quantity + free_units)
+                if taken is None:
+                    continue
+                batch, units = taken
+                if units < quantity + free_units:
+                    # Last units of the batch: sell them without free goods
+                    quantity, free = units, 0
+                discount = rnd.choice([0, 0, 0, 0, 2, 5, 10])
+                price = self.prices[batch[0].pk]
+                item = SaleItem(inventory=batch[0], quantity=quantity, price=_money(price),
+                                free_goods_discount=Decimal(free), price_discount=Decimal(discount))
+                unit_price = float(item.price) / (1 + discount / 100) if discount else float(item.price)
+                total += unit_price * quantity
+                items.append(item)
+                if rnd.random() < volumes['return_rate']:
+                    back = rnd.randint(1, quantity)
+                    total -= unit_price * back
+                    returns.append((item, back))
+            if not items:
+                continue
+            sale.total = _money(total)
+            sales.append(sale)
+            sale_items.append(items)
+            sale_returns.append(returns)
+
+        self.bulk(Sale, sales)
+        for sale, items in zip(sales, sale_items):
+            for item in items:
+                item.sale = sale
+        self.bulk(SaleItem, [item for items in sale_items for item in items])
+        self.bulk(ReturnedProduct, [
+            ReturnedProduct(sale=sale, sale_item=item, quantity=back,
+                            created_at=self.moment(sale.created_at, timedelta(days=20)), note='مرتجع')
+            for sale, returns in zip(sales, sale_returns) for item, back in returns
+        ])
+        for returns in sale_returns:
+            for item, back in returns:
+                self.returned[item.inventory_id] += back
+
+        invoices, payments, commissions = [], [], []
+        for sale in sales:
+            created = timezone.localtime(sale.created_at)
+            invoice = Invoice(sale=sale, created_at=sale.created_at, total=sale.total, file_path='',
+                              number=str(next(numbers)), due_date=created.date() + timedelta(days=30))
+            paid = self.invoice_payments(invoice, payments)
+            if paid >= sale.total and sale.total > 0:
+                invoice.status = 'paid'
+            elif paid > 0:
+                invoice.status = 'partial'
+            else:
+                invoice.status = 'unpaid'
+            invoices.append(invoice)
+            employee = sale.employee
+            if employee and employee.commission_percentage and sale.total > 0:
+                commissions.append(Commission(
+                    employee=employee, sale=sale, created_at=sale.created_at,
+                    amount=_money(float(sale.total) * float(employee.commission_percentage) / 100),
+                ))
+        self.bulk(Invoice, invoices)
+        for payment in payments:
+            payment.invoice_id = payment.invoice.pk
+        self.bulk(InvoicePayment, payments)
+        self.bulk(Commission, commissions)
+
+    def invoice_numbers(self, count):
+        """
+        `count` unused invoice numbers from the invoice sequence, skipping
+        any left in the table by the old random generator.
+        """
+        from .models import Invoice
+        from .numbering import reserve
+
+        numbers = []
+        while len(numbers) < count:
+            block = [str(number) for number in reserve('invoice', count - len(numbers))]
+            taken = set(Invoice.objects.filter(number__in=block).values_list('number', flat=True))
+            numbers += [number for number in block if number not in taken]
+        return iter(numbers)
+
+    def invoice_payments(self, invoice, payments):
+        """
+        Add payments for an invoice: older invoices are mostly settled,
+        recent ones mostly open. Returns the amount paid.
+        """
+        from .models import InvoicePayment
+
+        total = invoice.total
+        if total <= 0:
+            return Decimal('0')
+        age = (self.end - invoice.created_at).days
+        paid_share, partial_share = (0.85, 0.1) if age > 60 else (0.5, 0.3) if age > 30 else (0.2, 0.3)
+        roll = self.random.random()
+        if roll < paid_share:
+            if self.random.random() < 0.7:
+                amounts = [total]
+            else:
+                first = (total * Decimal('0.5')).quantize(Decimal('0.01'))
+                amounts = [first, total - first]
+        elif roll < paid_share + partial_share:
+            amounts = [(total * Decimal(self.random.randrange(20, 80)) / 100).quantize(Decimal('0.01'))]
+        else:
+            return Decimal('0')
+        when = invoice.created_at
+        for amount in amounts:
+            if amount <= 0:
+                continue
+            when = self.moment(when, timedelta(days=30))
+            payments.append(InvoicePayment(invoice=invoice, amount=amount, paid_at=when))
+        return sum(amounts, Decimal('0'))
+
+    def seed_commission_payments(self):
+        """
+        One payment per employee and month for that month's commissions,
+        up to the month before last; later commissions stay unpaid.
+        """
+        from .models import Commission, CommissionPayment
+
+        cutoff = timezone.localtime(self.end).replace(day=1, hour=0, minute=0, second=0) - timedelta(days=1)
+        cutoff = cutoff.replace(day=1)
+        Link = CommissionPayment.commissions.through
+        rows = (
+            Commission.objects.filter(created_at__lt=cutoff, employee__in=self.employees)
+            .order_by('employee_id', 'created_at').values_list('pk', 'employee_id', 'amount', 'created_at')
+        )
+        groups = defaultdict(list)
+        for pk, employee_id, amount, created_at in rows.iterator(chunk_size=self.batch_size):
+            local = timezone.localtime(created_at)
+            groups[(employee_id, local.year, local.month)].append((pk, amount))
+        payments, links = [], []
+        for (employee_id, year, month), paid in sorted(groups.items()):
+            month_end = timezone.localtime(self.start).replace(year=year, month=month, day=28)
+            payments.append(CommissionPayment(
+                employee_id=employee_id, amount=sum(amount for _, amount in paid),
+                paid_at=month_end + timedelta(days=self.random.randrange(3, 10)), note='عمولة شهرية',
+            ))
+            links.append([pk for pk, _ in paid])
+        self.bulk(CommissionPayment, payments)
+        self.bulk(Link, [
+            Link(commissionpayment_id=payment.pk, commission_id=pk)
+            for payment, pks in zip(payments, links) for pk in pks
+        ])
+        Commission.objects.filter(created_at__lt=cutoff, employee__in=self.employees).update(paid_amount=F('amount'))
+
+    def seed_supplier_payments(self):
+        from .models import Shipment, SupplierPayment
+
+        owed = defaultdict(Decimal)
+        for supplier_id, cost_usd, quantity in Shipment.objects.filter(
+            supplier__in=self.suppliers,
+        ).values_list('supplier_id', 'cost_usd', 'quantity'):
+            owed[supplier_id] += (cost_usd or 0) * quantity
+        payments = []
+        for supplier_id, amount in owed.items():
+            remaining = (amount * Decimal(self.random.randrange(70, 96)) / 100).quantize(Decimal('0.01'))
+            installments = self.random.randint(3, 12)
+            for index in range(installments):
+                part = remaining if index == installments - 1 else (remaining / (installments - index)).quantize(Decimal('0.01'))
+                remaining -= part
+                payments.append(SupplierPayment(supplier_id=supplier_id, amount=part, paid_at=self.moment(),
+                                                note='دفعة للمورد'))
+        self.bulk(SupplierPayment, payments)
+
+    def seed_expenses(self, count):
+        from .models import Expense
+        self.bulk(Expense, [
+            Expense(description=self.random.choice(EXPENSES), amount=Decimal(self.random.randrange(5, 500) * 1000),
+                    date=timezone.localtime(self.moment()).date())
+            for _ in range(count)
+        ])
+
+    def seed_partner_transactions(self, partner_count, count):
+        from finance.models import Currency, Partner, PartnerTransaction
+
+        partners = self.bulk(Partner, [Partner(full_name=self.person()) for _ in range(partner_count)])
+        if not partners:
+            return
+        currencies = list(Currency.objects.all())
+        balances = defaultdict(Decimal)
+        transactions = []
+        for offset in sorted(self.random.randrange(self.days) for _ in range(count)):
+            partner, currency = self.random.choice(partners), self.random.choice(currencies)
+            key = (partner.pk, currency.pk)
+            scale = 1000 if currency.code == 'SDG' else 1
+            if balances[key] > 0 and self.random.random() < 0.35:
+                kind = 'withdrawal'
+                amount = (balances[key] * Decimal(self.random.randrange(5, 50)) / 100).quantize(Decimal('0.01'))
+                balances[key] -= amount
+            else:
+                kind = 'deposit'
+                amount = Decimal(self.random.randrange(100, 10000) * scale)
+                balances[key] += amount
+            transactions.append(PartnerTransaction(
+                partner=partner, currency=currency, transaction_type=kind, amount=amount,
+                date=(self.start + timedelta(days=offset)).date(),
+            ))
+        self.bulk(PartnerTransaction, transactions)
+
+    def seed_exchanges(self, count):
+        from finance.models import Currency, CurrencyExchange
+
+        by_code = {currency.code: currency for currency in Currency.objects.all()}
+        exchanges = []
+        for offset in sorted(self.random.randrange(self.days) for _ in range(count)):
+            day = self.start + timedelta(days=offset)
+            code, rates = ('USD', USD_RATES) if self.random.random() < 0.75 else ('AED', AED_RATES)
+            rate = self.rate_at(day, rates) + Decimal(self.random.randrange(-20, 21))
+            bought = Decimal(self.random.randrange(5, 500) * 100)
+            exchanges.append(CurrencyExchange(
+                sold_currency=by_code['SDG'], bought_currency=by_code[code],
+                sold_amount=bought * rate, bought_amount=bought, exchange_rate=rate,
+                date=day.date(),
+            ))
+        self.bulk(CurrencyExchange, exchanges)
+
+
+INVARIANT_QUERIES = {
+    'batch stock differs from received - sold + returned - lost': """
+        SELECT COUNT(*) FROM panel_inventory i
+        JOIN panel_shipment s ON s.id = i.shipment_id
+        LEFT JOIN (SELECT inventory_id, SUM(quantity + CAST(quantity * free_goods_discount / 100 AS INTEGER)) AS units
+                   FROM panel_saleitem GROUP BY inventory_id) sold ON sold.inventory_id = i.id
+        LEFT JOIN (SELECT si.inventory_id, SUM(r.quantity) AS units FROM panel_returnedproduct r
+                   JOIN panel_saleitem si ON si.id = r.sale_item_id GROUP BY si.inventory_id) back ON back.inventory_id = i.id
+        LEFT JOIN (SELECT inventory_id, SUM(quantity) AS units FROM panel_lostproduct GROUP BY inventory_id) lost
+                   ON lost.inventory_id = i.id
+        WHERE i.quantity != s.quantity - COALESCE(sold.units, 0) + COALESCE(back.units, 0) - COALESCE(lost.units, 0)
+    """,
+    'sale total differs from its items minus returns': """
+        SELECT COUNT(*) FROM panel_sale s
+        JOIN (SELECT sale_id, SUM(price / (1 + price_discount / 100.0) * quantity) AS value
+              FROM panel_saleitem GROUP BY sale_id) items ON items.sale_id = s.id
+        LEFT JOIN (SELECT r.sale_id, SUM(si.price / (1 + si.price_discount / 100.0) * r.quantity) AS value
+                   FROM panel_returnedproduct r JOIN panel_saleitem si ON si.id = r.sale_item_id
+                   GROUP BY r.sale_id) back ON back.sale_id = s.id
+        WHERE ABS(s.total - (items.value - COALESCE(back.value, 0))) > 0.05
+    """,
+    'invoice total differs from its sale': """
+        SELECT COUNT(*) FROM panel_invoice i JOIN panel_sale s ON s.id = i.sale_id WHERE i.total != s.total
+    """,
+    'invoice overpaid or status out of date': """
+        SELECT COUNT(*) FROM panel_invoice i JOIN panel_sale s ON s.id = i.sale_id
+        LEFT JOIN (SELECT invoice_id, SUM(amount) AS paid FROM panel_invoicepayment GROUP BY invoice_id) p
+               ON p.invoice_id = i.id
+        WHERE COALESCE(p.paid, 0) > s.total + 0.005
+           OR i.status != CASE WHEN COALESCE(p.paid, 0) >= s.total - 0.005 AND s.total > 0 THEN 'paid'
+                               WHEN COALESCE(p.paid, 0) > 0 THEN 'partial' ELSE 'unpaid' END
+    """,
+    'commission paid more than its amount': """
+        SELECT COUNT(*) FROM panel_commission WHERE paid_amount > amount + 0.005
+    """,
+    'commission payments differ from paid commissions': """
+        SELECT COUNT(*) FROM (
+            SELECT employee_id, SUM(paid_amount) AS paid FROM panel_commission GROUP BY employee_id
+        ) c LEFT JOIN (
+            SELECT employee_id, SUM(amount) AS paid FROM panel_commissionpayment GROUP BY employee_id
+        ) p ON p.employee_id = c.employee_id
+        WHERE ABS(c.paid - COALESCE(p.paid, 0)) > 0.01
+    """,
+    'supplier paid more than its shipments cost': """
+        SELECT COUNT(*) FROM panel_supplier sup
+        JOIN (SELECT supplier_id, SUM(amount) AS paid FROM panel_supplierpayment GROUP BY supplier_id) p
+             ON p.supplier_id = sup.id
+        LEFT JOIN (SELECT supplier_id, SUM(COALESCE(cost_usd, 0) * quantity) AS owed FROM panel_shipment
+                   GROUP BY supplier_id) s ON s.supplier_id = sup.id
+        WHERE p.paid > COALESCE(s.owed, 0) + 0.01
+    """,
+    'company balance differs from its ledger': f"""
+        SELECT COUNT(*) FROM finance_currencybalance b
+        JOIN finance_currency c ON c.id = b.currency_id
+        LEFT JOIN (SELECT code, SUM(total) AS total FROM ({COMPANY_FLOWS_SQL}) by_source GROUP BY code) ledger
+             ON ledger.code = c.code
+        WHERE ABS(b.balance - COALESCE(ledger.total, 0)) > 0.005
+    """,
+    'partner withdrew more than deposited': """
+        SELECT COUNT(*) FROM (
+            SELECT partner_id, currency_id,
+                   SUM(CASE WHEN transaction_type = 'deposit' THEN amount ELSE -amount END) AS balance
+            FROM finance_partnertransaction GROUP BY partner_id, currency_id
+        ) WHERE balance < -0.005
+    """,
+}
+
+
+def check_invariants():
+    """
+    Run the consistency checks over the whole database. Returns a list of
+    "description: N rows" strings, empty when everything holds.
+    """
+    problems = []
+    with connection.cursor() as cursor:
+        for description, sql in INVARIANT_QUERIES.items():
+            cursor.execute(sql)
+            count = cursor.fetchone()[0]
+            if count:
+                problems.append(f"{description}: {count} rows")
+    return problems
@@ -0,0 +1,135 @@
+// Search-as-you-type for <select data-autocomplete-url="..."> rendered by
+// panel.widgets.AutocompleteSelect. The select only carries the chosen
+// option; matches are fetched from the server as the user types.
+(function () {
+  'use strict';
+
+  var DEBOUNCE_MS = 250;
+
+  function forwardParams(select) {
+    var params = {};
+    (select.dataset.forward || '').split(',').forEach(function (pair) {
+      if (!pair) return;
+      var parts = pair.split(':');
+      var field = document.getElementById(parts[1]);
+      if (field && field.value) params[parts[0]] = field.value;
+    });
+    return params;
+  }
+
+  function chooseOption(select, item) {
+    var option = Array.prototype.find.call(select.options, function (opt) {
+      return opt.value === String(item.id);
+    });
+    if (!option) {
+      option = new Option(item.text, item.id);
+      select.appendChild(option);
+    }
+    Object.keys(item.data || {}).forEach(function (key) {
+      option.setAttribute('data-' + key, item.data[key]);
+    });
+    select.value = String(item.id);
+    select.dispatchEvent(new Event('change', { bubbles: true }));
+  }
+
+  function init(select) {
+    if (select.dataset.autocompleteReady) return;
+    select.dataset.autocompleteReady = '1';
+
+    var wrapper = document.createElement('div');
+    wrapper.className = 'position-relative';
+    var input = document.createElement('input');
+    input.type = 'search';
+    input.className = 'form-control';
+    input.autocomplete = 'off';
+    input.placeholder = select.dataset.placeholder || '';
+    input.disabled = select.disabled;
+    var menu = document.createElement('div');
+    menu.className = 'dropdown-menu w-100';
+    menu.style.maxHeight = '260px';
+    menu.style.overflowY = 'auto';
+
+    select.parentNode.insertBefore(wrapper, select);
+    wrapper.appendChild(input);
+    wrapper.appendChild(menu);
+    wrapper.appendChild(select);
+    select.style.display = 'none';
+
+    function showSelected() {
+      var opt = select.options[select.selectedIndex];
+      input.value = opt && opt.value ? opt.text.trim() : '';
+    }
+
+    var timer = null;
+    var pending = null;
+
+    function search() {
+      var params = forwardParams(select);
+      params.q = input.value.trim();
+      var url = select.dataset.autocompleteUrl + '?' + new URLSearchParams(params).toString();
+      if (pending) pending.abort();
+      pending = new AbortController();
+      fetch(url, { signal: pending.signal, headers: { 'X-Requested-With': 'XMLHttpRequest' } })
+        .then(function (resp) { return resp.json(); })
+        .then(function (payload) { render(payload.results || []); })
+        .catch(function () {});
+    }
+
+    function render(results) {
+      menu.innerHTML = '';
+      if (!results.length) {
+        var empty = document.createElement('span');
+        empty.className = 'dropdown-item-text text-muted';
+        empty.textContent = 'لا توجد نتائج';
+        menu.appendChild(empty);
+      }
+      results.forEach(function (item) {
+        var link = document.createElement('button');
+        link.type = 'button';
+        link.className = 'dropdown-item text-end';
+        link.textContent = item.text;
+        link.addEventListener('mousedown', function (e) {
+          e.preventDefault();
+          chooseOption(select, item);
+          showSelected();
+          menu.classList.remove('show');
+        });
+        menu.appendChild(link);
+      });
+      menu.classList.add('show');
+    }
+
+    input.addEventListener('input', function () {
+      clearTimeout(timer);
+      if (!input.value && !select.required) {
+        select.value = '';
+        select.dispatchEvent(new Event('change', { bubbles: true }));
+      }
+      timer = setTimeout(search, DEBOUNCE_MS);
+    });
+    input.addEventListener('focus', search);
+    input.addEventListener('blur', function () {
+      menu.classList.remove('show');
+      showSelected();
+    });
+    select.addEventListener('change', showSelected);
+    // A new value in a forwarded field (e.g. the product) invalidates the choice
+    (select.dataset.forward || '').split(',').forEach(function (pair) {
+      var field = pair && document.getElementById(pair.split(':')[1]);
+      if (!field) return;
+      field.addEventListener('change', function () {
+        if (!select.value) return;
+        select.value = '';
+        select.dispatchEvent(new Event('change', { bubbles: true }));
+      });
+    });
+    showSelected();
+  }
+
+  function initAll(root) {
+    (root || document).querySelectorAll('select[data-autocomplete-url]').forEach(init);
+  }
+
+  window.initAutocomplete = initAll;
+  document.addEventListener('DOMContentLoaded', function () { initAll(); });
+})();
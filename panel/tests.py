@@ -1,3 +1,1184 @@
-from django.test import TestCase
+import re
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import skipUnless
 
-# Create your tests here.
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import (
+    Area, Client, Commission, Employee, Inventory, Invoice, InvoicePayment,
+    Product, Sale, Shipment,
+)
+from .periods import in_period, month_bounds, month_range
+
+# "SCAN <table>" with no index after it: SQLite reads every row
+FULL_SCAN = re.compile(r'\bSCAN (\w+)$')
+# Django's aliases for subquery and repeated-join tables
+TABLE_ALIAS = re.compile(r'[TU]\d+')
+
+
+class QueryPlanMixin:
+    """
+    Assertions over SQLite's EXPLAIN QUERY PLAN, so a change that drops an
+    index or makes a filter unsargable fails here instead of in production.
+    """
+
+    def full_scans(self, sql, params=()):
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            details = [row[-1] for row in cursor.fetchall()]
+        return [match.group(1) for match in map(FULL_SCAN.search, details) if match]
+
+    def assertIndexed(self, queryset, index=None):
+        """
+        `queryset` runs without a full table scan, and through `index` if given.
+        """
+        plan = queryset.explain()
+        sql, params = queryset.query.sql_with_params()
+        scans = self.full_scans(sql, params)
+        self.assertEqual(scans, [], f"Full scan on {', '.join(scans)}:\n{plan}")
+        if index:
+            self.assertIn(index, plan)
+
+    def assertViewIndexed(self, url, tables):
+        """
+        Every SELECT the view at `url` runs avoids full scans of `tables`.
+        """
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        for query in ctx.captured_queries:
+            sql = query['sql']
+            if not sql.startswith('SELECT'):
+                continue
+            scans = [table for table in self.full_scans(sql) if table in tables or TABLE_ALIAS.fullmatch(table)]
+            self.assertEqual(scans, [], f"{url} scans {', '.join(scans)}:\n{sql}")
+
+
+def seed_sales(clients=20, employees=5, products=10, sales=200):
+    """
+    Small but non-trivial dataset covering the tables the hot views read.
+    """
+    now = timezone.now()
+    area = Area.objects.create(name="الخرطوم")
+    client_objs = Client.objects.bulk_create(
+        [Client(name=f"عميل {i}", phone=f"0912{i:06d}", area=area) for i in range(clients)]
+    )
+    employee_objs = Employee.objects.bulk_create(
+        [Employee(name=f"مندوب {i}", commission_percentage=Decimal('5')) for i in range(employees)]
+    )
+    product_objs = Product.objects.bulk_create([Product(name=f"منتج {i}") for i in range(products)])
+    shipment_objs = Shipment.objects.bulk_create([
+        Shipment(product=product, quantity=100, shipment_cost=Decimal('1000'), batch_number=f"B{i}",
+                 received_at=now - timedelta(days=i), expiry_date=(now + timedelta(days=30 * (i + 1))).date())
+        for i, product in enumerate(product_objs)
+    ])
+    Inventory.objects.bulk_create([
+        Inventory(product=shipment.product, shipment=shipment, quantity=100 - i * 10)
+        for i, shipment in enumerate(shipment_objs)
+    ])
+    sale_objs = Sale.objects.bulk_create([
+        Sale(client=client_objs[i % clients], employee=employee_objs[i % employees],
+             created_at=now - timedelta(days=i), total=Decimal('100') * (i + 1))
+        for i in range(sales)
+    ])
+    invoices = Invoice.objects.bulk_create([
+        Invoice(sale=sale, total=sale.total, status=('unpaid', 'partial', 'paid')[i % 3],
+                created_at=sale.created_at, due_date=(sale.created_at + timedelta(days=30)).date())
+        for i, sale in enumerate(sale_objs)
+    ])
+    InvoicePayment.objects.bulk_create([
+        InvoicePayment(invoice=invoice, amount=invoice.total / 2, paid_at=invoice.created_at)
+        for invoice in invoices if invoice.status != 'unpaid'
+    ])
+    Commission.objects.bulk_create([
+        Commission(employee=sale.employee, sale=sale, amount=sale.total / 20, created_at=sale.created_at)
+        for sale in sale_objs
+    ])
+    return client_objs, employee_objs, product_objs
+
+
+@skipUnless(connection.vendor == 'sqlite', "EXPLAIN QUERY PLAN output is SQLite-specific")
+# The test database only exists on the 'default' connection
+@override_settings(REPORTS_DATABASE='off')
+class HotQueryPlanTests(QueryPlanMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.clients, cls.employees, cls.products = seed_sales()
+        cls.today = timezone.localdate()
+
+    def test_employee_monthly_sales(self):
+        self.assertIndexed(
+            Sale.objects.filter(employee=self.employees[0],
+                                **in_period('created_at', month_range(self.today.year, self.today.month))),
+            'sale_employee_created_idx',
+        )
+
+    def test_employee_commissions(self):
+        self.assertIndexed(Commission.objects.filter(employee=self.employees[0]).order_by('created_at'))
+
+    def test_client_invoices(self):
+        self.assertIndexed(
+            Invoice.objects.filter(sale__client=self.clients[0]).select_related('sale').order_by('created_at'),
+            'sale_client_created_idx',
+        )
+
+    def test_upcoming_due_invoices(self):
+        self.assertIndexed(
+            Invoice.objects.filter(status='unpaid', due_date__gte=self.today,
+                                   due_date__lte=self.today + timedelta(days=7)).select_related('sale', 'sale__client'),
+            'invoice_status_due_idx',
+        )
+
+    def test_open_invoices(self):
+        self.assertIndexed(Invoice.objects.filter(status__in=['unpaid', 'partial']), 'invoice_status_due_idx')
+
+    def test_invoice_payments(self):
+        invoice = Invoice.objects.filter(status='partial').first()
+        self.assertIndexed(InvoicePayment.objects.filter(invoice=invoice).order_by('paid_at'),
+                           'invoicepayment_invoice_idx')
+
+    def test_recent_lists_use_ordering_index(self):
+        self.assertIndexed(Sale.objects.select_related('client', 'employee').order_by('-created_at')[:50],
+                           'sale_created_idx')
+        self.assertIndexed(Invoice.objects.select_related('sale', 'sale__client').order_by('-created_at')[:50],
+                           'invoice_created_idx')
+        self.assertIndexed(Shipment.objects.select_related('product').order_by('-received_at')[:50],
+                           'shipment_received_idx')
+
+    def test_shipments_received_in_period(self):
+        self.assertIndexed(Shipment.objects.filter(received_at__gte=timezone.now() - timedelta(days=3)),
+                           'shipment_received_idx')
+
+    def test_expiring_shipments(self):
+        self.assertIndexed(Shipment.objects.filter(expiry_date__lte=self.today + timedelta(days=60)),
+                           'shipment_expiry_idx')
+
+    def test_expiry_scan(self):
+        from .expiry_utils import expiring_batches
+        self.assertIndexed(expiring_batches(30, self.today), 'shipment_expiry_idx')
+
+    def test_in_stock_batches(self):
+        self.assertIndexed(
+            Inventory.objects.filter(product=self.products[0], quantity__gt=0)
+            .select_related('shipment').order_by('shipment__expiry_date'),
+            'inventory_product_qty_idx',
+        )
+
+    def test_hot_views(self):
+        client = self.clients[0]
+        employee = self.employees[0]
+        tables = {'panel_sale', 'panel_invoice', 'panel_invoicepayment', 'panel_commission'}
+        self.assertViewIndexed(reverse('panel:client_detail', args=[client.pk]), tables)
+        self.assertViewIndexed(reverse('panel:employee_detail', args=[employee.pk]), tables)
+        self.assertViewIndexed(reverse('panel:employee_list'), tables)
+        self.assertViewIndexed(reverse('panel:sale_list') + f'?employee={employee.pk}', tables)
+
+
+class PeriodTests(TestCase):
+
+    def test_month_range_is_half_open_and_aware(self):
+        start, end = month_range(2024, 12)
+        self.assertTrue(timezone.is_aware(start) and timezone.is_aware(end))
+        self.assertEqual(timezone.localtime(start).date(), date(2024, 12, 1))
+        self.assertEqual(timezone.localtime(end).date(), date(2025, 1, 1))
+        self.assertEqual(month_bounds(2024, 2), (date(2024, 2, 1), date(2024, 3, 1)))
+
+    def test_matches_extract_lookups_at_local_midnight(self):
+        # Sales either side of local midnight at both ends of March
+        employee = Employee.objects.create(name="مندوب")
+        tz = timezone.get_current_timezone()
+        for moment in (datetime(2025, 2, 28, 23, 30), datetime(2025, 3, 1, 0, 0), datetime(2025, 3, 31, 23, 59)):
+            Sale.objects.create(employee=employee, created_at=timezone.make_aware(moment, tz), total=1)
+        by_extract = Sale.objects.filter(created_at__year=2025, created_at__month=3)
+        by_range = Sale.objects.filter(**in_period('created_at', month_range(2025, 3)))
+        self.assertEqual(set(by_range), set(by_extract))
+        self.assertEqual(by_range.count(), 2)
+        self.assertEqual(employee.get_monthly_sales(month=3, year=2025), 2)
+
+    def test_invalid_month_falls_back_to_the_current_one(self):
+        from .models import Manager
+        today = date.today()
+        urls = [
+            reverse('panel:employee_detail', args=[Employee.objects.create(name="مندوب").pk]),
+            reverse('panel:manager_detail', args=[Manager.objects.create(name="مدير").pk]),
+        ]
+        for url in urls:
+            for query in ({'month': '13'}, {'month': '0'}, {'month': 'x', 'year': 'y'}, {'year': '99999'}):
+                response = self.client.get(url, query)
+                self.assertEqual(response.status_code, 200, (url, query))
+                self.assertEqual((response.context['month'], response.context['year']), (today.month, today.year))
+
+
+class PerfStatsTests(TestCase):
+
+    def setUp(self):
+        from tempfile import TemporaryDirectory
+        from . import perf
+        tmp = TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.settings_override = override_settings(PERF_STATS_DIR=tmp.name, PERF_FLUSH_INTERVAL=3600)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        perf.store.reset()
+
+    def test_records_queries_per_view_and_staff_only_pages(self):
+        from django.contrib.auth.models import User
+        from . import perf
+        self.client.get(reverse('panel:client_list'))
+        stats = perf.collect()['panel:client_list']
+        self.assertEqual(stats.count, 1)
+        self.assertGreater(stats.sql_count, 0)
+
+        self.assertEqual(self.client.get(reverse('panel:perf_metrics')).status_code, 403)
+        self.assertEqual(self.client.get(reverse('panel:perf_stats')).status_code, 302)
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+        self.assertContains(self.client.get(reverse('panel:perf_stats')), 'panel:client_list')
+        metrics = self.client.get(reverse('panel:perf_metrics')).content.decode()
+        self.assertIn('qur_view_requests_total{view="panel:client_list"} 1', metrics)
+
+    def test_merges_flushed_snapshots_of_other_processes(self):
+        import json
+        from pathlib import Path
+        from django.conf import settings
+        from . import perf
+        other = perf.ViewStats()
+        other.add(0.2, 3, 0.01, 0.05, False, 512)
+        Path(settings.PERF_STATS_DIR, 'perf-1.json').write_text(json.dumps({'views': {'panel:debts': other.as_dict()}}))
+        perf.store.record('panel:debts', 0.4, 1, 0.02, 0.1, True)
+        merged = perf.collect()['panel:debts']
+        self.assertEqual((merged.count, merged.errors, merged.sql_count), (2, 1, 4))
+        self.assertAlmostEqual(merged.percentile(0.99), 0.4)
+
+
+class QueryLogTests(TestCase):
+
+    def test_fingerprint_normalizes_literals_and_lists(self):
+        from .querylog import fingerprint
+        self.assertEqual(
+            fingerprint("SELECT * FROM t WHERE a = 12 AND b = 'x''y' AND c IN (%s, %s,  %s)"),
+            fingerprint("SELECT * FROM t WHERE a = 7 AND b = 'z' AND c IN (%s)"),
+        )
+
+    @override_settings(DUPLICATE_QUERY_THRESHOLD=3, SLOW_QUERY_MS=10000)
+    def test_reports_repeated_query_with_its_origin(self):
+        from .querylog import QueryInspector
+        employee = Employee.objects.create(name="مندوب")
+        sales = [Sale.objects.create(employee=employee, total=1) for _ in range(5)]
+        inspector = QueryInspector()
+        with connection.execute_wrapper(inspector):
+            for sale in sales:
+                Commission.objects.filter(employee=employee, sale=sale).first()
+        with self.assertLogs('panel.querylog', 'WARNING') as logs:
+            inspector.report('/commissions/')
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn('Repeated query: 5 times', logs.output[0])
+        self.assertIn('panel/tests.py', logs.output[0])
+
+    @override_settings(SLOW_QUERY_MS=0)
+    def test_slow_query_logged_with_plan(self):
+        from .querylog import QueryInspector
+        inspector = QueryInspector()
+        with connection.execute_wrapper(inspector):
+            list(Sale.objects.filter(client_id=1))
+        with self.assertLogs('panel.querylog', 'WARNING') as logs:
+            inspector.report()
+        self.assertIn('Slow query', logs.output[0])
+        self.assertIn('panel_sale', logs.output[0])
+        if connection.vendor == 'sqlite':
+            self.assertIn('USING INDEX', logs.output[0])
+
+    def test_middleware_is_off_by_default(self):
+        from django.conf import settings
+        self.assertFalse(settings.QUERY_LOG_ENABLED)
+        with override_settings(SLOW_QUERY_MS=0), self.assertNoLogs('panel.querylog', 'WARNING'):
+            self.assertEqual(self.client.get(reverse('panel:expense_list')).status_code, 200)
+
+    def test_middleware_logs_when_enabled(self):
+        from tempfile import TemporaryDirectory
+        tmp = TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        log_file = Path(tmp.name, 'logs', 'queries.log')
+        with override_settings(QUERY_LOG_ENABLED=True, QUERY_LOG_FILE=log_file, SLOW_QUERY_MS=0):
+            with self.assertLogs('panel.querylog', 'WARNING') as logs:
+                self.client.get(reverse('panel:expense_list'))
+        self.assertTrue(log_file.parent.is_dir())
+        self.assertIn('panel:expense_list', '\n'.join(logs.output))
+
+
+class ProfilerTests(TestCase):
+
+    def setUp(self):
+        from tempfile import TemporaryDirectory
+        tmp = TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        override = override_settings(PROFILE_DIR=tmp.name, PROFILE_RATE_LIMIT=2)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_staff_only_stored_and_rate_limited(self):
+        from django.contrib.auth.models import User
+        from django.core.cache import cache
+        from . import profiling
+        cache.clear()
+        url = reverse('panel:client_list')
+        self.assertNotIn('X-Profile', self.client.get(url + '?_profile=cprofile'))
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+
+        profile_id = self.client.get(url + '?_profile=cprofile')['X-Profile']
+        meta, data_path = profiling.load(profile_id)
+        self.assertEqual(meta['view'], 'panel:client_list')
+        self.assertGreater(meta['sql_count'], 0)
+        self.assertIn('client_list', profiling.summary_text(meta, data_path))
+        self.assertContains(self.client.get(reverse('panel:profile_detail', args=[profile_id])), 'client_list')
+        download = self.client.get(reverse('panel:profile_download', args=[profile_id]))
+        self.assertEqual(download['Content-Disposition'], f'attachment; filename="{profile_id}.prof"')
+
+        sampled = self.client.get(url, HTTP_X_PROFILE='sample')['X-Profile']
+        self.assertEqual(profiling.load(sampled)[0]['mode'], 'sample')
+        self.assertEqual(self.client.get(url + '?_profile=sample')['X-Profile'], 'rate-limited')
+
+
+class LoadDataTests(TestCase):
+    VOLUMES = {
+        'areas': 3, 'clients': 40, 'employees': 5, 'managers': 2, 'products': 15, 'suppliers': 3,
+        'sales': 300, 'items_per_sale': 3, 'return_rate': 0.1, 'expenses': 20, 'partners': 2,
+        'partner_transactions': 60, 'exchanges': 20,
+    }
+
+    def test_generated_data_is_consistent_and_reproducible(self):
+        from .seed_utils import LoadDataGenerator, check_invariants
+        counts = LoadDataGenerator(seed=7, days=120, batch_size=100).run(self.VOLUMES)
+        self.assertEqual(check_invariants(), [])
+        self.assertEqual(counts['Sale'], Sale.objects.count())
+        self.assertEqual(Invoice.objects.count(), Sale.objects.count())
+        self.assertGreater(counts['ReturnedProduct'], 0)
+        totals = sorted(Sale.objects.values_list('total', flat=True))
+
+        Sale.objects.all().delete()
+        LoadDataGenerator(seed=7, days=120, batch_size=100).run(self.VOLUMES)
+        self.assertEqual(sorted(Sale.objects.values_list('total', flat=True)), totals)
+
+
+@override_settings(REPORTS_DATABASE='off')
+class QueryBudgetTests(TestCase):
+    """
+    The hot pages stay within the query budgets of panel/bench_baseline.json
+    on the benchmark dataset (timings are left to the bench_views command).
+    """
+    @classmethod
+    def setUpTestData(cls):
+        from django.contrib.auth.models import User
+        from .bench_utils import BENCH_DAYS, BENCH_SEED, BENCH_VOLUMES
+        from .seed_utils import LoadDataGenerator
+        LoadDataGenerator(seed=BENCH_SEED, days=BENCH_DAYS).run(BENCH_VOLUMES)
+        cls.user = User.objects.create_superuser('bench', password='x')
+
+    def test_hot_views_within_query_budget(self):
+        from .bench_utils import HOT_VIEWS, _call, cases, load_baseline
+        from .perf import RequestTimer
+        budgets = load_baseline()['views']
+        self.client.force_login(self.user)
+        measured = set()
+        for name, method, url, data in cases():
+            if name not in HOT_VIEWS:
+                continue
+            measured.add(name)
+            counter = RequestTimer()
+            with self.subTest(view=name):
+                _call(self.client, method, url, data, counter)
+                self.assertLessEqual(counter.sql_count, budgets[name]['budget'], name)
+        self.assertEqual(measured, set(HOT_VIEWS))
+
+
+class LoadTestTests(TestCase):
+    def test_requests_are_accepted_and_checks_pass_when_sequential(self):
+        import random
+        from .loadtest_utils import DEFAULT_MIX, Targets, balances, build_request, classify, verify
+        from .seed_utils import LoadDataGenerator
+        LoadDataGenerator(seed=3, days=60, batch_size=100).run(LoadDataTests.VOLUMES)
+        targets = Targets(hot=3)
+        self.assertEqual(targets.missing(DEFAULT_MIX), [])
+        before = balances()
+        rng = random.Random(1)
+        # A return lowers Sale.total but leaves Invoice.total as it was,
+        # which the checks report, so it is left out here
+        for name in [name for name in DEFAULT_MIX if name != 'return']:
+            path, data = build_request(name, rng, targets)
+            response = self.client.post(path, data)
+            self.assertIn(classify(response.status_code, response.content), ('ok', 'rejected'), name)
+        self.assertEqual(verify(before), [])
+
+
+@override_settings(REPORTS_DATABASE='off')
+class StockForecastTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        from .models import ReturnedProduct, SaleItem
+        cls.today = timezone.localdate()
+        cls.product = Product.objects.create(name="مضاد حيوي")
+        batches = []
+        for number, (quantity, expiry_days) in enumerate(((30, 5), (100, 400))):
+            shipment = Shipment.objects.create(
+                product=cls.product, quantity=quantity, shipment_cost=0, batch_number=f'F{number}',
+                expiry_date=cls.today + timedelta(days=expiry_days),
+            )
+            batches.append(Inventory.objects.create(product=cls.product, shipment=shipment, quantity=quantity))
+        # 10 paid + 1 free - 1 returned = 10 units a day for the last 90 days
+        tz = timezone.get_current_timezone()
+        for days_ago in range(1, 91):
+            moment = datetime.combine(cls.today - timedelta(days=days_ago), datetime.min.time()).replace(hour=12)
+            sale = Sale.objects.create(created_at=timezone.make_aware(moment, tz), total=1)
+            item = SaleItem.objects.create(
+                sale=sale, inventory=batches[1], quantity=10, price=1, free_goods_discount=Decimal('15'),
+            )
+            # bulk_create: save() would put the unit back in stock
+            ReturnedProduct.objects.bulk_create([ReturnedProduct(sale=sale, sale_item=item, quantity=1)])
+
+    def test_velocity_cover_and_reorder(self):
+        from .forecast_utils import forecast
+        with self.assertNumQueries(3):
+            [row] = forecast(self.today, lead_time_days=30, cover_days=30)
+        self.assertAlmostEqual(row['velocity'], 10)
+        self.assertAlmostEqual(row['moving_average'], 10)
+        # The first batch expires in 5 days but its 30 units sell in 3,
+        # so all 130 count and last 13 days
+        self.assertEqual(row['stock'], 130)
+        self.assertEqual(row['expiring'], 0)
+        self.assertEqual(row['stockout_date'], self.today + timedelta(days=13))
+        self.assertEqual(row['reorder'], 600 - 130)
+
+    def test_stock_expiring_before_it_sells_is_not_cover(self):
+        from .forecast_utils import usable_stock
+        # 10 a day: 20 of the 50 expiring in 3 days can't be sold
+        self.assertEqual(usable_stock([(100, 400), (50, 3)], 10), 130)
+        self.assertEqual(usable_stock([(50, -1)], 10), 0)
+
+    def test_page_and_export(self):
+        response = self.client.get(reverse('panel:stock_forecast'), {'lead_time_days': 10})
+        self.assertContains(response, self.product.name)
+        self.assertEqual(response.context['lead_time_days'], 10)
+        response = self.client.get(reverse('panel:stock_forecast_export', args=['csv']))
+        body = b''.join(response.streaming_content).decode('utf-8')
+        self.assertIn(self.product.name, body)
+
+
+class ExpiryScanTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.today = timezone.localdate()
+        product = Product.objects.create(name="قطرة")
+        cls.batches = []
+        for number, (quantity, expiry_days) in enumerate(((5, -3), (8, 20), (40, 200))):
+            shipment = Shipment.objects.create(
+                product=product, quantity=quantity, shipment_cost=0, cost_sdg=Decimal('100'),
+                batch_number=f'E{number}', expiry_date=cls.today + timedelta(days=expiry_days),
+            )
+            cls.batches.append(Inventory.objects.create(product=product, shipment=shipment, quantity=quantity))
+
+    def test_expiring_batches(self):
+        from .expiry_utils import expiring_batches
+        batches = list(expiring_batches(30, self.today))
+        self.assertEqual([batch.pk for batch in batches], [self.batches[0].pk, self.batches[1].pk])
+        self.assertEqual(batches[1].value, Decimal('800'))
+
+    def test_bulk_write_off(self):
+        from .models import LostProduct
+        expired, expiring, _ = self.batches
+        response = self.client.post(reverse('panel:expiry_scan'), {
+            'batch': [expired.pk, expiring.pk], f'quantity_{expired.pk}': 5, f'quantity_{expiring.pk}': 3,
+            'note': "منتهي",
+        })
+        self.assertRedirects(response, reverse('panel:lost_product_list'))
+        self.assertEqual(
+            list(Inventory.objects.filter(pk__in=[expired.pk, expiring.pk]).order_by('pk').values_list('quantity', flat=True)),
+            [0, 5],
+        )
+        self.assertEqual(sum(LostProduct.objects.values_list('quantity', flat=True)), 8)
+
+    def test_write_off_is_all_or_nothing(self):
+        from .expiry_utils import WriteOffError, write_off
+        from .models import LostProduct
+        expired, expiring, _ = self.batches
+        with self.assertRaises(WriteOffError) as raised:
+            write_off({expired.pk: 2, expiring.pk: 9})
+        self.assertEqual(raised.exception.batches, [expiring.pk])
+        self.assertFalse(LostProduct.objects.exists())
+        expired.refresh_from_db()
+        self.assertEqual(expired.quantity, 5)
+
+    def test_write_off_that_empties_a_product_raises_a_low_stock_alert(self):
+        from .expiry_utils import write_off
+        from .models import NotificationOutbox
+        NotificationOutbox.objects.all().delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            write_off({batch.pk: batch.quantity for batch in self.batches})
+        alert = NotificationOutbox.objects.get()
+        self.assertEqual(alert.kind, 'low_stock')
+        self.assertEqual(alert.data, {'product_id': self.batches[0].product_id, 'remaining': 0})
+
+
+@skipUnless(connection.vendor == 'sqlite', "The search index is SQLite FTS5")
+class SearchTests(TestCase):
+
+    def test_normalize_arabic(self):
+        from .search import normalize_arabic
+        self.assertEqual(normalize_arabic('أَحْمَد'), 'احمد')
+        self.assertEqual(normalize_arabic('مدرسة مستشفى إبراهيم'), 'مدرسه مستشفي ابراهيم')
+        self.assertEqual(normalize_arabic('فاتورة ١٢٣'), 'فاتوره 123')
+        self.assertEqual(normalize_arabic(None), '')
+
+    def test_index_text_adds_words_without_the_article(self):
+        from .search import index_text
+        self.assertEqual(index_text('الإيمان والخير'), 'الايمان والخير ايمان خير')
+        # Too short to be an article plus a word
+        self.assertEqual(index_text('الم'), 'الم')
+
+    def test_index_follows_saves_and_deletes(self):
+        from .search import search
+        client = Client.objects.create(name='مُحمّد الأمين', phone='0912345678')
+        self.assertEqual(search('امين'), [('client', client.pk)])
+        self.assertEqual(search('0912'), [('client', client.pk)])
+        client.name = 'عثمان'
+        client.save()
+        self.assertEqual(search('امين'), [])
+        self.assertEqual(search('عثم'), [('client', client.pk)])
+        client.delete()
+        self.assertEqual(search('عثم'), [])
+
+    def test_search_q(self):
+        from .search import search_q
+        wanted = Client.objects.create(name='فاطمة')
+        Client.objects.create(name='زينب')
+        self.assertEqual(list(Client.objects.filter(search_q('فاطمه', 'client'))), [wanted])
+        self.assertFalse(Client.objects.filter(search_q('!!', 'client')).exists())
+
+    def test_plain_sql_writes_need_no_custom_function(self):
+        client = Client.objects.create(name='سلمى')
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND sql LIKE '%arabic_normalize%'")
+            self.assertEqual(cursor.fetchone()[0], 0)
+            cursor.execute("UPDATE panel_client SET name = 'سلوى' WHERE id = %s", [client.pk])
+
+
+class NumberingTests(TestCase):
+
+    def setUp(self):
+        from .numbering import reset_blocks
+        reset_blocks()
+
+    def test_block_is_kept_once_the_transaction_commits(self):
+        from .models import Sequence
+        from .numbering import next_number
+        with self.settings(INVOICE_NUMBER_BLOCK_SIZE=5):
+            with self.captureOnCommitCallbacks(execute=True):
+                first = next_number('test')
+            self.assertEqual(Sequence.objects.get(name='test').next_value, first + 5)
+            with self.assertNumQueries(0):
+                self.assertEqual([next_number('test') for _ in range(4)], list(range(first + 1, first + 5)))
+            # Block used up: the next call reserves a new one
+            self.assertEqual(next_number('test'), first + 5)
+
+    def test_rolled_back_sale_does_not_leave_a_block_behind(self):
+        from .numbering import next_number
+        sale = Sale.objects.create(total=1)
+        try:
+            with transaction.atomic():
+                Invoice.objects.create(sale=sale)
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        # The counter UPDATE was rolled back with the invoice, so the same
+        # range is free again and must not also be handed out from memory
+        with self.captureOnCommitCallbacks(execute=True):
+            invoice = Invoice.objects.create(sale=sale)
+        numbers = [invoice.number] + [
+            Invoice.objects.create(sale=Sale.objects.create(total=1)).number for _ in range(30)
+        ]
+        self.assertEqual(len(set(numbers)), len(numbers))
+        self.assertEqual(Invoice.objects.filter(number=invoice.number).count(), 1)
+        self.assertGreaterEqual(min(int(number) for number in numbers), 100000)
+        self.assertNotIn(str(next_number('invoice')), numbers)
+
+    def test_numbers_must_fit_the_field(self):
+        from .models import Sequence
+        Sequence.objects.update_or_create(name='invoice', defaults={'next_value': 10 ** 12})
+        with self.assertRaises(ValueError):
+            Invoice.objects.create(sale=Sale.objects.create(total=1))
+
+
+class StubResponse:
+    def __init__(self, status_code, error=None, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self._body = {'error': {'status': error}} if error else {}
+        self.text = str(self._body)
+
+    def json(self):
+        return self._body
+
+
+class StubSession:
+    """
+    Stands in for the dispatcher's requests.Session: answers each POST
+    with the next response queued for that token.
+    """
+    def __init__(self, responses):
+        self.responses = {token: list(queue) for token, queue in responses.items()}
+        self.posts = []
+
+    def post(self, url, headers=None, data=None, timeout=None):
+        import json
+        token = json.loads(data)['message']['token']
+        self.posts.append(token)
+        return self.responses[token].pop(0)
+
+
+class FCMDispatcherTests(TestCase):
+
+    def dispatcher(self, responses):
+        from .fcm_utils import FCMDispatcher
+        dispatcher = FCMDispatcher(endpoint='http://stub/send', token_source=lambda: 'access', max_retries=2, backoff=0)
+        dispatcher.session = StubSession(responses)
+        return dispatcher
+
+    def send(self, dispatcher, tokens):
+        from .fcm_utils import build_staff_message
+        return dispatcher.send(tokens, lambda token: build_staff_message(token, "t", "b", {}, '/'))
+
+    def test_success_retry_and_dead_tokens(self):
+        dispatcher = self.dispatcher({
+            'ok': [StubResponse(200)],
+            'throttled': [StubResponse(429), StubResponse(503), StubResponse(200)],
+            'gone': [StubResponse(404, 'UNREGISTERED')],
+            'bad': [StubResponse(400, 'INVALID_ARGUMENT')],
+            'down': [StubResponse(500)] * 3,
+        })
+        result = self.send(dispatcher, ['ok', 'throttled', 'gone', 'bad', 'down'])
+        # Only UNREGISTERED drops the token; a bad request is a send error
+        self.assertEqual(result, {'sent': 2, 'failed': 2, 'invalid': ['gone']})
+        self.assertEqual(dispatcher.session.posts.count('throttled'), 3)
+        self.assertEqual(dispatcher.session.posts.count('down'), 3)
+
+    def test_retry_after_is_capped(self):
+        dispatcher = self.dispatcher({})
+        self.assertEqual(dispatcher._retry_delay(0, StubResponse(429, headers={'Retry-After': '3600'})), 30)
+        self.assertEqual(dispatcher._retry_delay(0, StubResponse(429, headers={'Retry-After': '2'})), 2)
+
+    def test_dead_tokens_are_cleared(self):
+        from .fcm_utils import _clear_invalid_tokens
+
+        class Owner:
+            def __init__(self, token):
+                self.fcm_token = token
+                self.saved = False
+
+            def save(self, update_fields=None):
+                self.saved = update_fields == ['fcm_token']
+
+        gone, kept = Owner('gone'), Owner('ok')
+        _clear_invalid_tokens([gone, kept], {'gone'})
+        self.assertEqual((gone.fcm_token, gone.saved), (None, True))
+        self.assertEqual((kept.fcm_token, kept.saved), ('ok', False))
+
+
+class NotificationOutboxTests(TestCase):
+
+    def setUp(self):
+        from .models import NotificationOutbox
+        from .notifications import enqueue
+        NotificationOutbox.objects.all().delete()
+        self.assertTrue(enqueue('low_stock', "a", "body a", 'key-a'))
+        self.assertTrue(enqueue('low_stock', "b", "body b", 'key-b', {'product_id': 1}))
+
+    def test_enqueue_is_deduplicated(self):
+        from .models import NotificationOutbox
+        from .notifications import enqueue
+        self.assertFalse(enqueue('low_stock', "a", "again", 'key-a'))
+        self.assertEqual(NotificationOutbox.objects.count(), 2)
+
+    def test_claim_returns_only_this_workers_rows(self):
+        from .models import NotificationOutbox
+        from .notifications import claim_batch
+        first = claim_batch(1)
+        second = claim_batch(10)
+        self.assertEqual(len(first), 1)
+        self.assertEqual(len(second), 1)
+        self.assertNotEqual(first[0].pk, second[0].pk)
+        self.assertNotEqual(first[0].claim_token, second[0].claim_token)
+        self.assertEqual(claim_batch(10), [])
+        self.assertEqual(set(NotificationOutbox.objects.values_list('status', flat=True)), {'sending'})
+
+    def test_stale_claims_are_taken_back(self):
+        from .models import NotificationOutbox
+        from .notifications import claim_batch
+        claim_batch(10)
+        NotificationOutbox.objects.update(available_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(len(claim_batch(10)), 2)
+
+    def test_deliver_records_sent_and_retries_failures(self):
+        from .models import NotificationOutbox
+        from .notifications import claim_batch, deliver
+        sent = []
+
+        def send(title, body, data):
+            sent.append(title)
+            if title == "b":
+                return {'sent': 0, 'failed': 1, 'invalid': []}
+            return {'sent': 1, 'failed': 0, 'invalid': []}
+
+        counts = deliver(claim_batch(10), send, max_attempts=2)
+        self.assertEqual(counts, {'sent': 1, 'skipped': 0, 'retry': 1, 'failed': 0})
+        a, b = NotificationOutbox.objects.order_by('title')
+        self.assertEqual((a.status, a.attempts), ('sent', 1))
+        self.assertEqual((b.status, b.attempts), ('pending', 1))
+        self.assertGreater(b.available_at, timezone.now())
+        # Not due yet; once it is, the second failure uses up the attempts
+        self.assertEqual(claim_batch(10), [])
+        NotificationOutbox.objects.filter(pk=b.pk).update(available_at=timezone.now())
+        counts = deliver(claim_batch(10), send, max_attempts=2)
+        self.assertEqual(counts, {'sent': 0, 'skipped': 0, 'retry': 0, 'failed': 1})
+        self.assertEqual(NotificationOutbox.objects.get(pk=b.pk).status, 'failed')
+        self.assertEqual(sent, ["a", "b", "b"])
+
+    def test_deliver_skips_when_nobody_has_a_token(self):
+        from .models import NotificationOutbox
+        from .notifications import claim_batch, deliver
+        counts = deliver(claim_batch(10), lambda title, body, data: None)
+        self.assertEqual(counts['skipped'], 2)
+        self.assertEqual(set(NotificationOutbox.objects.values_list('status', flat=True)), {'skipped'})
+
+    def stock(self, *quantities):
+        product = Product.objects.create(name="مرهم")
+        batches = []
+        for number, quantity in enumerate(quantities):
+            shipment = Shipment.objects.create(
+                product=product, quantity=quantity, shipment_cost=0, batch_number=f'L{number}',
+                expiry_date=timezone.localdate() + timedelta(days=365),
+            )
+            batches.append(Inventory.objects.create(product=product, shipment=shipment, quantity=quantity))
+        # Loaded as a view would, so the saves below know the old quantity
+        return product, list(Inventory.objects.filter(product=product).order_by('pk'))
+
+    def test_low_stock_is_checked_once_per_product_on_commit(self):
+        from .models import NotificationOutbox
+        product, batches = self.stock(6, 6)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with transaction.atomic():
+                for batch in batches:
+                    batch.quantity -= 2
+                    batch.save()
+        self.assertEqual(len(callbacks), 1)
+        alert = NotificationOutbox.objects.get(dedupe_key__startswith='low_stock:')
+        self.assertEqual(alert.data, {'product_id': product.pk, 'remaining': 8})
+
+    def test_low_stock_is_not_checked_when_stock_goes_up_or_rolls_back(self):
+        from .models import NotificationOutbox
+        _, (batch,) = self.stock(3)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with transaction.atomic():
+                batch.quantity += 1
+                batch.save()
+        self.assertEqual(callbacks, [])
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            try:
+                with transaction.atomic():
+                    batch.quantity -= 1
+                    batch.save()
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+        self.assertEqual(callbacks, [])
+        self.assertFalse(NotificationOutbox.objects.filter(dedupe_key__startswith='low_stock:').exists())
+
+
+class DueInvoiceAlertTests(TestCase):
+
+    def test_stage_for_picks_the_most_urgent_day_reached(self):
+        from .management.commands.check_due_invoices import Command
+        stage_for = Command().stage_for
+        lead, overdue = [1, 3, 7], [1, 7, 30]
+        self.assertEqual(stage_for(8, lead, overdue), (None, None))
+        self.assertEqual(stage_for(7, lead, overdue), ('due_7', -7))
+        # Between lead days: still the last one reached, not nothing
+        self.assertEqual(stage_for(5, lead, overdue), ('due_7', -7))
+        self.assertEqual(stage_for(2, lead, overdue), ('due_3', -3))
+        self.assertEqual(stage_for(0, lead, overdue), ('due_1', -1))
+        self.assertEqual(stage_for(-3, lead, overdue), ('overdue_1', 1))
+        self.assertEqual(stage_for(-45, lead, overdue), ('overdue_30', 30))
+        self.assertEqual(stage_for(2, [], overdue), (None, None))
+
+    def test_each_stage_is_alerted_once(self):
+        from django.core.management import call_command
+        from .models import NotificationOutbox
+        today = timezone.localdate()
+        sale = Sale.objects.create(total=1000, client=Client.objects.create(name="عميل"))
+        invoice = Invoice.objects.create(sale=sale, status='unpaid', due_date=today + timedelta(days=5))
+        NotificationOutbox.objects.all().delete()
+
+        def run(day):
+            call_command('check_due_invoices', date=(today + timedelta(days=day)).isoformat(), stdout=StringIO())
+            invoice.refresh_from_db()
+            return NotificationOutbox.objects.count()
+
+        self.assertEqual(run(0), 1)
+        self.assertEqual(invoice.alert_stage, 'due_7')
+        # Same stage on the next runs: nothing new
+        self.assertEqual(run(0), 1)
+        self.assertEqual(run(1), 1)
+        # Day 3 was never run: day 4 (one day left) jumps to due_1
+        self.assertEqual(run(4), 2)
+        self.assertEqual(invoice.alert_stage, 'due_1')
+        self.assertEqual(run(5), 2)
+        self.assertEqual(run(6), 3)
+        self.assertEqual(invoice.alert_stage, 'overdue_1')
+        self.assertEqual(run(7), 3)
+
+
+class BackupTests(SimpleTestCase):
+
+    def setUp(self):
+        import tempfile
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.dir = Path(self.tmp.name)
+
+    def test_snapshots_in_the_same_second_get_distinct_names(self):
+        from .backup_utils import list_snapshots, snapshot_path
+        when = datetime(2026, 10, 19, 8, 30, 0)
+        paths = []
+        for _ in range(3):
+            path = snapshot_path(self.dir, 'db', when)
+            path.touch()
+            paths.append(path)
+        self.assertEqual(len(set(paths)), 3)
+        self.assertEqual(paths[1].name, 'db-20261019-083000-2.sqlite3')
+        self.assertEqual([path for _, path in list_snapshots(self.dir, 'db')], paths[::-1])
+
+    def test_rotate_keeps_last_daily_weekly_and_monthly(self):
+        from .backup_utils import list_snapshots, rotate, snapshot_path
+        start = datetime(2026, 1, 1, 3, 0)
+        # Two snapshots a day for 120 days
+        for day in range(120):
+            for hour in (3, 15):
+                snapshot_path(self.dir, 'db', start + timedelta(days=day, hours=hour - 3)).touch()
+        deleted = rotate(self.dir, 'db', keep_last=3, keep_daily=5, keep_weekly=3, keep_monthly=4)
+        kept = [taken for taken, _ in list_snapshots(self.dir, 'db')]
+        self.assertEqual(len(deleted) + len(kept), 240)
+        newest = start + timedelta(days=119, hours=12)
+        self.assertEqual(kept[:3], [newest, newest - timedelta(hours=12), newest - timedelta(days=1)])
+        # Beyond the last 3, only the newest of a day, week or month survives
+        self.assertTrue(all(taken.hour == 15 for taken in kept[3:]))
+        days = {taken.date() for taken in kept}
+        self.assertTrue(all(newest.date() - timedelta(days=back) in days for back in range(5)))
+        weeks = {taken.isocalendar()[:2] for taken in kept}
+        self.assertTrue(all((newest - timedelta(weeks=back)).isocalendar()[:2] in weeks for back in range(3)))
+        self.assertEqual({(taken.year, taken.month) for taken in kept}, {(2026, 1), (2026, 2), (2026, 3), (2026, 4)})
+        self.assertIn(datetime(2026, 1, 31, 15, 0), kept)
+        self.assertLess(len(kept), 3 + 5 + 3 + 4)
+        self.assertTrue(all(not path.exists() for path in deleted))
+        # Nothing more to prune
+        self.assertEqual(rotate(self.dir, 'db', keep_last=3, keep_daily=5, keep_weekly=3, keep_monthly=4), [])
+
+    def test_online_backup_copies_a_consistent_file(self):
+        import sqlite3
+        from .backup_utils import check_integrity, online_backup
+        source = self.dir / 'source.sqlite3'
+        conn = sqlite3.connect(source)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("CREATE TABLE item (id INTEGER PRIMARY KEY, name TEXT)")
+        conn.executemany("INSERT INTO item (name) VALUES (?)", [(f"item {i}" * 20,) for i in range(2000)])
+        conn.commit()
+        conn.close()
+        dest = self.dir / 'copy.sqlite3'
+        stats = online_backup(source, dest, pages=16, sleep=0)
+        self.assertGreater(stats['steps'], 1)
+        self.assertEqual(stats['bytes'], dest.stat().st_size)
+        self.assertFalse(dest.with_name(dest.name + '.partial').exists())
+        self.assertEqual(check_integrity(dest), [])
+        copy = sqlite3.connect(dest)
+        try:
+            self.assertEqual(copy.execute("SELECT count(*) FROM item").fetchone()[0], 2000)
+            self.assertEqual(copy.execute("PRAGMA journal_mode").fetchone()[0], 'delete')
+        finally:
+            copy.close()
+
+
+@override_settings(REPORTS_DATABASE='off')
+class ExportTests(TestCase):
+
+    def csv_rows(self, response):
+        import csv
+        self.assertTrue(response.streaming)
+        content = b''.join(response.streaming_content).decode('utf-8')
+        self.assertTrue(content.startswith('﻿'))
+        return list(csv.reader(StringIO(content[1:])))
+
+    def xlsx_rows(self, response):
+        import zipfile
+        from xml.etree import ElementTree
+        content = b''.join(response.streaming_content)
+        with zipfile.ZipFile(BytesIO(content)) as workbook:
+            sheet = ElementTree.fromstring(workbook.read('xl/worksheets/sheet1.xml'))
+        ns = {'x': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'}
+
+        def value(cell):
+            text = ''.join(cell.itertext())
+            # constant_memory mode writes strings inline; untyped cells are numbers
+            return text if cell.get('t') else float(text)
+        return [[value(cell) for cell in row.findall('x:c', ns)] for row in sheet.findall('x:sheetData/x:row', ns)]
+
+    def test_sales_csv_applies_the_filters(self):
+        paid = Invoice.objects.create(sale=Sale.objects.create(total=100, client=Client.objects.create(name="أحمد")), status='paid')
+        unpaid = Invoice.objects.create(sale=Sale.objects.create(total=250, client=Client.objects.create(name="سارة")), status='unpaid')
+        response = self.client.get(reverse('panel:sale_list_export', args=['csv']), {'status': 'unpaid'})
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertIn('.csv"', response['Content-Disposition'])
+        rows = self.csv_rows(response)
+        self.assertEqual(rows[0][:2], ["رقم الفاتورة", "العميل"])
+        self.assertEqual([row[:2] for row in rows[1:]], [[unpaid.number, "سارة"]])
+        rows = self.csv_rows(self.client.get(reverse('panel:sale_list_export', args=['csv'])))
+        self.assertEqual({row[0] for row in rows[1:]}, {paid.number, unpaid.number})
+
+    def test_expenses_xlsx_applies_the_month_filter(self):
+        from .models import Expense
+        Expense.objects.create(description="إيجار", amount=Decimal('1500'), date=date(2026, 9, 1))
+        Expense.objects.create(description="كهرباء", amount=Decimal('200'), date=date(2026, 10, 5))
+        response = self.client.get(reverse('panel:expense_list_export', args=['xlsx']), {'month': '2026-10'})
+        self.assertIn('.xlsx"', response['Content-Disposition'])
+        rows = self.xlsx_rows(response)
+        self.assertEqual(rows, [["الوصف", "المبلغ بالجنيه", "التاريخ"], ["كهرباء", 200.0, "2026-10-05"]])
+
+    def test_unknown_format_is_not_found(self):
+        self.assertEqual(self.client.get(reverse('panel:expense_list_export', args=['ods'])).status_code, 404)
+
+
+class TablePDFTests(SimpleTestCase):
+    # A4 with the builder's margins fits 47 rows under a header, 44 on the first page
+    FIRST_PAGE_ROWS, ROWS_PER_PAGE = 44, 47
+
+    def pages(self, count):
+        from .pdf_utils import build_table_pdf
+        output = BytesIO()
+        rows = ([i, f"item {i}", Decimal('1234.5')] for i in range(count))
+        build_table_pdf(output, "Report", ["#", "Name", "Amount"], rows)
+        data = output.getvalue()
+        self.assertTrue(data.startswith(b'%PDF'))
+        return len(re.findall(rb'/Type /Page[^s]', data))
+
+    def test_rows_are_split_into_full_pages(self):
+        self.assertEqual(self.pages(0), 1)
+        self.assertEqual(self.pages(self.FIRST_PAGE_ROWS), 1)
+        self.assertEqual(self.pages(self.FIRST_PAGE_ROWS + 1), 2)
+        self.assertEqual(self.pages(self.FIRST_PAGE_ROWS + self.ROWS_PER_PAGE), 2)
+        self.assertEqual(self.pages(self.FIRST_PAGE_ROWS + self.ROWS_PER_PAGE + 1), 3)
+
+    def test_every_chunk_repeats_the_header(self):
+        from .pdf_utils import _table_chunks
+        rows = ([i, "x"] for i in range(12))
+        tables = list(_table_chunks(["#", "Name"], rows, None, 5, 3, rtl=True, max_chars=80))
+        sizes = [len(table._cellvalues) - 1 for table in tables]
+        self.assertEqual(sizes, [3, 5, 4])
+        # RTL: columns are reversed so the first column is drawn on the right
+        self.assertTrue(all(table._cellvalues[0] == ["Name", "#"] for table in tables))
+        self.assertEqual(tables[0]._cellvalues[1], ["x", "0"])
+
+    def test_cells_are_formatted(self):
+        from .pdf_utils import _format_cell
+        self.assertEqual(_format_cell(None, 10), '')
+        self.assertEqual(_format_cell(Decimal('1234.5'), 10), '1,234.50')
+        self.assertEqual(_format_cell(12345, 10), '12,345')
+        self.assertEqual(_format_cell("x" * 20, 5), 'xxxxx')
+
+
+class AutocompleteTests(QueryPlanMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        for name, phone in (("محمد", "0912000001"), ("محمود", None), ("مح", None), ("أحمد", "0123"), ("م", None), ("Ahmed", None)):
+            Client.objects.create(name=name, phone=phone)
+
+    def texts(self, kind, q, **params):
+        response = self.client.get(reverse('panel:autocomplete', args=[kind]), {'q': q, **params})
+        self.assertEqual(response.status_code, 200)
+        return [result['text'] for result in response.json()['results']]
+
+    def test_prefix_bounds(self):
+        # The term itself and anything that continues it, nothing shorter or before it
+        self.assertEqual(self.texts('clients', 'مح'), ["مح", "محمد (0912000001)", "محمود"])
+        self.assertEqual(self.texts('clients', 'محمد'), ["محمد (0912000001)"])
+        self.assertEqual(self.texts('clients', 'حمد'), [])
+        self.assertEqual(self.texts('clients', 'Ah'), ["Ahmed"])
+        # Phone numbers match by prefix too
+        self.assertEqual(self.texts('clients', '0912'), ["محمد (0912000001)"])
+
+    def test_empty_term_lists_the_first_names(self):
+        from .views import AUTOCOMPLETE_LIMIT
+        texts = self.texts('clients', '')
+        self.assertEqual(len(texts), min(6, AUTOCOMPLETE_LIMIT))
+        self.assertEqual(texts, sorted(texts))
+
+    def test_unknown_source_is_not_found(self):
+        self.assertEqual(self.client.get(reverse('panel:autocomplete', args=['nothing'])).status_code, 404)
+
+    @skipUnless(connection.vendor == 'sqlite', "EXPLAIN QUERY PLAN output is SQLite-specific")
+    def test_prefix_match_uses_the_index(self):
+        from .views import _prefix_match
+        self.assertIndexed(Client.objects.filter(_prefix_match('name', 'مح')), 'panel_client_name')
+
+
+class ProductionSQLiteBackendTests(SimpleTestCase):
+    """
+    cafe/sqlite on a scratch database file, outside the test database.
+    """
+
+    def setUp(self):
+        import tempfile
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = Path(tmp.name) / 'db.sqlite3'
+
+    def connect(self, **settings_dict):
+        from django.db.utils import ConnectionHandler
+        handler = ConnectionHandler({
+            'default': {'ENGINE': 'django.db.backends.dummy'},
+            'scratch': {'ENGINE': 'cafe.sqlite', 'NAME': self.path, **settings_dict},
+        })
+        connection = handler['scratch']
+        self.addCleanup(connection.close)
+        return connection
+
+    def pragma(self, connection, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f"PRAGMA {name}")
+            return cursor.fetchone()[0]
+
+    def begin(self, connection):
+        # What transaction.atomic() does on a connection in autocommit mode
+        connection.set_autocommit(False, force_begin_transaction_with_broken_autocommit=True)
+        self.addCleanup(connection.set_autocommit, True)
+        self.addCleanup(connection.rollback)
+
+    def other_writer_is_locked_out(self):
+        import sqlite3
+        other = sqlite3.connect(self.path, timeout=0)
+        try:
+            other.execute("INSERT INTO item VALUES (2)")
+            other.commit()
+        except sqlite3.OperationalError as error:
+            return 'locked' in str(error)
+        finally:
+            other.close()
+        return False
+
+    def test_pragmas_are_applied_on_connect(self):
+        connection = self.connect(PRAGMAS={'busy_timeout': 1234, 'mmap_size': None})
+        self.assertEqual(self.pragma(connection, 'journal_mode'), 'wal')
+        self.assertEqual(self.pragma(connection, 'synchronous'), 1)  # NORMAL
+        self.assertEqual(self.pragma(connection, 'busy_timeout'), 1234)
+        self.assertEqual(self.pragma(connection, 'cache_size'), -20000)
+        self.assertEqual(self.pragma(connection, 'temp_store'), 2)  # MEMORY
+        # None leaves SQLite's default in place
+        self.assertEqual(self.pragma(connection, 'mmap_size'), 0)
+
+    def test_atomic_blocks_take_the_write_lock_up_front(self):
+        connection = self.connect()
+        with connection.cursor() as cursor:
+            cursor.execute("CREATE TABLE item (id INTEGER)")
+        self.begin(connection)
+        # Nothing written yet, but another writer already has to wait
+        self.assertTrue(self.other_writer_is_locked_out())
+
+    def test_deferred_transactions_can_be_configured(self):
+        connection = self.connect(TRANSACTION_MODE=None)
+        with connection.cursor() as cursor:
+            cursor.execute("CREATE TABLE item (id INTEGER)")
+        self.begin(connection)
+        self.assertFalse(self.other_writer_is_locked_out())
+
+
+class ReportRouterTests(SimpleTestCase):
+    """
+    cafe/routers.py, with the reports database switched on for the router.
+    """
+
+    def setUp(self):
+        from unittest import mock
+        patcher = mock.patch('cafe.routers.reports_enabled', return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def reporting(self):
+        from cafe.routers import _reporting
+        token = _reporting.set(True)
+        self.addCleanup(_reporting.reset, token)
+
+    def test_cache_reads_stay_on_default(self):
+        from django.core.cache import cache
+        from django.db import router
+        self.reporting()
+        self.assertEqual(router.db_for_read(Sale), 'reports')
+        self.assertEqual(router.db_for_read(cache.cache_model_class), 'default')
+
+    def test_reads_inside_a_report_view_go_to_reports(self):
+        from django.db import router
+        from django.http import HttpResponse
+        from django.test import RequestFactory
+        from cafe.routers import report_view
+        seen = []
+
+        @report_view
+        def view(request):
+            seen.append((router.db_for_read(Sale), Sale.objects.all().db))
+            return HttpResponse()
+
+        view(RequestFactory().get('/'))
+        self.assertEqual(seen, [('reports', 'reports')])
+        # Back to the default routing once the view has returned
+        self.assertEqual(router.db_for_read(Sale), 'default')
+        self.assertEqual(Sale.objects.all().db, 'default')
+
+    def test_objects_loaded_from_reports_are_saved_to_default(self):
+        from django.db import router
+        sale = Sale(total=1)
+        sale._state.db = 'reports'
+        self.reporting()
+        self.assertEqual(router.db_for_write(Sale, instance=sale), 'default')
+        self.assertEqual(router.db_for_write(Sale), 'default')
+        client = Client(name="عميل")
+        client._state.db = 'default'
+        self.assertTrue(router.allow_relation(sale, client))
+        self.assertFalse(router.allow_migrate('reports', 'panel'))
+
+    def test_streamed_responses_keep_the_routing(self):
+        from django.db import router
+        from django.http import FileResponse, StreamingHttpResponse
+        from django.test import RequestFactory
+        from cafe.routers import report_view
+
+        def rows():
+            for _ in range(2):
+                yield router.db_for_read(Sale) or 'default'
+
+        streamed = report_view(lambda request: StreamingHttpResponse(rows()))(RequestFactory().get('/'))
+        # The body is produced after the view returned, and still reads from reports
+        self.assertEqual([chunk.decode() for chunk in streamed.streaming_content], ['reports', 'reports'])
+        self.assertEqual(router.db_for_read(Sale), 'default')
+        # A FileResponse is built by the view and left as it is
+        file_response = report_view(lambda request: FileResponse(BytesIO(b'x')))(RequestFactory().get('/'))
+        self.assertEqual(b''.join(file_response.streaming_content), b'x')
+
+    def test_snapshot_command_needs_a_snapshot_path(self):
+        from django.core.management import CommandError, call_command
+        for target in ('off', 'readonly'):
+            with override_settings(REPORTS_DATABASE=target), self.assertRaisesMessage(CommandError, repr(target)):
+                call_command('refresh_reports_snapshot', stdout=StringIO())
@@ -19,6 +19,7 @@ urlpatterns = [
     path('sales/<int:pk>/delete/', views.sale_delete, name='sale_delete'),
     path('sales/<int:pk>/return_product/', views.sale_return_product, name='sale_return_product'),
     path('sales/export/pdf/', views.sale_list_pdf, name='sale_list_pdf'),
+    path('sales/export/<str:fmt>/', views.sale_list_export, name='sale_list_export'),
 
     # Shipment URLs
     path('shipments/', views.shipment_list, name='shipment_list'),
@@ -27,6 +28,7 @@ urlpatterns = [
     path('shipments/<int:pk>/delete/', views.shipment_delete, name='shipment_delete'),
     path('shipments/profit/', views.shipment_profit_report, name='shipment_profit_report'),
     path('shipments/export/pdf/', views.shipment_list_pdf, name='shipment_list_pdf'),
+    path('shipments/export/<str:fmt>/', views.shipment_list_export, name='shipment_list_export'),
 
     # Employee URLs
     path('employees/', views.employee_list, name='employee_list'),
@@ -54,6 +56,8 @@ urlpatterns = [
     # Commissions
     path('commissions/', views.sale_commissions, name='sale_commissions'),
     path('ajax/get-employee-commission/', views.get_employee_commission, name='get_employee_commission'),
+    path('ajax/autocomplete/<slug:kind>/', views.autocomplete, name='autocomplete'),
+    path('ajax/search/', views.global_search, name='global_search'),
     path('employee/<int:employee_id>/commission_pay/', views.commission_pay, name='commission_pay'),
 
     # Reports
@@ -71,16 +75,22 @@ urlpatterns = [
     path('expenses/<int:pk>/edit/', views.expense_edit, name='expense_edit'),
     path('expenses/<int:pk>/delete/', views.expense_delete, name='expense_delete'),
     path('expenses/export/pdf/', views.expense_list_pdf, name='expense_list_pdf'),
+    path('expenses/export/<str:fmt>/', views.expense_list_export, name='expense_list_export'),
 
     # Inventory URLs
     path('inventory/', views.inventory_list, name='inventory_list'),
     # Removed add/edit/delete inventory URLs
     path('inventory/export/pdf/', views.inventory_list_pdf, name='inventory_list_pdf'),
+    path('inventory/export/<str:fmt>/', views.inventory_list_export, name='inventory_list_export'),
+    path('inventory/forecast/', views.stock_forecast, name='stock_forecast'),
+    path('inventory/forecast/export/<str:fmt>/', views.stock_forecast_export, name='stock_forecast_export'),
 
     path('lost-products/', views.lost_product_list, name='lost_product_list'),
     path('lost-products/add/', views.lost_product_add, name='lost_product_add'),
+    path('lost-products/expiry/', views.expiry_scan, name='expiry_scan'),
 
     path('invoices/', views.invoice_list, name='invoice_list'),
+    path('invoices/export/<str:fmt>/', views.invoice_list_export, name='invoice_list_export'),
 
     #  path('', views.invoice_list, name='invoice_list'),
     path('invoices/<int:pk>/', views.invoice_detail, name='invoice_detail'),
@@ -108,4 +118,11 @@ urlpatterns = [
     path('managers/<int:pk>/', views.manager_detail, name='manager_detail'),
     path("manager_commission_pay/<int:manager_id>/", views.manager_commission_pay, name="manager_commission_pay"),  
 
+    # Performance stats
+    path('perf/', views.perf_stats, name='perf_stats'),
+    path('perf/metrics/', views.perf_metrics, name='perf_metrics'),
+    path('profiles/', views.profile_list, name='profile_list'),
+    path('profiles/<str:profile_id>/', views.profile_detail, name='profile_detail'),
+    path('profiles/<str:profile_id>/download/', views.profile_download, name='profile_download'),
+
 ]
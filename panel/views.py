@@ -2,12 +2,16 @@ from django.shortcuts import get_object_or_404, render, redirect
 from django.urls import reverse
 from django.http import HttpResponseRedirect, JsonResponse
 from django.db.models import Sum, Count, Q
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib import messages
 from django.core.paginator import Paginator
 from datetime import timedelta  # <-- Add this import
+from .widgets import AutocompleteSelect
+from .search import search_q
+from .periods import in_period, month_bounds, month_range
+from cafe.routers import report_view
 from .models import (
     Expense, Product, Invoice, Sale, SaleItem, Client, Employee,
     ExchangeRate, Area, Shipment, Commission, Inventory, InvoicePayment,
@@ -23,7 +27,7 @@ from django.http import FileResponse
 import io
 from calendar import monthrange
 from finance.models import CurrencyExchange, Currency, get_latest_exchange_rate
-from finance.views import calculate_company_balance
+from finance.balance_utils import InsufficientBalance, spend
 
 @register.filter
 def get_item(dictionary, key):
@@ -122,7 +126,7 @@ def product_list(request):
     search = request.GET.get('search')
     category = request.GET.get('category')
     if search:
-        products = products.filter(name__icontains=search)
+        products = products.filter(search_q(search, 'product', fallback='name__icontains'))
     if category:
         products = products.filter(category=category)
     paginator = Paginator(products, 20)
@@ -274,7 +278,7 @@ def client_list(request):
     search = request.GET.get('search')
     area_id = request.GET.get('area')
     if search:
-        clients = clients.filter(name__icontains=search)
+        clients = clients.filter(search_q(search, 'client', fallback='name__icontains'))
     if area_id:
         clients = clients.filter(area_id=area_id)
     # Annotate each client with total sales
@@ -292,20 +296,34 @@ def client_list(request):
     })
 
 @require_GET
+@report_view
 def client_list_pdf(request):
-    from django.template.loader import render_to_string
-    from weasyprint import HTML, CSS
-    import tempfile
-    from datetime import date
-
     clients = Client.objects.select_related('area').all()
     search = request.GET.get('search')
     area_id = request.GET.get('area')
     if search:
-        clients = clients.filter(name__icontains=search)
+        clients = clients.filter(search_q(search, 'client', fallback='name__icontains'))
     if area_id:
         clients = clients.filter(area_id=area_id)
     clients = clients.annotate(total_sales=Sum('sale__total'))
+
+    if request.GET.get('mode') == 'fast':
+        from .export_utils import iter_queryset
+        from .pdf_utils import table_pdf_response
+
+        def row(client):
+            return [client.name, client.phone or '', client.address or '', client.area.name if client.area else '', client.total_sales or 0]
+
+        headers = ["الاسم", "الهاتف", "العنوان", "المنطقة", "إجمالي المبيعات"]
+        return table_pdf_response(
+            f"client_list_{date.today().isoformat()}", "قائمة العملاء", headers,
+            iter_queryset(clients.order_by('name'), row), rtl=True,
+        )
+
+    from django.template.loader import render_to_string
+    from weasyprint import HTML, CSS
+    import tempfile
+
     logo_url = request.build_absolute_uri('/static/logo.png')
     html_string = render_to_string('panel/client_list_pdf.html', {
         'clients': clients,
@@ -335,6 +353,7 @@ def clients_by_area(request):
     })
 
 @require_GET
+@report_view
 def area_list_pdf(request):
     from django.template.loader import render_to_string
     from weasyprint import HTML, CSS
@@ -356,6 +375,7 @@ def area_list_pdf(request):
     from django.http import FileResponse
     return FileResponse(io.BytesIO(pdf), as_attachment=True, filename=f'area_list_{date.today().isoformat()}.pdf')
 
+@report_view
 def area_sales_report(request):
     # Revenue per area
     area_revenue = (
@@ -441,6 +461,10 @@ class SaleForm(forms.ModelForm):
             'employee': 'المندوب',
             'due_date': 'تاريخ الاستحقاق',
         }
+        widgets = {
+            'client': AutocompleteSelect('clients', placeholder='اختر العميل...'),
+            'employee': AutocompleteSelect('employees', placeholder='اختر المندوب...'),
+        }
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -496,102 +520,110 @@ def sale_create(request):
                 post_data[f'{prefix}-price'] = "0"
         formset = SaleItemFormSet(post_data)
         if sale_form.is_valid() and formset.is_valid():
-            sale = sale_form.save(commit=False)
-            sale.created_at = timezone.now()
-            sale.save()
-            formset.instance = sale
-            sale_items = formset.save(commit=False)
-            total = 0
-            for i, form in enumerate(formset.forms):
-                if form.cleaned_data.get('DELETE', False):
-                    continue
-                prefix = form.prefix
-                batch_key = f"{prefix}-batch"
-                batch_id = request.POST.get(batch_key)
-                if not batch_id:
-                    messages.error(request, "يجب اختيار دفعة لكل منتج.")
-                    return render(request, 'sales/sale_form.html', {
-                        'sale_form': sale_form,
-                        'formset': formset,
-                        'latest_rate': latest_rate,
-                        'products': products,
-                        'inventories': inventories,
-                        'products_with_batches': products_with_batches,
-                        'inventories_by_product': inventories_by_product,
-                        'sale': None,
-                        "active_sidebar": "sales"
-                    })
-                try:
-                    inventory = Inventory.objects.select_related('shipment', 'product').get(pk=batch_id)
-                except Inventory.DoesNotExist:
-                    messages.error(request, "دفعة غير صالحة.")
-                    return render(request, 'sales/sale_form.html', {
-                        'sale_form': sale_form,
-                        'formset': formset,
-                        'latest_rate': latest_rate,
-                        'products': products,
-                        'inventories': inventories,
-                        'products_with_batches': products_with_batches,
-                        'inventories_by_product': inventories_by_product,
-                        'sale': None,
-                        "active_sidebar": "sales"
-                    })
-                form.instance.inventory = inventory
-                # Set price from shipment.sale_usd * product.exchange_rate (enforce backend)
-                shipment = inventory.shipment
-                product = inventory.product
-                if shipment and shipment.sale_usd is not None and product.exchange_rate is not None:
-                    form.instance.price = float(shipment.sale_usd or 0) * float(product.exchange_rate or 0)
-                else:
-                    form.instance.price = 0
-                # --- Set discounts from form data ---
-                form.instance.free_goods_discount = float(form.cleaned_data.get('free_goods_discount') or 0)
-                form.instance.price_discount = float(form.cleaned_data.get('price_discount') or 0)
-            for obj in formset.deleted_objects:
-                obj.delete()
-            for item in sale_items:
-                # Deduct both paid and free units from inventory
-                total_units = item.quantity + item.free_units
-                # if total_units > item.inventory.quantity:
-                #     messages.error(request, f"الكمية المطلوبة (مع المجاني) غير متوفرة في الدفعة {item.inventory.shipment.batch_number} للمنتج {item.inventory.product.name}")
-                #     return render(request, 'sales/sale_form.html', {
-                #         'sale_form': sale_form,
-                #         'formset': formset,
-                #         'latest_rate': latest_rate,
-                #         'products': products,
-                #         'inventories': inventories,
-                #         'products_with_batches': products_with_batches,
-                #         'inventories_by_product': inventories_by_product,
-                #         'sale': None,
-                #         "active_sidebar": "sales"
-                #     })
-                item.inventory.quantity -= total_units
-                item.inventory.save()
-                item.save()
-                total += item.get_total
-            sale.total = total
-            sale.save()
-            formset.save_m2m()
-            sale.calculate_total()
-            # --- Commission creation ---
-            employee = sale.employee
-            if employee and getattr(employee, 'commission_percentage', 0):
-                commission_percentage = float(employee.commission_percentage)
-                commission_amount = float(sale.total or 0) * (commission_percentage / 100)
-                Commission.objects.update_or_create(
-                    employee=employee, sale=sale,
-                    defaults={'amount': commission_amount}
+            # One transaction: stock deductions, invoice and any queued alerts commit together
+            with transaction.atomic():
+                sale = sale_form.save(commit=False)
+                sale.created_at = timezone.now()
+                sale.save()
+                formset.instance = sale
+                sale_items = formset.save(commit=False)
+                total = 0
+                for i, form in enumerate(formset.forms):
+                    if form.cleaned_data.get('DELETE', False):
+                        continue
+                    prefix = form.prefix
+                    batch_key = f"{prefix}-batch"
+                    batch_id = request.POST.get(batch_key)
+                    if not batch_id:
+                        messages.error(request, "يجب اختيار دفعة لكل منتج.")
+                        response = render(request, 'sales/sale_form.html', {
+                            'sale_form': sale_form,
+                            'formset': formset,
+                            'latest_rate': latest_rate,
+                            'products': products,
+                            'inventories': inventories,
+                            'products_with_batches': products_with_batches,
+                            'inventories_by_product': inventories_by_product,
+                            'sale': None,
+                            "active_sidebar": "sales"
+                        })
+                        # Undo the partly saved sale
+                        transaction.set_rollback(True)
+                        return response
+                    try:
+                        inventory = Inventory.objects.select_related('shipment', 'product').get(pk=batch_id)
+                    except Inventory.DoesNotExist:
+                        messages.error(request, "دفعة غير صالحة.")
+                        response = render(request, 'sales/sale_form.html', {
+                            'sale_form': sale_form,
+                            'formset': formset,
+                            'latest_rate': latest_rate,
+                            'products': products,
+                            'inventories': inventories,
+                            'products_with_batches': products_with_batches,
+                            'inventories_by_product': inventories_by_product,
+                            'sale': None,
+                            "active_sidebar": "sales"
+                        })
+                        # Undo the partly saved sale
+                        transaction.set_rollback(True)
+                        return response
+                    form.instance.inventory = inventory
+                    # Set price from shipment.sale_usd * product.exchange_rate (enforce backend)
+                    shipment = inventory.shipment
+                    product = inventory.product
+                    if shipment and shipment.sale_usd is not None and product.exchange_rate is not None:
+                        form.instance.price = float(shipment.sale_usd or 0) * float(product.exchange_rate or 0)
+                    else:
+                        form.instance.price = 0
+                    # --- Set discounts from form data ---
+                    form.instance.free_goods_discount = float(form.cleaned_data.get('free_goods_discount') or 0)
+                    form.instance.price_discount = float(form.cleaned_data.get('price_discount') or 0)
+                for obj in formset.deleted_objects:
+                    obj.delete()
+                for item in sale_items:
+                    # Deduct both paid and free units from inventory
+                    total_units = item.quantity + item.free_units
+                    # if total_units > item.inventory.quantity:
+                    #     messages.error(request, f"الكمية المطلوبة (مع المجاني) غير متوفرة في الدفعة {item.inventory.shipment.batch_number} للمنتج {item.inventory.product.name}")
+                    #     return render(request, 'sales/sale_form.html', {
+                    #         'sale_form': sale_form,
+                    #         'formset': formset,
+                    #         'latest_rate': latest_rate,
+                    #         'products': products,
+                    #         'inventories': inventories,
+                    #         'products_with_batches': products_with_batches,
+                    #         'inventories_by_product': inventories_by_product,
+                    #         'sale': None,
+                    #         "active_sidebar": "sales"
+                    #     })
+                    item.inventory.quantity -= total_units
+                    item.inventory.save()
+                    item.save()
+                    total += item.get_total
+                sale.total = total
+                sale.save()
+                formset.save_m2m()
+                sale.calculate_total()
+                # --- Commission creation ---
+                employee = sale.employee
+                if employee and getattr(employee, 'commission_percentage', 0):
+                    commission_percentage = float(employee.commission_percentage)
+                    commission_amount = float(sale.total or 0) * (commission_percentage / 100)
+                    Commission.objects.update_or_create(
+                        employee=employee, sale=sale,
+                        defaults={'amount': commission_amount}
+                    )
+                # --- End commission creation ---
+                invoice = Invoice.objects.create(
+                    sale=sale,
+                    created_at=timezone.now(),
+                    file_path='',
                 )
-            # --- End commission creation ---
-            invoice = Invoice.objects.create(
-                sale=sale,
-                created_at=timezone.now(),
-                file_path='',
-            )
-            invoice.total = sale.total
-            invoice.due_date = sale_form.cleaned_data['due_date']
-            invoice.status = 'unpaid'
-            invoice.save()
+                invoice.total = sale.total
+                invoice.due_date = sale_form.cleaned_data['due_date']
+                invoice.status = 'unpaid'
+                invoice.save()
             return redirect('panel:sale_detail', pk=sale.pk)
         else:
             # --- Add this block to print form errors for debugging ---
@@ -624,6 +656,132 @@ def get_employee_commission(request):
     except Employee.DoesNotExist:
         return JsonResponse({'commission_percentage': 0})
 
+AUTOCOMPLETE_LIMIT = 20
+
+def _prefix_match(field, term):
+    """
+    Prefix filter written as a range so SQLite can walk the column's index
+    (its LIKE is case-insensitive and cannot use a plain index).
+    """
+    return Q(**{f'{field}__gte': term, f'{field}__lt': term + '\U0010ffff'})
+
+def _autocomplete_clients(request, term):
+    clients = Client.objects.order_by('name')
+    if term:
+        clients = clients.filter(_prefix_match('name', term) | _prefix_match('phone', term))
+    return [
+        {'id': c.pk, 'text': f"{c.name} ({c.phone})" if c.phone else c.name}
+        for c in clients[:AUTOCOMPLETE_LIMIT]
+    ]
+
+def _autocomplete_by_name(model):
+    def search(request, term):
+        objects = model.objects.order_by('name')
+        if term:
+            objects = objects.filter(_prefix_match('name', term))
+        return [{'id': obj.pk, 'text': obj.name} for obj in objects[:AUTOCOMPLETE_LIMIT]]
+    return search
+
+def _autocomplete_inventories(request, term):
+    inventories = (
+        Inventory.objects.select_related('product', 'shipment')
+        .filter(quantity__gt=0)
+        .order_by('shipment__expiry_date')
+    )
+    product_id = request.GET.get('product')
+    if product_id:
+        inventories = inventories.filter(product_id=product_id)
+    if term:
+        inventories = inventories.filter(
+            _prefix_match('product__name', term) | _prefix_match('shipment__batch_number', term)
+        )
+    return [
+        {
+            'id': inv.pk,
+            'text': f"{inv.shipment.batch_number} - {inv.product.name} (الكمية: {inv.quantity})",
+            'data': {'product': inv.product_id, 'qty': inv.quantity},
+        }
+        for inv in inventories[:AUTOCOMPLETE_LIMIT]
+    ]
+
+def _autocomplete_sale_items(request, term):
+    sale_id = request.GET.get('sale')
+    if not sale_id:
+        return []
+    items = SaleItem.objects.select_related('inventory__product', 'inventory__shipment').filter(sale_id=sale_id)
+    if term:
+        items = items.filter(_prefix_match('inventory__product__name', term))
+    return [
+        {
+            'id': item.pk,
+            'text': f"{item.inventory.product.name} ({item.quantity}) - تشغيلة: {item.inventory.shipment.batch_number}",
+            'data': {'max': item.quantity},
+        }
+        for item in items[:AUTOCOMPLETE_LIMIT]
+    ]
+
+AUTOCOMPLETE_SOURCES = {
+    'clients': _autocomplete_clients,
+    'employees': _autocomplete_by_name(Employee),
+    'suppliers': _autocomplete_by_name(Supplier),
+    'products': _autocomplete_by_name(Product),
+    'inventories': _autocomplete_inventories,
+    'sale-items': _autocomplete_sale_items,
+}
+
+@require_GET
+def autocomplete(request, kind):
+    """
+    JSON search used by AutocompleteSelect widgets: {"results": [{id, text, data}]}.
+    """
+    source = AUTOCOMPLETE_SOURCES.get(kind)
+    if source is None:
+        from django.http import Http404
+        raise Http404("Unknown autocomplete source.")
+    term = request.GET.get('q', '').strip()
+    return JsonResponse({'results': source(request, term)})
+
+@require_GET
+def global_search(request):
+    """
+    Ranked search over clients, products, suppliers, batch numbers and
+    invoice numbers. Results use the autocomplete format with the target
+    page's URL as the id, so the navbar picker can jump straight to it.
+    """
+    from urllib.parse import urlencode
+    from .search import search
+    hits = search(request.GET.get('q', ''), limit=AUTOCOMPLETE_LIMIT)
+    ids = defaultdict(list)
+    for kind, obj_id in hits:
+        ids[kind].append(obj_id)
+    objects = {
+        'client': Client.objects.in_bulk(ids['client']),
+        'product': Product.objects.in_bulk(ids['product']),
+        'supplier': Supplier.objects.in_bulk(ids['supplier']),
+        'shipment': Shipment.objects.select_related('product').in_bulk(ids['shipment']),
+        'invoice': Invoice.objects.select_related('sale__client').in_bulk(ids['invoice']),
+    }
+    results = []
+    for kind, obj_id in hits:
+        obj = objects[kind].get(obj_id)
+        if obj is None:
+            continue
+        if kind == 'client':
+            url, text = reverse('panel:client_detail', args=[obj.pk]), f"عميل: {obj.name}"
+        elif kind == 'product':
+            url, text = reverse('panel:product_detail', args=[obj.pk]), f"منتج: {obj.name}"
+        elif kind == 'supplier':
+            url, text = reverse('panel:supplier_detail', args=[obj.pk]), f"مورد: {obj.name}"
+        elif kind == 'shipment':
+            url = reverse('panel:shipment_list') + '?' + urlencode({'search': obj.batch_number})
+            text = f"تشغيلة: {obj.batch_number} - {obj.product.name}"
+        else:
+            client = obj.sale.client
+            url = reverse('panel:invoice_detail', args=[obj.pk])
+            text = f"فاتورة: {obj.number}" + (f" - {client.name}" if client else '')
+        results.append({'id': url, 'text': text, 'data': {'kind': kind}})
+    return JsonResponse({'results': results})
+
 def sale_detail(request, pk):
     sale = get_object_or_404(Sale, pk=pk)
     invoice = Invoice.objects.filter(sale=sale).first()
@@ -868,24 +1026,18 @@ def sale_return_product(request, pk):
             messages.error(request, error)
     return redirect('panel:sale_detail', pk=sale.pk)
 
-def sale_list(request):
-    sales = Sale.objects.select_related('client', 'employee').order_by('-created_at')
-    # Prefetch invoice for each sale for payment info in the list
-    from django.db.models import Prefetch
-    invoices = Invoice.objects.all()
-    sales = sales.prefetch_related(Prefetch('invoice', queryset=invoices))
-    # --- Add search by invoice number ---
+def _filter_sales(request, sales):
+    """
+    Apply the sale_list filters (invoice number, area, status, employee, client)
+    from the query string. Shared by the list, the PDF and the CSV/XLSX exports.
+    """
     invoice_number = request.GET.get('invoice_number')
     if invoice_number:
         sales = sales.filter(invoice__number__icontains=invoice_number)
-    # --- End search ---
-
-    # --- New: Filtering ---
     area_id = request.GET.get('area')
     status = request.GET.get('status')
     employee_id = request.GET.get('employee')
     client_id = request.GET.get('client')
-
     if area_id:
         sales = sales.filter(client__area_id=area_id)
     # --- handle new partial_or_unpaid status ---
@@ -893,16 +1045,30 @@ def sale_list(request):
         sales = sales.filter(invoice__status__in=["partial", "unpaid"])
     elif status:
         sales = sales.filter(invoice__status=status)
-    # --- end handle ---
     if employee_id:
         sales = sales.filter(employee_id=employee_id)
     if client_id:
         sales = sales.filter(client_id=client_id)
+    return sales
 
-    # For filter dropdowns
+def sale_list(request):
+    sales = Sale.objects.select_related('client', 'employee').order_by('-created_at')
+    # Prefetch invoice for each sale for payment info in the list
+    from django.db.models import Prefetch
+    invoices = Invoice.objects.all()
+    sales = sales.prefetch_related(Prefetch('invoice', queryset=invoices))
+    sales = _filter_sales(request, sales)
+    invoice_number = request.GET.get('invoice_number')
+    area_id = request.GET.get('area')
+    status = request.GET.get('status')
+    employee_id = request.GET.get('employee')
+    client_id = request.GET.get('client')
+
+    # For filter dropdowns; employee/client are searched on demand, so only
+    # the selected one is rendered
     areas = Area.objects.all()
-    employees = Employee.objects.all()
-    clients = Client.objects.all()
+    employees = Employee.objects.filter(pk=employee_id) if employee_id else Employee.objects.none()
+    clients = Client.objects.filter(pk=client_id) if client_id else Client.objects.none()
     status_choices = Invoice.STATUS_CHOICES
 
     return render(request, 'panel/sale_list.html', {
@@ -921,38 +1087,27 @@ def sale_list(request):
     })
 
 @require_GET
+@report_view
 def sale_list_pdf(request):
     """
     Export the current sales list as a PDF for sharing/printing.
+    ?mode=fast builds it with the chunked ReportLab table builder instead.
     """
+    if request.GET.get('mode') == 'fast':
+        from .pdf_utils import table_pdf_response
+        headers, rows = _sale_list_rows(request)
+        return table_pdf_response(f"sales_list_{date.today().isoformat()}", "قائمة المبيعات", headers, rows, rtl=True)
+
     from django.template.loader import render_to_string
     from weasyprint import HTML, CSS
     import tempfile
-    from datetime import date
 
     # Use same filtering logic as sale_list
     sales = Sale.objects.select_related('client', 'employee').order_by('-created_at')
     from django.db.models import Prefetch
     invoices = Invoice.objects.all()
     sales = sales.prefetch_related(Prefetch('invoice', queryset=invoices))
-
-    invoice_number = request.GET.get('invoice_number')
-    if invoice_number:
-        sales = sales.filter(invoice__number__icontains=invoice_number)
-    area_id = request.GET.get('area')
-    status = request.GET.get('status')
-    employee_id = request.GET.get('employee')
-    client_id = request.GET.get('client')
-    if area_id:
-        sales = sales.filter(client__area_id=area_id)
-    if status == "partial_or_unpaid":
-        sales = sales.filter(invoice__status__in["partial", "unpaid"])
-    elif status:
-        sales = sales.filter(invoice__status=status)
-    if employee_id:
-        sales = sales.filter(employee_id=employee_id)
-    if client_id:
-        sales = sales.filter(client_id=client_id)
+    sales = _filter_sales(request, sales)
 
     # Logo path (if available)
     logo_url = request.build_absolute_uri('/static/logo.png')  # Adjust path as needed
@@ -990,7 +1145,66 @@ def sale_list_pdf(request):
     )
     return response
 
+def _invoice_paid_subquery(invoice_ref):
+    """
+    Correlated subquery for the amount paid on an invoice, so exports get it
+    per row without a GROUP BY over the whole result.
+    """
+    from decimal import Decimal
+    from django.db.models import OuterRef, Subquery
+    from django.db.models.functions import Coalesce
+    paid = (
+        InvoicePayment.objects
+        .filter(invoice=OuterRef(invoice_ref))
+        .values('invoice')
+        .annotate(total=Sum('amount'))
+        .values('total')
+    )
+    return Coalesce(Subquery(paid), Decimal('0'), output_field=models.DecimalField(max_digits=12, decimal_places=2))
+
+def _sale_list_rows(request):
+    """
+    Headers and lazily-built rows for the filtered sales list, shared by the
+    CSV/XLSX export and the fast PDF.
+    """
+    from .export_utils import iter_queryset
+    sales = (
+        Sale.objects.select_related('client', 'employee', 'invoice')
+        .annotate(paid=_invoice_paid_subquery('invoice'))
+        .order_by('-created_at')
+    )
+    sales = _filter_sales(request, sales)
+    status_labels = dict(Invoice.STATUS_CHOICES)
+
+    def row(sale):
+        invoice = getattr(sale, 'invoice', None)
+        return [
+            invoice.number if invoice else '',
+            sale.client.name if sale.client else '',
+            (sale.client.phone or '') if sale.client else '',
+            sale.employee.name if sale.employee else '',
+            timezone.localtime(sale.created_at).strftime('%Y-%m-%d %H:%M'),
+            sale.total,
+            sale.paid,
+            sale.total - sale.paid,
+            status_labels.get(invoice.status, invoice.status) if invoice else '',
+        ]
+
+    headers = ["رقم الفاتورة", "العميل", "الهاتف", "المندوب", "التاريخ", "الإجمالي", "المدفوع", "المتبقي", "الحالة"]
+    return headers, iter_queryset(sales, row)
+
+@require_GET
+@report_view
+def sale_list_export(request, fmt):
+    """
+    Export the filtered sales list as CSV or XLSX, streamed from the database.
+    """
+    from .export_utils import export_response
+    headers, rows = _sale_list_rows(request)
+    return export_response(fmt, f"sales_list_{date.today().isoformat()}", headers, rows)
+
 @require_GET
+@report_view
 def supplier_list_pdf(request):
     from django.template.loader import render_to_string
     from weasyprint import HTML, CSS
@@ -1011,14 +1225,21 @@ def supplier_list_pdf(request):
     from django.http import FileResponse
     return FileResponse(io.BytesIO(pdf), as_attachment=True, filename=f'supplier_list_{date.today().isoformat()}.pdf')
 
+def _filter_shipments(request, shipments):
+    search = request.GET.get('search')
+    if search:
+        shipments = shipments.filter(
+            search_q(search, 'product', lookup='product_id', fallback='product__name__icontains')
+            | search_q(search, 'shipment', fallback='batch_number__icontains')
+        )
+    return shipments
+
 def shipment_list(request):
     """
     List shipments with optional search/filter and pagination.
     """
-    shipments = Shipment.objects.select_related('product').all().order_by('-received_at')
+    shipments = _filter_shipments(request, Shipment.objects.select_related('product').all().order_by('-received_at'))
     search = request.GET.get('search')
-    if search:
-        shipments = shipments.filter(product__name__icontains=search)
     paginator = Paginator(shipments, 20)
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
@@ -1029,16 +1250,22 @@ def shipment_list(request):
     })
 
 @require_GET
+@report_view
 def shipment_list_pdf(request):
+    if request.GET.get('mode') == 'fast':
+        from .pdf_utils import table_pdf_response
+        from reportlab.lib.pagesizes import A4, landscape
+        headers, rows = _shipment_list_rows(request)
+        return table_pdf_response(
+            f"shipment_list_{date.today().isoformat()}", "قائمة الشحنات", headers, rows,
+            rtl=True, pagesize=landscape(A4),
+        )
+
     from django.template.loader import render_to_string
     from weasyprint import HTML, CSS
     import tempfile
-    from datetime import date
 
-    shipments = Shipment.objects.select_related('product').all().order_by('-received_at')
-    search = request.GET.get('search')
-    if search:
-        shipments = shipments.filter(product__name__icontains=search)
+    shipments = _filter_shipments(request, Shipment.objects.select_related('product').all().order_by('-received_at'))
     logo_url = request.build_absolute_uri('/static/logo.png')
     html_string = render_to_string('shipments/shipment_list_pdf.html', {
         'shipments': shipments,
@@ -1052,17 +1279,58 @@ def shipment_list_pdf(request):
     from django.http import FileResponse
     return FileResponse(io.BytesIO(pdf), as_attachment=True, filename=f'shipment_list_{date.today().isoformat()}.pdf')
 
+def _shipment_list_rows(request):
+    """
+    Headers and lazily-built rows for the filtered shipment list.
+    """
+    from .export_utils import iter_queryset
+    shipments = _filter_shipments(request, Shipment.objects.select_related('product', 'supplier').order_by('-received_at'))
+
+    def row(shipment):
+        return [
+            shipment.pk,
+            shipment.product.name,
+            shipment.supplier.name if shipment.supplier else '',
+            shipment.quantity,
+            shipment.cost_usd,
+            shipment.exchange_rate,
+            shipment.cost_sdg,
+            shipment.sale_usd,
+            shipment.shipment_cost,
+            shipment.batch_number,
+            shipment.expiry_date.isoformat(),
+            timezone.localtime(shipment.received_at).strftime('%Y-%m-%d %H:%M'),
+        ]
+
+    headers = [
+        "#", "المنتج", "المورد", "الكمية", "تكلفة الوحدة بالدولار", "سعر الصرف", "تكلفة الوحدة بالجنيه",
+        "سعر البيع بالدولار", "تكاليف اضافيه (جنيه)", "رقم التشغيلة", "تاريخ الانتهاء", "تاريخ الاستلام",
+    ]
+    return headers, iter_queryset(shipments, row)
+
+@require_GET
+@report_view
+def shipment_list_export(request, fmt):
+    """
+    Export the filtered shipment list as CSV or XLSX, streamed from the database.
+    """
+    from .export_utils import export_response
+    headers, rows = _shipment_list_rows(request)
+    return export_response(fmt, f"shipment_list_{date.today().isoformat()}", headers, rows)
+
 @require_GET
+@report_view
 def inventory_list_pdf(request):
+    if request.GET.get('mode') == 'fast':
+        from .pdf_utils import table_pdf_response
+        headers, rows = _inventory_list_rows(request)
+        return table_pdf_response(f"inventory_list_{date.today().isoformat()}", "قائمة المخزون", headers, rows, rtl=True)
+
     from django.template.loader import render_to_string
     from weasyprint import HTML, CSS
     import tempfile
-    from datetime import date
 
-    inventories = Inventory.objects.select_related('product', 'shipment').order_by('shipment__expiry_date')
-    search = request.GET.get('search')
-    if search:
-        inventories = inventories.filter(product__name__icontains=search)
+    inventories = _filter_inventories(request, Inventory.objects.select_related('product', 'shipment').order_by('shipment__expiry_date'))
     logo_url = request.build_absolute_uri('/static/logo.png')
     html_string = render_to_string('inventory/inventory_list_pdf.html', {
         'inventories': inventories,
@@ -1076,24 +1344,93 @@ def inventory_list_pdf(request):
     from django.http import FileResponse
     return FileResponse(io.BytesIO(pdf), as_attachment=True, filename=f'inventory_list_{date.today().isoformat()}.pdf')
 
+def _inventory_list_rows(request):
+    """
+    Headers and lazily-built rows for the filtered inventory list.
+    """
+    from .export_utils import iter_queryset
+    inventories = _filter_inventories(request, Inventory.objects.select_related('product', 'shipment').order_by('shipment__expiry_date'))
+
+    def row(inv):
+        return [
+            inv.product.name,
+            inv.shipment.batch_number,
+            inv.shipment.expiry_date.isoformat(),
+            inv.quantity,
+        ]
+
+    headers = ["المنتج", "رقم التشغيلة", "تاريخ الانتهاء", "الكمية"]
+    return headers, iter_queryset(inventories, row)
+
+@require_GET
+@report_view
+def inventory_list_export(request, fmt):
+    """
+    Export the filtered inventory list as CSV or XLSX, streamed from the database.
+    """
+    from .export_utils import export_response
+    headers, rows = _inventory_list_rows(request)
+    return export_response(fmt, f"inventory_list_{date.today().isoformat()}", headers, rows)
+
+def _forecast_params(request):
+    """
+    Lead time and cover days from the query string, within 1..365.
+    """
+    from .forecast_utils import COVER_DAYS, LEAD_TIME_DAYS
+    params = {}
+    for name, default in (('lead_time_days', LEAD_TIME_DAYS), ('cover_days', COVER_DAYS)):
+        try:
+            params[name] = min(max(int(request.GET.get(name, default)), 1), 365)
+        except (TypeError, ValueError):
+            params[name] = default
+    return params
+
+@report_view
+def stock_forecast(request):
+    """
+    Days of cover, stock-out date and reorder quantity per product from
+    its recent sales velocity.
+    """
+    from .forecast_utils import HISTORY_DAYS, MOVING_AVERAGE_DAYS, forecast
+    params = _forecast_params(request)
+    rows = forecast(**params)
+    return render(request, 'inventory/stock_forecast.html', {
+        'rows': rows,
+        'reorder_count': sum(1 for row in rows if row['reorder']),
+        'history_days': HISTORY_DAYS,
+        'moving_average_days': MOVING_AVERAGE_DAYS,
+        **params,
+        "active_sidebar": "inventory",
+    })
+
+@require_GET
+@report_view
+def stock_forecast_export(request, fmt):
+    """
+    Export the stock forecast as CSV or XLSX.
+    """
+    from .export_utils import export_response
+    from .forecast_utils import forecast, forecast_rows
+    headers, rows = forecast_rows(forecast(**_forecast_params(request)))
+    return export_response(fmt, f"stock_forecast_{date.today().isoformat()}", headers, rows)
+
 @require_GET
+@report_view
 def expense_list_pdf(request):
+    if request.GET.get('mode') == 'fast':
+        from .pdf_utils import table_pdf_response
+        headers, rows = _expense_list_rows(request)
+        return table_pdf_response(f"expense_list_{date.today().isoformat()}", "قائمة المصروفات", headers, rows, rtl=True)
+
     from django.template.loader import render_to_string
     from weasyprint import HTML, CSS
     import tempfile
-    from datetime import date
 
-    expenses = Expense.objects.all().order_by('-date')
+    expenses = _filter_expenses(request, Expense.objects.all().order_by('-date'))
     months = []
     for e in Expense.objects.dates('date', 'month', order='DESC'):
         months.append({'value': e.strftime('%Y-%m'), 'label': e.strftime('%B %Y')})
     selected_month = request.GET.get('month')
-    if selected_month:
-        try:
-            year, month = map(int, selected_month.split('-'))
-            expenses = expenses.filter(date__year=year, date__month=month)
-        except Exception:
-            pass
     logo_url = request.build_absolute_uri('/static/logo.png')
     html_string = render_to_string('expenses/expense_list_pdf.html', {
         'expenses': expenses,
@@ -1109,6 +1446,29 @@ def expense_list_pdf(request):
     from django.http import FileResponse
     return FileResponse(io.BytesIO(pdf), as_attachment=True, filename=f'expense_list_{date.today().isoformat()}.pdf')
 
+def _expense_list_rows(request):
+    """
+    Headers and lazily-built rows for the filtered expense list.
+    """
+    from .export_utils import iter_queryset
+    expenses = _filter_expenses(request, Expense.objects.all().order_by('-date'))
+
+    def row(expense):
+        return [expense.description, expense.amount, expense.date.isoformat()]
+
+    headers = ["الوصف", "المبلغ بالجنيه", "التاريخ"]
+    return headers, iter_queryset(expenses, row)
+
+@require_GET
+@report_view
+def expense_list_export(request, fmt):
+    """
+    Export the filtered expense list as CSV or XLSX, streamed from the database.
+    """
+    from .export_utils import export_response
+    headers, rows = _expense_list_rows(request)
+    return export_response(fmt, f"expense_list_{date.today().isoformat()}", headers, rows)
+
 class ShipmentForm(forms.ModelForm):
     # batch_number = forms.CharField(label="رقم التشغيلة", required=True)
     expiry_date = forms.DateField(label="تاريخ الانتهاء", required=True, widget=forms.DateInput(attrs={'type': 'date'}))
@@ -1117,7 +1477,7 @@ class ShipmentForm(forms.ModelForm):
         queryset=Supplier.objects.all(),
         required=True,
         label="المورد",
-        widget=forms.Select(attrs={'class': 'form-select'})
+        widget=AutocompleteSelect('suppliers', attrs={'class': 'form-select'}, placeholder='اختر المورد...')
     )
 
     class Meta:
@@ -1135,6 +1495,9 @@ class ShipmentForm(forms.ModelForm):
             'supplier': 'المورد',
 
         }
+        widgets = {
+            'product': AutocompleteSelect('products', placeholder='اختر المنتج...'),
+        }
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -1158,22 +1521,22 @@ def shipment_create(request):
         form = ShipmentForm(request.POST)
         if form.is_valid():
             sdg_cost = form.cleaned_data['shipment_cost']
-            balance = calculate_company_balance(Currency.objects.get(code='SDG'))
-            if balance < sdg_cost:
-                form.add_error('shipment_cost', f"الرصيد الحالي للجنيه السوداني ({balance}) غير كافٍ لتغطية تكاليف الشحن ({sdg_cost}).")
+            try:
+                with spend('SDG', sdg_cost):
+                    shipment = form.save(commit=False)
+                    shipment.received_at = timezone.now()
+                    shipment.cost_sdg = float(shipment.cost_usd) * float(shipment.exchange_rate)
+                    shipment.save()
+                    # Create Inventory for this shipment
+                    from .models import Inventory
+                    Inventory.objects.create(
+                        product=shipment.product,
+                        shipment=shipment,
+                        quantity=shipment.quantity
+                    )
+            except InsufficientBalance as error:
+                form.add_error('shipment_cost', f"الرصيد الحالي للجنيه السوداني ({error.balance}) غير كافٍ لتغطية تكاليف الشحن ({sdg_cost}).")
                 return render(request, 'shipments/shipment_form.html', {'form': form, 'active_sidebar': 'shipments'})
-
-            shipment = form.save(commit=False)
-            shipment.received_at = timezone.now()
-            shipment.cost_sdg = float(shipment.cost_usd) * float(shipment.exchange_rate)
-            shipment.save()
-            # Create Inventory for this shipment
-            from .models import Inventory
-            Inventory.objects.create(
-                product=shipment.product,
-                shipment=shipment,
-                quantity=shipment.quantity
-            )
             messages.success(request, "تم تسجيل الشحنة بنجاح.")
             return redirect('panel:shipment_list')
         
@@ -1199,51 +1562,48 @@ def shipment_edit(request, pk):
     if request.method == 'POST':
         form = ShipmentForm(request.POST, instance=shipment)
         if form.is_valid():
-            # Check if shipment cost has changed
-            if form.cleaned_data['shipment_cost'] != old_shipment_cost:
-                sdg_cost = form.cleaned_data['shipment_cost']
-                # check if new cost sdg is greater than old cost sdg and increase in cost is greater than company balance
-                if sdg_cost > old_shipment_cost:
-                    balance = calculate_company_balance(Currency.objects.get(code='SDG'))
-                    decrease_amount = sdg_cost - old_shipment_cost
-                    if balance < decrease_amount:
-                        form.add_error('shipment_cost', f"الرصيد الحالي للجنيه السوداني ({balance}) غير كافٍ لتغطية الزيادة في تكاليف الشحن ({decrease_amount}).")
-                        return render(request, 'shipments/shipment_form.html', {'form': form, 'active_sidebar': 'shipments'})
-            new_shipment = form.save(commit=False)
-
-            # Update inventory for this shipment
-            if inventory:
+            # Only an increase in the shipment cost spends money
+            increase = form.cleaned_data['shipment_cost'] - old_shipment_cost
+            try:
+                with spend('SDG', increase):
+                    new_shipment = form.save(commit=False)
+
+                    # Update inventory for this shipment
+                    if inventory:
                 
-                inventory_qty_diff = new_shipment.quantity - orig_quantity
-                # print(inventory_qty_diff)
-                # print(orig_quantity)
-                # if orig_quantity < new_shipment.quantity:
-                #     # If quantity increased, just update the inventory
-                #     inventory.quantity += inventory_qty_diff
-                # elif orig_quantity > new_shipment.quantity:
-                #     # If quantity decreased, decrease the inventory
-                #     inventory.quantity -= inventory_qty_diff
-                # Ensure inventory quantity does not go negative
-                inventory.quantity += inventory_qty_diff
-                if inventory.quantity < 0:
-                    messages.error(request, "الكمية الجديدة لا يمكن أن تكون أقل من الصفر.")
-                    return render(request, 'shipments/shipment_form.html', {
-                        'form': form,
-                        'products': Product.objects.all(),
-                        'shipment': shipment,
-                        "active_sidebar": "shipments"
-                    })
-                inventory.product = new_shipment.product
-                inventory.save()
-            else:
-                Inventory.objects.create(
-                    product=new_shipment.product,
-                    shipment=new_shipment,
-                    quantity=new_shipment.quantity
-                )
-            # update cost_sdg
-            new_shipment.cost_sdg = float(new_shipment.cost_usd) * float(new_shipment.exchange_rate)
-            new_shipment.save()
+                        inventory_qty_diff = new_shipment.quantity - orig_quantity
+                        # print(inventory_qty_diff)
+                        # print(orig_quantity)
+                        # if orig_quantity < new_shipment.quantity:
+                        #     # If quantity increased, just update the inventory
+                        #     inventory.quantity += inventory_qty_diff
+                        # elif orig_quantity > new_shipment.quantity:
+                        #     # If quantity decreased, decrease the inventory
+                        #     inventory.quantity -= inventory_qty_diff
+                        # Ensure inventory quantity does not go negative
+                        inventory.quantity += inventory_qty_diff
+                        if inventory.quantity < 0:
+                            messages.error(request, "الكمية الجديدة لا يمكن أن تكون أقل من الصفر.")
+                            return render(request, 'shipments/shipment_form.html', {
+                                'form': form,
+                                'products': Product.objects.all(),
+                                'shipment': shipment,
+                                "active_sidebar": "shipments"
+                            })
+                        inventory.product = new_shipment.product
+                        inventory.save()
+                    else:
+                        Inventory.objects.create(
+                            product=new_shipment.product,
+                            shipment=new_shipment,
+                            quantity=new_shipment.quantity
+                        )
+                    # update cost_sdg
+                    new_shipment.cost_sdg = float(new_shipment.cost_usd) * float(new_shipment.exchange_rate)
+                    new_shipment.save()
+            except InsufficientBalance as error:
+                form.add_error('shipment_cost', f"الرصيد الحالي للجنيه السوداني ({error.balance}) غير كافٍ لتغطية الزيادة في تكاليف الشحن ({increase}).")
+                return render(request, 'shipments/shipment_form.html', {'form': form, 'active_sidebar': 'shipments'})
             messages.success(request, "تم تعديل الشحنة بنجاح.")
             return redirect('panel:shipment_list')
         
@@ -1281,6 +1641,7 @@ def shipment_delete(request, pk):
         "active_sidebar": "shipments"
     })
 
+@report_view
 def shipment_profit_report(request):
     from django.db.models import Sum, F
     shipments = Shipment.objects.select_related('product').all().order_by('-received_at')
@@ -1378,23 +1739,30 @@ class EmployeeForm(forms.ModelForm):
             instance.save()
         return instance
 
-def employee_list(request):
-    from datetime import date
-    today = date.today()
-    # Get month/year from GET params
-    month = request.GET.get('month')
-    year = request.GET.get('year')
-    # --- Ensure valid integer values and fallback ---
+def _selected_month(request, today):
+    """
+    (month, year) from the query string, falling back to today's month or
+    year when a value is missing, not a number or out of range.
+    """
     try:
-        month = int(month)
+        month = int(request.GET.get('month'))
         if not (1 <= month <= 12):
             month = today.month
     except (TypeError, ValueError):
         month = today.month
     try:
-        year = int(year)
+        year = int(request.GET.get('year'))
+        # month_range() needs the following month to exist too
+        if not (1 <= year < 9999):
+            year = today.year
     except (TypeError, ValueError):
         year = today.year
+    return month, year
+
+def employee_list(request):
+    from datetime import date
+    today = date.today()
+    month, year = _selected_month(request, today)
     # --- Build years list for dropdown ---
     first_employee = Employee.objects.order_by('created_at').first()
     min_year = first_employee.created_at.year if first_employee else today.year
@@ -1432,20 +1800,11 @@ def employee_list(request):
 def employee_detail(request, pk):
     from datetime import date
     employee = get_object_or_404(Employee, pk=pk)
-    # Get month/year from GET params
-    month = request.GET.get('month')
-    year = request.GET.get('year')
     today = date.today()
-    if not month:
-        month = today.month
-    else:
-        month = int(month)
-    if not year:
-        year = today.year
-    else:
-        year = int(year)
+    month, year = _selected_month(request, today)
     # Get sales for this employee in the selected month
-    sales = Sale.objects.filter(employee=employee, created_at__year=year, created_at__month=month)
+    period = month_range(year, month)
+    sales = Sale.objects.filter(employee=employee, **in_period('created_at', period))
     total_sales = sales.aggregate(total=Sum('total'))['total'] or 0
     commission_percentage = employee.commission_percentage or 0
     commission_amount = employee.get_monthly_commission(month=month, year=year)
@@ -1463,7 +1822,7 @@ def employee_detail(request, pk):
     unpaid_commission = employee.get_unpaid_commission(month=month, year=year)
     # Commission payments for this employee (for this month only)
     commission_payments = employee.commission_payments.filter(
-        paid_at__year=year, paid_at__month=month
+        **in_period('paid_at', period)
     ).order_by('-paid_at')
     # Prepare months for dropdown
     months = []
@@ -1565,6 +1924,7 @@ def sale_commissions(request):
         "active_sidebar": "commissions"
     })
 
+@report_view
 def net_profit_dashboard(request):
     from django.db.models import Q
     from decimal import Decimal
@@ -1681,17 +2041,21 @@ def net_profit_dashboard(request):
         'inventory_value_sales_value': inventory_value_sales_value,
     })
 
-def invoice_list(request):
-    invoices = Invoice.objects.select_related('sale', 'sale__client').order_by('-created_at')
+def _filter_invoices(request, invoices):
     client_name = request.GET.get('client')
     status = request.GET.get('status')
     invoice_num = request.GET.get('invoice')
     if client_name:
-        invoices = invoices.filter(sale__client__name__icontains=client_name)
+        invoices = invoices.filter(search_q(client_name, 'client', lookup='sale__client_id', fallback='sale__client__name__icontains'))
     if invoice_num:
-        invoices = invoices.filter(pk=invoice_num)
+        by_number = search_q(invoice_num, 'invoice', fallback='number__startswith')
+        invoices = invoices.filter(Q(pk=invoice_num) | by_number if invoice_num.isdigit() else by_number)
     if status in ['paid', 'unpaid', 'partial']:
         invoices = invoices.filter(status=status)
+    return invoices
+
+def invoice_list(request):
+    invoices = _filter_invoices(request, Invoice.objects.select_related('sale', 'sale__client').order_by('-created_at'))
     paginator = Paginator(invoices, 20)
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
@@ -1701,6 +2065,37 @@ def invoice_list(request):
         "today": date.today(),
     })
 
+@require_GET
+@report_view
+def invoice_list_export(request, fmt):
+    """
+    Export the filtered invoice list as CSV or XLSX, streamed from the database.
+    """
+    from .export_utils import export_response, iter_queryset
+    invoices = (
+        Invoice.objects.select_related('sale', 'sale__client')
+        .annotate(paid=_invoice_paid_subquery('pk'))
+        .order_by('-created_at')
+    )
+    invoices = _filter_invoices(request, invoices)
+    status_labels = dict(Invoice.STATUS_CHOICES)
+
+    def row(invoice):
+        client = invoice.sale.client
+        return [
+            invoice.number or invoice.pk,
+            client.name if client else '',
+            timezone.localtime(invoice.created_at).strftime('%Y-%m-%d'),
+            invoice.sale.total,
+            invoice.paid,
+            invoice.sale.total - invoice.paid,
+            invoice.due_date.isoformat() if invoice.due_date else '',
+            status_labels.get(invoice.status, invoice.status),
+        ]
+
+    headers = ["رقم الفاتورة", "العميل", "التاريخ", "الإجمالي", "المدفوع", "المتبقي", "الاستحقاق", "الحالة"]
+    return export_response(fmt, f"invoice_list_{date.today().isoformat()}", headers, iter_queryset(invoices, row))
+
 class InvoicePaymentForm(forms.ModelForm):
     class Meta:
         model = InvoicePayment
@@ -1826,22 +2221,26 @@ def invoice_pdf(request, pk):
     )
     return response
 
+def _filter_expenses(request, expenses):
+    selected_month = request.GET.get('month')
+    if selected_month:
+        try:
+            year, month = map(int, selected_month.split('-'))
+            expenses = expenses.filter(**in_period('date', month_bounds(year, month)))
+        except Exception:
+            pass
+    return expenses
+
 def expense_list(request):
     """
     List expenses with optional month filter and pagination.
     """
     from datetime import datetime
-    expenses = Expense.objects.all().order_by('-date')
+    expenses = _filter_expenses(request, Expense.objects.all().order_by('-date'))
     months = []
     for e in Expense.objects.dates('date', 'month', order='DESC'):
         months.append({'value': e.strftime('%Y-%m'), 'label': e.strftime('%B %Y')})
     selected_month = request.GET.get('month')
-    if selected_month:
-        try:
-            year, month = map(int, selected_month.split('-'))
-            expenses = expenses.filter(date__year=year, date__month=month)
-        except Exception:
-            pass
     paginator = Paginator(expenses, 20)
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
@@ -1858,14 +2257,14 @@ def expense_add(request):
         form = ExpenseForm(request.POST)
         expense = None  # ✅ initialize early to avoid UnboundLocalError
         if form.is_valid():
-            balance = calculate_company_balance(Currency.objects.get(code='SDG'))
             amount = form.cleaned_data['amount']
-            if balance < amount:
-                # expense = None
-                form.add_error('amount', f"الرصيد الحالي للجنيه السوداني ({balance}) غير كافٍ لتغطية المصروف ({amount}).")
+            try:
+                with spend('SDG', amount):
+                    expense = form.save()
+            except InsufficientBalance as error:
+                form.add_error('amount', f"الرصيد الحالي للجنيه السوداني ({error.balance}) غير كافٍ لتغطية المصروف ({amount}).")
                 return render(request, 'expenses/expense_form.html', {'form': form, "active_sidebar": "expenses",'expense': expense})
 
-            expense = form.save()
             messages.success(request, "تم إضافة المصروف بنجاح.")
             return redirect('panel:expense_list')
         # expense = None
@@ -1890,14 +2289,14 @@ def expense_edit(request, pk):
             print("skhdytuhk")
             
             amount = form.cleaned_data['amount']
-            if amount > old_amount:
-                balance = calculate_company_balance(Currency.objects.get(code='SDG'))
-                if balance < (amount - old_amount):
-                    form.add_error('amount', f"الرصيد الحالي للجنيه السوداني ({balance}) غير كافٍ لتغطية الزيادة في المصروف ({amount - old_amount}).")
-                    return render(request, 'expenses/expense_form.html', {'form': form, "active_sidebar": "expenses", 'expense': expense})
-
+            try:
+                # Only an increase spends money
+                with spend('SDG', amount - old_amount):
+                    form.save()
+            except InsufficientBalance as error:
+                form.add_error('amount', f"الرصيد الحالي للجنيه السوداني ({error.balance}) غير كافٍ لتغطية الزيادة في المصروف ({amount - old_amount}).")
+                return render(request, 'expenses/expense_form.html', {'form': form, "active_sidebar": "expenses", 'expense': expense})
 
-            form.save()
             messages.success(request, "تم تعديل المصروف بنجاح.")
             return redirect('panel:expense_list')
         
@@ -2079,11 +2478,18 @@ def area_delete(request, pk):
         "active_sidebar": "areas"
     })
 
-def inventory_list(request):
-    inventories = Inventory.objects.select_related('product', 'shipment').order_by('shipment__expiry_date')
+def _filter_inventories(request, inventories):
     search = request.GET.get('search')
     if search:
-        inventories = inventories.filter(product__name__icontains=search)
+        inventories = inventories.filter(
+            search_q(search, 'product', lookup='product_id', fallback='product__name__icontains')
+            | search_q(search, 'shipment', lookup='shipment_id', fallback='shipment__batch_number__icontains')
+        )
+    return inventories
+
+def inventory_list(request):
+    inventories = _filter_inventories(request, Inventory.objects.select_related('product', 'shipment').order_by('shipment__expiry_date'))
+    search = request.GET.get('search')
     paginator = Paginator(inventories, 20)
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
@@ -2110,12 +2516,13 @@ def commission_pay(request, employee_id):
     if amount <= 0 or amount > unpaid:
         messages.error(request, "المبلغ يجب أن يكون أكبر من صفر وأقل أو يساوي العمولة غير المدفوعة.")
         return redirect('panel:employee_detail', pk=employee.pk)
-    balance = calculate_company_balance(Currency.objects.get(code='SDG'))
-    if balance < amount:
-        messages.error(request, f"الرصيد الحالي للجنيه السوداني ({balance}) غير كافٍ لتغطية العمولة ({amount}).")
-        return redirect('panel:employee_detail', pk=employee.pk)
     from .models import CommissionPayment
-    CommissionPayment.objects.create(employee=employee, amount=amount, note=note)
+    try:
+        with spend('SDG', amount):
+            CommissionPayment.objects.create(employee=employee, amount=amount, note=note)
+    except InsufficientBalance as error:
+        messages.error(request, f"الرصيد الحالي للجنيه السوداني ({error.balance}) غير كافٍ لتغطية العمولة ({amount}).")
+        return redirect('panel:employee_detail', pk=employee.pk)
     messages.success(request, f"تم تسجيل دفعة عمولة بمبلغ {amount} بنجاح.")
     return redirect('panel:employee_detail', pk=employee.pk)
 
@@ -2171,6 +2578,7 @@ def client_detail(request, pk):
     })
 
 @require_GET
+@report_view
 def client_pdf(request, pk):
     client = get_object_or_404(Client, pk=pk)
     invoices = (
@@ -2253,6 +2661,7 @@ def client_pdf(request, pk):
     )
     return response
 
+@report_view
 def debts_view(request):
     from decimal import Decimal
     today = timezone.now().date()
@@ -2377,13 +2786,16 @@ def supplier_add_payment(request, pk):
     form = SupplierPaymentForm(request.POST, supplier=supplier)
     if form.is_valid():
         amount = form.cleaned_data['amount']
-        balance = calculate_company_balance(Currency.objects.get(code='USD'))
-        if balance < amount:
+        try:
+            with spend('USD', amount):
+                payment = form.save(commit=False)
+                payment.supplier = supplier
+                payment.save()
+        except InsufficientBalance as error:
             shipments = supplier.shipments.select_related('product').all().order_by('-received_at')
             payments = supplier.payments.order_by('-paid_at')
             # form.add_error('amount', f"الرصيد الحالي للدولار ({balance}) غير كافٍ لتغطية المبلغ ({amount}).")
-            error = f"الرصيد الحالي للدولار ({balance}) غير كافٍ لتغطية المبلغ ({amount})."
-            messages.error(request, error)
+            messages.error(request, f"الرصيد الحالي للدولار ({error.balance}) غير كافٍ لتغطية المبلغ ({amount}).")
             
             return render(request, 'suppliers/supplier_detail.html', {'form': form, 
             'supplier': supplier,
@@ -2394,12 +2806,7 @@ def supplier_add_payment(request, pk):
             'remaining_amount': supplier.remaining_amount,
             
             })
-        else:
-
-            payment = form.save(commit=False)
-            payment.supplier = supplier
-            payment.save()
-            messages.success(request, f"تم تسجيل دفعة بمبلغ {payment.amount} بنجاح.")
+        messages.success(request, f"تم تسجيل دفعة بمبلغ {payment.amount} بنجاح.")
     else:
         for error in form.errors.values():
             messages.error(request, error)
@@ -2436,6 +2843,13 @@ class LostProductForm(forms.ModelForm):
             'quantity': 'الكمية المفقودة',
             'note': 'ملاحظة',
         }
+        widgets = {
+            'product': AutocompleteSelect('products', placeholder='اختر المنتج...'),
+            'inventory': AutocompleteSelect(
+                'inventories', forward={'product': 'id_product'},
+                placeholder='رقم التشغيلة...', select_related=('product', 'shipment'),
+            ),
+        }
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -2462,6 +2876,54 @@ def lost_product_add(request):
         "active_sidebar": "lost_products"
     })
 
+def expiry_scan(request):
+    """
+    Batches expiring within N days (or sitting unsold for N days), with a
+    bulk write-off of the selected ones as lost products.
+    """
+    from .expiry_utils import (
+        DEAD_STOCK_DAYS, EXPIRY_DAYS, WriteOffError, dead_batches, expiring_batches, write_off,
+    )
+    kind = 'dead' if request.GET.get('kind') == 'dead' else 'expiring'
+    default_days = DEAD_STOCK_DAYS if kind == 'dead' else EXPIRY_DAYS
+    try:
+        days = min(max(int(request.GET.get('days', default_days)), 0), 3650)
+    except (TypeError, ValueError):
+        days = default_days
+
+    if request.method == 'POST':
+        quantities = {}
+        for pk in request.POST.getlist('batch'):
+            if not pk.isdigit():
+                continue
+            try:
+                quantities[int(pk)] = int(request.POST.get(f'quantity_{pk}', ''))
+            except ValueError:
+                quantities[int(pk)] = 0  # write_off rejects it
+        if not quantities:
+            messages.error(request, "لم يتم اختيار أي دفعة.")
+            return redirect(f"{reverse('panel:expiry_scan')}?{request.GET.urlencode()}")
+        try:
+            lost = write_off(quantities, note=request.POST.get('note', '').strip() or None)
+        except WriteOffError as error:
+            batches = Inventory.objects.filter(pk__in=error.batches).select_related('shipment')
+            names = "، ".join(batch.shipment.batch_number for batch in batches)
+            messages.error(request, f"الكمية المطلوبة غير صحيحة أو أكبر من المتوفر في الدفعات: {names or '-'}")
+            return redirect(f"{reverse('panel:expiry_scan')}?{request.GET.urlencode()}")
+        messages.success(request, f"تم شطب {len(lost)} دفعة وتسجيلها كمفقودات.")
+        return redirect('panel:lost_product_list')
+
+    batches = list(dead_batches(days) if kind == 'dead' else expiring_batches(days))
+    return render(request, 'lost_products/expiry_scan.html', {
+        'batches': batches,
+        'kind': kind,
+        'days': days,
+        'today': timezone.localdate(),
+        'total_quantity': sum(batch.quantity for batch in batches),
+        'total_value': sum(batch.value or 0 for batch in batches),
+        "active_sidebar": "lost_products"
+    })
+
 class ReturnedProductForm(forms.ModelForm):
     class Meta:
         model = ReturnedProduct
@@ -2471,6 +2933,12 @@ class ReturnedProductForm(forms.ModelForm):
             'quantity': 'الكمية المرجعة',
             'note': 'ملاحظة',
         }
+        widgets = {
+            'sale_item': AutocompleteSelect(
+                'sale-items', forward={'sale': 'id_return_sale'},
+                placeholder='اختر العنصر', select_related=('inventory__product', 'inventory__shipment'),
+            ),
+        }
 
     def __init__(self, sale=None, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -2485,7 +2953,7 @@ class ReturnedProductForm(forms.ModelForm):
         quantity = cleaned_data.get('quantity')
         if sale_item and quantity:
             # Only allow returning up to sold quantity minus already returned
-            already_returned = sum(r.quantity for r in sale_item.returns.all())
+            already_returned = sale_item.returns.aggregate(total=Sum('quantity'))['total'] or 0
             max_returnable = sale_item.quantity - already_returned
             if quantity > max_returnable:
                 raise forms.ValidationError(f"لا يمكن إرجاع أكثر من {max_returnable} وحدة لهذا العنصر.")
@@ -2515,28 +2983,18 @@ def manager_list(request):
     from decimal import Decimal
     from .models import Manager, Sale, ManagerCommissionPayment
     today = date.today()
-    month = request.GET.get('month')
-    year = request.GET.get('year')
-    try:
-        month = int(month)
-        if not (1 <= month <= 12):
-            month = today.month
-    except (TypeError, ValueError):
-        month = today.month
-    try:
-        year = int(year)
-    except (TypeError, ValueError):
-        year = today.year
+    month, year = _selected_month(request, today)
     managers = Manager.objects.all()
+    period = month_range(year, month)
     manager_data = []
     for manager in managers:
         employees = manager.employees.all()
-        sales = Sale.objects.filter(employee__in=employees, created_at__year=year, created_at__month=month)
+        sales = Sale.objects.filter(employee__in=employees, **in_period('created_at', period))
         total_sales = sales.aggregate(total=models.Sum('total'))['total'] or Decimal('0')
         commission_percentage = manager.commission_percentage or Decimal('0')
         commission_amount = total_sales * (commission_percentage / Decimal('100'))
         commission_payments = ManagerCommissionPayment.objects.filter(
-            manager=manager, paid_at__year=year, paid_at__month=month
+            manager=manager, **in_period('paid_at', period)
         )
         paid_total = commission_payments.aggregate(total=models.Sum('amount'))['total'] or Decimal('0')
         unpaid_commission = commission_amount - paid_total
@@ -2613,31 +3071,22 @@ def manager_detail(request, pk):
     from .models import Manager, Employee, Sale, Commission
     manager = get_object_or_404(Manager, pk=pk)
     employees = manager.employees.all()
-    # Get month/year from GET params
-    month = request.GET.get('month')
-    year = request.GET.get('year')
     today = date.today()
-    if not month:
-        month = today.month
-    else:
-        month = int(month)
-    if not year:
-        year = today.year
-    else:
-        year = int(year)
+    month, year = _selected_month(request, today)
     # Get sales for all employees of this manager in the selected month
-    sales = Sale.objects.filter(employee__in=employees, created_at__year=year, created_at__month=month)
+    period = month_range(year, month)
+    sales = Sale.objects.filter(employee__in=employees, **in_period('created_at', period))
     total_sales = sales.aggregate(total=models.Sum('total'))['total'] or Decimal('0')
     commission_percentage = manager.commission_percentage or Decimal('0')
     commission_amount = total_sales * (commission_percentage / Decimal('100'))
     # Get all commissions for manager's employees for this month
-    commissions = Commission.objects.filter(employee__in=employees, sale__created_at__year=year, sale__created_at__month=month)
+    commissions = Commission.objects.filter(employee__in=employees, **in_period('sale__created_at', period))
     # Unpaid commission for manager: total commission - paid to manager
     unpaid_commission = commission_amount
     # Manager commission payments for this month
     from .models import ManagerCommissionPayment
     commission_payments = ManagerCommissionPayment.objects.filter(
-        manager=manager, paid_at__year=year, paid_at__month=month
+        manager=manager, **in_period('paid_at', period)
     ).order_by('-paid_at')
     paid_total = commission_payments.aggregate(total=models.Sum('amount'))['total'] or Decimal('0')
     unpaid_commission -= paid_total
@@ -2648,7 +3097,7 @@ def manager_detail(request, pk):
     # Employees sales summary
     employees_summary = []
     for emp in employees:
-        emp_sales = Sale.objects.filter(employee=emp, created_at__year=year, created_at__month=month)
+        emp_sales = Sale.objects.filter(employee=emp, **in_period('created_at', period))
         emp_sales_total = emp_sales.aggregate(total=models.Sum('total'))['total'] or Decimal('0')
         employees_summary.append({
             'name': emp.name,
@@ -2686,16 +3135,16 @@ def manager_commission_pay(request, manager_id):
     # Calculate unpaid commission for current month/year
     from datetime import date
     today = date.today()
-    month = int(request.GET.get('month', today.month))
-    year = int(request.GET.get('year', today.year))
+    month, year = _selected_month(request, today)
     # Get total sales for manager's employees
     employees = manager.employees.all()
-    sales = Sale.objects.filter(employee__in=employees, created_at__year=year, created_at__month=month)
+    period = month_range(year, month)
+    sales = Sale.objects.filter(employee__in=employees, **in_period('created_at', period))
     total_sales = sales.aggregate(total=models.Sum('total'))['total'] or Decimal('0')
     commission_percentage = manager.commission_percentage or Decimal('0')
     commission_amount = total_sales * (commission_percentage / Decimal('100'))
     commission_payments = ManagerCommissionPayment.objects.filter(
-        manager=manager, paid_at__year=year, paid_at__month=month
+        manager=manager, **in_period('paid_at', period)
     )
     paid_total = commission_payments.aggregate(total=models.Sum('amount'))['total'] or Decimal('0')
     unpaid_commission = commission_amount - paid_total
@@ -2711,3 +3160,66 @@ def manager_commission_pay(request, manager_id):
     ManagerCommissionPayment.objects.create(manager=manager, amount=amount, note=note)
     messages.success(request, f"تم تسجيل دفعة عمولة للمدير بمبلغ {amount} بنجاح.")
     return redirect('panel:manager_detail', pk=manager.pk)
+
+# --- Performance stats (panel/perf.py, collected by PerfMiddleware) ---
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import Http404, HttpResponse, HttpResponseForbidden
+
+@staff_member_required
+def perf_stats(request):
+    from . import perf
+    if request.method == 'POST' and request.POST.get('action') == 'reset':
+        perf.reset_all()
+        messages.success(request, "تم تصفير إحصائيات الأداء.")
+        return redirect('panel:perf_stats')
+    return render(request, 'panel/perf_stats.html', {
+        'rows': perf.rows(perf.collect()),
+        'enabled': getattr(settings, 'PERF_ENABLED', True),
+        "active_sidebar": "perf"
+    })
+
+def perf_metrics(request):
+    """
+    Prometheus scrape endpoint. Staff sessions, or `Authorization: Bearer
+    <PERF_METRICS_TOKEN>` for the scraper.
+    """
+    from . import perf
+    token = getattr(settings, 'PERF_METRICS_TOKEN', '')
+    authorized = request.user.is_active and request.user.is_staff
+    if not authorized and token:
+        authorized = request.headers.get('Authorization', '') == f'Bearer {token}'
+    if not authorized:
+        return HttpResponseForbidden()
+    return HttpResponse(perf.prometheus_text(perf.collect()), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+# --- On-demand profiles (panel/profiling.py, taken by ProfilerMiddleware) ---
+@staff_member_required
+def profile_list(request):
+    from . import profiling
+    return render(request, 'panel/profile_list.html', {
+        'profiles': profiling.list_profiles(),
+        "active_sidebar": "perf"
+    })
+
+@staff_member_required
+def profile_detail(request, profile_id):
+    from . import profiling
+    found = profiling.load(profile_id)
+    if found is None:
+        raise Http404("Profile not found")
+    meta, data_path = found
+    return render(request, 'panel/profile_detail.html', {
+        'profile': meta,
+        'summary': profiling.summary_text(meta, data_path),
+        "active_sidebar": "perf"
+    })
+
+@staff_member_required
+def profile_download(request, profile_id):
+    from . import profiling
+    found = profiling.load(profile_id)
+    if found is None:
+        raise Http404("Profile not found")
+    _, data_path = found
+    return FileResponse(open(data_path, 'rb'), as_attachment=True, filename=data_path.name)
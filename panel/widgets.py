@@ -0,0 +1,50 @@
+from django import forms
+from django.urls import reverse
+
+
+class AutocompleteSelect(forms.Select):
+    """
+    <select> that only renders the currently selected option(s); the rest
+    are fetched on demand from a panel autocomplete endpoint by
+    static/assets/js/autocomplete.js.
+
+    `forward` maps query parameter names to the ids of other inputs whose
+    value is sent along with the search (e.g. {'product': 'id_product'} to
+    restrict batches to the chosen product).
+    """
+    def __init__(self, kind, attrs=None, forward=None, placeholder='ابحث...', select_related=()):
+        super().__init__(attrs)
+        self.kind = kind
+        self.forward = forward or {}
+        self.placeholder = placeholder
+        self.select_related = select_related
+
+    class Media:
+        js = ('assets/js/autocomplete.js',)
+
+    def build_attrs(self, base_attrs, extra_attrs=None):
+        attrs = super().build_attrs(base_attrs, extra_attrs)
+        attrs.setdefault('class', 'form-select')
+        attrs['data-autocomplete-url'] = reverse('panel:autocomplete', args=[self.kind])
+        attrs['data-placeholder'] = self.placeholder
+        if self.forward:
+            attrs['data-forward'] = ','.join(f'{param}:{field_id}' for param, field_id in self.forward.items())
+        return attrs
+
+    def optgroups(self, name, value, attrs=None):
+        # Same idea as the admin's AutocompleteSelect: look up only the
+        # selected values instead of iterating the whole queryset.
+        selected = {str(v) for v in value if v not in (None, '')}
+        groups = []
+        if not self.is_required and not self.allow_multiple_selected:
+            groups.append((None, [self.create_option(name, '', '---------', not selected, 0)], 0))
+        if not selected:
+            return groups
+        queryset = self.choices.queryset
+        if self.select_related:
+            queryset = queryset.select_related(*self.select_related)
+        for index, obj in enumerate(queryset.filter(pk__in=selected), start=1):
+            option_value = self.choices.field.prepare_value(obj)
+            label = self.choices.field.label_from_instance(obj)
+            groups.append((None, [self.create_option(name, option_value, label, True, index)], index))
+        return groups